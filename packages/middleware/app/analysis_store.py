@@ -0,0 +1,125 @@
+"""
+Persistent store of `/materials/analyze` results.
+
+Symmetry analysis results are written to a SQLite database
+(ANALYSIS_STORE_PATH, WAL mode) and survive restarts. They are shared by the
+middleware workers and the materials worker processes. Two tables:
+
+- `results`: keyed by a canonical hash of the parsed structure (see
+  `structures.structure_key`), `symprec` and `angle_tolerance`. The same
+  structure written as CIF or POSCAR, with other comments, or with its sites in
+  another order normally hits the same row. A coordinate that happens to round
+  the other way only costs a recomputation. Materials workers check this table
+  before running spglib.
+- `texts`: keyed by the request's cache key (hash of the text, or of an
+  upload) and the tolerances. The middleware checks it before submitting a job
+  at all, so a warm lookup is one indexed SELECT.
+
+Values are the JSON `analyze` output.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+from .config import ANALYSIS_STORE_PATH
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS results ("
+    " structure_key TEXT NOT NULL, symprec REAL NOT NULL, angle_tolerance REAL NOT NULL,"
+    " result TEXT NOT NULL, created REAL NOT NULL,"
+    " PRIMARY KEY (structure_key, symprec, angle_tolerance))",
+    "CREATE TABLE IF NOT EXISTS texts ("
+    " text_key TEXT NOT NULL, symprec REAL NOT NULL, angle_tolerance REAL NOT NULL,"
+    " result TEXT NOT NULL, created REAL NOT NULL,"
+    " PRIMARY KEY (text_key, symprec, angle_tolerance))",
+)
+
+
+class AnalysisStore:
+    def __init__(self, path: Path = ANALYSIS_STORE_PATH):
+        self.path = Path(path)
+        self._local = threading.local()
+        self._schema_ready = False
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "errors": 0}
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per thread and process; materials workers get their own
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            if not self._schema_ready:
+                for statement in _SCHEMA:
+                    conn.execute(statement)
+                self._schema_ready = True
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _get(self, table: str, column: str, key: str, symprec: float, angle_tolerance: float) -> Optional[dict]:
+        try:
+            row = self._connect().execute(
+                f"SELECT result FROM {table} WHERE {column} = ? AND symprec = ? AND angle_tolerance = ?",
+                (key, symprec, angle_tolerance),
+            ).fetchone()
+        except sqlite3.Error as e:
+            # The store only saves time; a broken database must not fail the request
+            self.stats["errors"] += 1
+            logger.warning(f"Analysis store lookup failed: {e}")
+            return None
+        if row is None:
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        return json.loads(row[0])
+
+    def _put(self, table: str, column: str, key: str, symprec: float, angle_tolerance: float, result: dict):
+        try:
+            self._connect().execute(
+                f"INSERT OR REPLACE INTO {table} ({column}, symprec, angle_tolerance, result, created) VALUES (?, ?, ?, ?, ?)",
+                (key, symprec, angle_tolerance, json.dumps(result), time.time()),
+            )
+            self.stats["writes"] += 1
+        except sqlite3.Error as e:
+            self.stats["errors"] += 1
+            logger.warning(f"Analysis store write failed: {e}")
+
+    def get(self, structure_key: str, symprec: float, angle_tolerance: float) -> Optional[dict]:
+        """Result for a canonical structure hash, or None."""
+        return self._get("results", "structure_key", structure_key, symprec, angle_tolerance)
+
+    def put(self, structure_key: str, symprec: float, angle_tolerance: float, result: dict):
+        self._put("results", "structure_key", structure_key, symprec, angle_tolerance, result)
+
+    def get_text(self, text_key: str, symprec: float, angle_tolerance: float) -> Optional[dict]:
+        """Result for a structure-cache key (text or upload digest), or None."""
+        return self._get("texts", "text_key", text_key, symprec, angle_tolerance)
+
+    def put_text(self, text_key: str, symprec: float, angle_tolerance: float, result: dict):
+        self._put("texts", "text_key", text_key, symprec, angle_tolerance, result)
+
+    def info(self) -> dict:
+        try:
+            conn = self._connect()
+            counts = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in ("results", "texts")}
+        except sqlite3.Error as e:
+            counts = {"error": str(e)}
+        return {"path": str(self.path), **counts, **self.stats}
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+analysis_store = AnalysisStore()
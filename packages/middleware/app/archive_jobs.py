@@ -0,0 +1,135 @@
+"""
+Background archive/cleanup queue.
+
+Request handlers never move or delete workspace trees themselves. They detach
+the tree with a cheap rename (`services.detach_dir`) and submit an
+`ArchiveJob`; a small thread pool then moves it into the archive and removes
+leftovers. Job status is exposed through `routers/archive.py`.
+"""
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+from .config import ARCHIVE_WORKERS, ARCHIVE_JOB_HISTORY, ARCHIVE_STAGING_DIR, INPUTS_DIR, OUTPUTS_DIR, TEMP_DIR
+from .services import DISCARD_SUFFIX, archive_workspace, detach_dir, detach_root_files, remove_tree
+
+logger = logging.getLogger(__name__)
+
+
+class ArchiveJob:
+    def __init__(self, source: Optional[Path], label: Optional[str], remove: Iterable[Path]):
+        self.id = f"job_{uuid.uuid4().hex[:10]}"
+        self.source = source
+        self.label = label
+        self.remove = list(remove)
+        self.status = "queued"
+        self.archive_path: Optional[Path] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "label": self.label,
+            "source": str(self.source) if self.source else None,
+            "archive_path": str(self.archive_path) if self.archive_path else None,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class ArchiveQueue:
+    def __init__(self, max_workers: int = ARCHIVE_WORKERS, history: int = ARCHIVE_JOB_HISTORY):
+        self.max_workers = max_workers
+        self.history = history
+        self._jobs: "OrderedDict[str, ArchiveJob]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="archive")
+
+    def submit(self, source: Optional[Path], label: Optional[str] = None, remove: Iterable[Path] = ()) -> ArchiveJob:
+        """Archive `source` (an outputs tree) and then delete every path in `remove`."""
+        job = ArchiveJob(source, label, remove)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._trim()
+        self._executor.submit(self._run, job)
+        logger.info(f"Queued archive job {job.id} for {source}")
+        return job
+
+    def _trim(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.status in ("done", "failed")]
+        while len(self._jobs) > self.history and finished:
+            self._jobs.pop(finished.pop(0), None)
+
+    def _run(self, job: ArchiveJob):
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            if job.source is not None and job.source.exists():
+                job.archive_path = archive_workspace(job.source, label=job.label)
+            for path in job.remove:
+                remove_tree(path)
+            job.status = "done"
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            logger.error(f"Archive job {job.id} failed: {e}")
+        finally:
+            job.finished_at = time.time()
+
+    def get(self, job_id: str) -> Optional[ArchiveJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self) -> List[ArchiveJob]:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def pending(self) -> int:
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job.status in ("queued", "running"))
+
+    def recover(self):
+        """Re-queue trees left in the staging area by a previous process.
+
+        Session trees and staged outputs are archived; staged inputs and tmp
+        trees are only deleted.
+        """
+        if not ARCHIVE_STAGING_DIR.exists():
+            return
+        for staged in sorted(ARCHIVE_STAGING_DIR.iterdir()):
+            # Trees staged before the discard suffix existed end in the directory name
+            if staged.name.endswith((DISCARD_SUFFIX, f"_{INPUTS_DIR.name}", f"_{TEMP_DIR.name}")):
+                self.submit(None, label=staged.name, remove=[staged])
+            else:
+                self.submit(staged / "outputs" if (staged / "outputs").is_dir() else staged, label=staged.name, remove=[staged])
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="archive")
+
+
+archive_queue = ArchiveQueue()
+
+
+def schedule_workspace_cleanup() -> Optional[ArchiveJob]:
+    """Non-blocking version of `services.cleanup_workspace` for the shared workspace."""
+    staged_outputs = detach_dir(OUTPUTS_DIR)
+    # Loose files at the workspace root are deleted too, as cleanup_workspace does
+    staged = [
+        p for p in (detach_dir(INPUTS_DIR, discard=True), detach_dir(TEMP_DIR, discard=True), detach_root_files())
+        if p is not None
+    ]
+    if staged_outputs is None and not staged:
+        return None
+    return archive_queue.submit(staged_outputs, remove=staged + ([staged_outputs] if staged_outputs else []))
@@ -0,0 +1,289 @@
+"""
+Content-addressed, compressed archive store for workspace outputs.
+
+Layout under the archive root:
+
+    objects/<h[:2]>/<sha256>.<codec>   compressed chunks (codec: zst, gz or raw)
+    manifests/<archive_id>.json        one manifest per archived session
+
+Files are split into fixed-size chunks and each chunk is stored once, keyed by
+the SHA-256 of its uncompressed bytes, so regenerated trajectories and
+structures cost no extra disk space. Chunks are compressed with zstd when the
+optional `zstandard` package is installed and with gzip otherwise.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .config import ARCHIVE_CHUNK_SIZE, ARCHIVE_MAX_AGE_DAYS, ARCHIVE_MAX_BYTES
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+_CODECS = ("zst", "gz", "raw")
+
+
+def _compress(data: bytes):
+    if zstandard is not None:
+        packed, codec = zstandard.ZstdCompressor(level=3).compress(data), "zst"
+    else:
+        packed, codec = gzip.compress(data, compresslevel=6, mtime=0), "gz"
+    if len(packed) >= len(data):
+        return data, "raw"
+    return packed, codec
+
+
+def _decompress(data: bytes, codec: str) -> bytes:
+    if codec == "zst":
+        if zstandard is None:
+            raise RuntimeError("Archive chunk is zstd-compressed but the 'zstandard' package is not installed")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == "gz":
+        return gzip.decompress(data)
+    return data
+
+
+def _atomic_write(path: Path, data: bytes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class ArchiveStore:
+    def __init__(self, root: Path, chunk_size: int = ARCHIVE_CHUNK_SIZE):
+        self.root = Path(root)
+        self.objects_dir = self.root / "objects"
+        self.manifests_dir = self.root / "manifests"
+        self.chunk_size = chunk_size
+        self._lock = threading.RLock()
+
+    # -- chunks -------------------------------------------------------------
+
+    def _chunk_path(self, digest: str, codec: str) -> Path:
+        return self.objects_dir / digest[:2] / f"{digest}.{codec}"
+
+    def _find_chunk(self, digest: str) -> Optional[Path]:
+        for codec in _CODECS:
+            path = self._chunk_path(digest, codec)
+            if path.exists():
+                return path
+        return None
+
+    def _put_chunk(self, data: bytes) -> Tuple[str, int]:
+        """Store a chunk if it is new. Returns (digest, bytes written)."""
+        digest = hashlib.sha256(data).hexdigest()
+        if self._find_chunk(digest) is not None:
+            return digest, 0
+        packed, codec = _compress(data)
+        _atomic_write(self._chunk_path(digest, codec), packed)
+        return digest, len(packed)
+
+    def _read_chunk(self, digest: str) -> bytes:
+        path = self._find_chunk(digest)
+        if path is None:
+            raise FileNotFoundError(f"Missing archive chunk {digest}")
+        return _decompress(path.read_bytes(), path.suffix[1:])
+
+    # -- manifests ----------------------------------------------------------
+
+    def add_tree(self, source: Path, label: Optional[str] = None) -> dict:
+        """Archive every file under `source` and write a manifest. The source is left in place."""
+        source = Path(source)
+        timestamp = time.strftime("%Y%m%d_%H%M%S")
+        archive_id = f"{timestamp}_{label}" if label else f"{timestamp}_{uuid.uuid4().hex[:6]}"
+        files = []
+        total_size = 0
+        stored_size = 0
+        with self._lock:
+            for path in sorted(p for p in source.rglob("*") if p.is_file() and not p.is_symlink()):
+                st = path.stat()
+                chunks = []
+                with open(path, "rb") as f:
+                    while True:
+                        data = f.read(self.chunk_size)
+                        if not data:
+                            break
+                        digest, written = self._put_chunk(data)
+                        chunks.append(digest)
+                        stored_size += written
+                files.append({
+                    "path": path.relative_to(source).as_posix(),
+                    "size": st.st_size,
+                    "mtime": st.st_mtime,
+                    "mode": st.st_mode & 0o777,
+                    "chunks": chunks,
+                })
+                total_size += st.st_size
+            manifest = {
+                "id": archive_id,
+                "label": label,
+                "created_at": time.time(),
+                "source": str(source),
+                "total_size": total_size,
+                "stored_size": stored_size,
+                "files": files,
+            }
+            manifest_path = self.manifests_dir / f"{archive_id}.json"
+            suffix = 1
+            while manifest_path.exists():
+                manifest["id"] = f"{archive_id}-{suffix}"
+                manifest_path = self.manifests_dir / f"{manifest['id']}.json"
+                suffix += 1
+            _atomic_write(manifest_path, json.dumps(manifest).encode("utf-8"))
+        logger.info(f"Archived {len(files)} files ({total_size} bytes, {stored_size} new bytes stored) as {manifest['id']}")
+        return manifest
+
+    def get_manifest(self, archive_id: str) -> Optional[dict]:
+        if "/" in archive_id or "\\" in archive_id or archive_id.startswith("."):
+            return None
+        path = self.manifests_dir / f"{archive_id}.json"
+        if not path.exists():
+            return None
+        return json.loads(path.read_text(encoding="utf-8"))
+
+    def list(self) -> List[dict]:
+        """Summaries of every archived run, oldest first."""
+        runs = []
+        if not self.manifests_dir.exists():
+            return runs
+        for path in self.manifests_dir.glob("*.json"):
+            try:
+                manifest = json.loads(path.read_text(encoding="utf-8"))
+            except Exception as e:
+                logger.error(f"Unreadable archive manifest {path}: {e}")
+                continue
+            runs.append({
+                "id": manifest["id"],
+                "label": manifest.get("label"),
+                "created_at": manifest["created_at"],
+                "num_files": len(manifest["files"]),
+                "total_size": manifest["total_size"],
+                "stored_size": manifest.get("stored_size"),
+            })
+        runs.sort(key=lambda r: r["created_at"])
+        return runs
+
+    def file_entry(self, archive_id: str, file_path: str) -> Optional[dict]:
+        manifest = self.get_manifest(archive_id)
+        if manifest is None:
+            return None
+        for entry in manifest["files"]:
+            if entry["path"] == file_path:
+                return entry
+        return None
+
+    def iter_file(self, entry: dict) -> Iterator[bytes]:
+        """Yield the decompressed contents of a manifest file entry chunk by chunk."""
+        for digest in entry["chunks"]:
+            yield self._read_chunk(digest)
+
+    def restore(self, archive_id: str, target: Path) -> List[Path]:
+        """Recreate the archived tree under `target`. Returns the restored file paths."""
+        manifest = self.get_manifest(archive_id)
+        if manifest is None:
+            raise FileNotFoundError(f"Unknown archive: {archive_id}")
+        target = Path(target).resolve()
+        restored = []
+        for entry in manifest["files"]:
+            dest = (target / entry["path"]).resolve()
+            if target not in dest.parents:
+                raise ValueError(f"Refusing to restore outside of {target}: {entry['path']}")
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            with open(dest, "wb") as f:
+                for digest in entry["chunks"]:
+                    f.write(self._read_chunk(digest))
+            os.chmod(dest, entry.get("mode", 0o644))
+            os.utime(dest, (entry["mtime"], entry["mtime"]))
+            restored.append(dest)
+        return restored
+
+    def delete(self, archive_id: str, collect: bool = True) -> bool:
+        with self._lock:
+            path = self.manifests_dir / f"{archive_id}.json"
+            if self.get_manifest(archive_id) is None:
+                return False
+            path.unlink()
+            if collect:
+                self.collect_garbage()
+            return True
+
+    # -- retention ----------------------------------------------------------
+
+    def _objects(self) -> Dict[str, Path]:
+        objects = {}
+        if self.objects_dir.exists():
+            for path in self.objects_dir.glob("*/*"):
+                if path.name.startswith("."):
+                    continue
+                objects[path.name.split(".", 1)[0]] = path
+        return objects
+
+    def collect_garbage(self) -> int:
+        """Delete chunks no manifest refers to. Returns the number of bytes freed."""
+        with self._lock:
+            referenced = set()
+            for path in self.manifests_dir.glob("*.json") if self.manifests_dir.exists() else []:
+                manifest = json.loads(path.read_text(encoding="utf-8"))
+                for entry in manifest["files"]:
+                    referenced.update(entry["chunks"])
+            freed = 0
+            for digest, path in self._objects().items():
+                if digest not in referenced:
+                    freed += path.stat().st_size
+                    path.unlink()
+            return freed
+
+    def disk_usage(self) -> int:
+        return sum(path.stat().st_size for path in self._objects().values())
+
+    def enforce_retention(self, max_age_days: float = ARCHIVE_MAX_AGE_DAYS, max_bytes: int = ARCHIVE_MAX_BYTES) -> List[str]:
+        """Evict the oldest runs until they are younger than `max_age_days` and fit in `max_bytes` (0 disables a limit)."""
+        if not max_age_days and not max_bytes:
+            return []
+        evicted = []
+        with self._lock:
+            runs = self.list()
+            if max_age_days:
+                cutoff = time.time() - max_age_days * 86400
+                while runs and runs[0]["created_at"] < cutoff:
+                    evicted.append(runs.pop(0)["id"])
+                    self.delete(evicted[-1], collect=False)
+            if evicted:
+                self.collect_garbage()
+            if max_bytes:
+                usage = self.disk_usage()
+                # Always keep the newest run, even if it alone exceeds the budget
+                while usage > max_bytes and len(runs) > 1:
+                    evicted.append(runs.pop(0)["id"])
+                    self.delete(evicted[-1], collect=False)
+                    usage -= self.collect_garbage()
+        if evicted:
+            logger.info(f"Archive retention evicted {len(evicted)} runs: {evicted}")
+        return evicted
+
+
+_stores: Dict[Path, ArchiveStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_archive_store(root: Path) -> ArchiveStore:
+    """Return the shared store for an archive root (one instance per root so locks are shared)."""
+    root = Path(root).resolve()
+    with _stores_lock:
+        store = _stores.get(root)
+        if store is None:
+            store = _stores[root] = ArchiveStore(root)
+        return store
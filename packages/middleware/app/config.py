@@ -8,13 +8,154 @@ from pathlib import Path
 BASE_DIR = Path(__file__).resolve().parent.parent.parent
 ROOT_DIR = BASE_DIR.parent
 
-CONFIG_FILE = ROOT_DIR / "config" / "config.json"
+# MIDDLEWARE_CONFIG_FILE and MIDDLEWARE_WORKSPACE_DIR point the middleware at
+# another tree, e.g. a scratch workspace for the benchmarks
+CONFIG_FILE = Path(os.getenv("MIDDLEWARE_CONFIG_FILE", str(ROOT_DIR / "config" / "config.json")))
+# Fallback check interval for config.json changes when watchfiles is unavailable (see app/config_service.py)
+CONFIG_POLL_INTERVAL = float(os.getenv("CONFIG_POLL_INTERVAL", "2.0"))
 
-WORKSPACE_DIR = BASE_DIR / "agent-server" / "agentom" / "workspace"
+WORKSPACE_DIR = Path(os.getenv("MIDDLEWARE_WORKSPACE_DIR", str(BASE_DIR / "agent-server" / "agentom" / "workspace")))
 INPUTS_DIR = WORKSPACE_DIR / "inputs"
 LOGS_DIR = WORKSPACE_DIR / "logs"
 OUTPUTS_DIR = WORKSPACE_DIR / "outputs"
 TEMP_DIR = WORKSPACE_DIR / "tmp"
+SESSIONS_DIR = WORKSPACE_DIR / "sessions"
+ARCHIVE_STAGING_DIR = WORKSPACE_DIR / ".archiving"
+# Small persistent middleware state (e.g. app/session_cache.py)
+STATE_DIR = Path(os.getenv("MIDDLEWARE_STATE_DIR", str(BASE_DIR / "middleware" / ".state")))
 
 AGENTOM_BASE_URL = os.getenv("AGENTOM_BASE_URL", "http://localhost:8000")
 APP_NAME = "agentom"
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _env_float(name: str, default):
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return default
+    if value.strip().lower() in ("none", "off"):
+        return None
+    return float(value)
+
+
+# Shared Agentom HTTP client (see app/http_client.py)
+AGENTOM_MAX_CONNECTIONS = int(os.getenv("AGENTOM_MAX_CONNECTIONS", "100"))
+AGENTOM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("AGENTOM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+AGENTOM_KEEPALIVE_EXPIRY = _env_float("AGENTOM_KEEPALIVE_EXPIRY", 30.0)
+AGENTOM_HTTP2 = _env_bool("AGENTOM_HTTP2", False)
+AGENTOM_CONNECT_TIMEOUT = _env_float("AGENTOM_CONNECT_TIMEOUT", 5.0)
+AGENTOM_READ_TIMEOUT = _env_float("AGENTOM_READ_TIMEOUT", 60.0)
+AGENTOM_WRITE_TIMEOUT = _env_float("AGENTOM_WRITE_TIMEOUT", 30.0)
+AGENTOM_POOL_TIMEOUT = _env_float("AGENTOM_POOL_TIMEOUT", 10.0)
+# Streaming /run responses can stay silent while the LLM is thinking, so the
+# read timeout for the stream is disabled unless explicitly configured.
+AGENTOM_STREAM_READ_TIMEOUT = _env_float("AGENTOM_STREAM_READ_TIMEOUT", None)
+
+# /run proxying (see app/run_proxy.py). MAX_CONCURRENT_RUNS is per worker
+# process. The idle timeout aborts a run stream that has sent nothing for
+# that long; "none" disables it.
+MAX_CONCURRENT_RUNS = int(os.getenv("MAX_CONCURRENT_RUNS", "32"))
+RUN_QUEUE_TIMEOUT = float(os.getenv("RUN_QUEUE_TIMEOUT", "10"))
+RUN_IDLE_TIMEOUT = _env_float("RUN_IDLE_TIMEOUT", 900.0)
+RUN_STREAM_BUFFER = int(os.getenv("RUN_STREAM_BUFFER", "64"))
+
+# Known-live Agentom sessions (see app/session_cache.py); a TTL of 0 disables
+# the cache and /run creates the session before every turn again.
+SESSION_CACHE_TTL = float(os.getenv("SESSION_CACHE_TTL", "86400"))
+SESSION_CACHE_MAX = int(os.getenv("SESSION_CACHE_MAX", "100000"))
+
+# State shared between worker processes (see app/state.py): "memory" (single
+# worker), "sqlite" or "redis". A /run holds its session for SESSION_LEASE_TTL
+# seconds at a time, renewed while the run lasts, so a crashed worker cannot
+# block the session for long.
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory").lower()
+STATE_SQLITE_PATH = Path(os.getenv("STATE_SQLITE_PATH", str(STATE_DIR / "state.db")))
+STATE_REDIS_URL = os.getenv("STATE_REDIS_URL", "redis://localhost:6379/0")
+SESSION_LEASE_TTL = float(os.getenv("SESSION_LEASE_TTL", "180"))
+
+# Per-session workspaces (see app/workspace.py)
+WORKSPACE_IDLE_TIMEOUT = float(os.getenv("WORKSPACE_IDLE_TIMEOUT", "3600"))
+WORKSPACE_EVICTION_INTERVAL = float(os.getenv("WORKSPACE_EVICTION_INTERVAL", "60"))
+# Agentom still reads inputs from and writes results to the shared workspace,
+# so sessions use it too (and it is archived when another session starts a
+# run). Set to false once the agent works in the session paths it is given.
+WORKSPACE_SHARED_FALLBACK = _env_bool("WORKSPACE_SHARED_FALLBACK", True)
+
+# Background archive jobs (see app/archive_jobs.py)
+ARCHIVE_WORKERS = int(os.getenv("ARCHIVE_WORKERS", "2"))
+ARCHIVE_JOB_HISTORY = int(os.getenv("ARCHIVE_JOB_HISTORY", "200"))
+
+# Archive storage (see app/archive_store.py). "store" keeps compressed,
+# deduplicated chunks plus a manifest per run; "directory" keeps plain copies.
+ARCHIVE_BACKEND = os.getenv("ARCHIVE_BACKEND", "store").lower()
+ARCHIVE_CHUNK_SIZE = int(os.getenv("ARCHIVE_CHUNK_SIZE", str(4 * 1024 * 1024)))
+ARCHIVE_MAX_AGE_DAYS = float(os.getenv("ARCHIVE_MAX_AGE_DAYS", "0"))
+ARCHIVE_MAX_BYTES = int(os.getenv("ARCHIVE_MAX_BYTES", "0"))
+
+# Workspace file watching and indexes (see app/watcher.py, app/file_index.py)
+WATCH_DEBOUNCE_MS = int(os.getenv("WATCH_DEBOUNCE_MS", "50"))
+FILE_INDEX_TTL = float(os.getenv("FILE_INDEX_TTL", "1.0"))
+FILE_INDEX_RESCAN_INTERVAL = float(os.getenv("FILE_INDEX_RESCAN_INTERVAL", "30"))
+FILE_LISTING_INDEXES = int(os.getenv("FILE_LISTING_INDEXES", "64"))
+
+# Structure push subscriptions (see app/structure_feed.py)
+STRUCTURE_FEED_HISTORY = int(os.getenv("STRUCTURE_FEED_HISTORY", "100"))
+STRUCTURE_PUSH_MAX_BYTES = int(os.getenv("STRUCTURE_PUSH_MAX_BYTES", str(5 * 1024 * 1024)))
+SSE_KEEPALIVE_INTERVAL = float(os.getenv("SSE_KEEPALIVE_INTERVAL", "15"))
+
+# Incremental /get_final_structure updates (see app/structure_diff.py). Distances in Angstrom.
+STRUCTURE_DIFF_TOLERANCE = float(os.getenv("STRUCTURE_DIFF_TOLERANCE", "1e-4"))
+STRUCTURE_DIFF_MATCH_RADIUS = float(os.getenv("STRUCTURE_DIFF_MATCH_RADIUS", "0.5"))
+STRUCTURE_DIFF_MAX_FRACTION = float(os.getenv("STRUCTURE_DIFF_MAX_FRACTION", "0.3"))
+STRUCTURE_DIFF_MAX_BYTES = int(os.getenv("STRUCTURE_DIFF_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# Log streaming (see app/log_tailer.py)
+LOG_POLL_INTERVAL = float(os.getenv("LOG_POLL_INTERVAL", "0.5"))
+LOG_READ_CHUNK = int(os.getenv("LOG_READ_CHUNK", str(256 * 1024)))
+LOG_SUBSCRIBER_QUEUE = int(os.getenv("LOG_SUBSCRIBER_QUEUE", "256"))
+
+# Parsed-structure cache for /materials (see app/structure_cache.py)
+STRUCTURE_CACHE_MAX_BYTES = int(os.getenv("STRUCTURE_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# Symmetry analysis tolerances and the persistent result store (see app/analysis_store.py).
+# ANALYSIS_PRECOMPUTE (off by default) analyzes every structure in OUTPUTS_DIR and the archive in the background at startup.
+ANALYSIS_SYMPREC = float(os.getenv("ANALYSIS_SYMPREC", "0.01"))
+ANALYSIS_ANGLE_TOLERANCE = float(os.getenv("ANALYSIS_ANGLE_TOLERANCE", "5.0"))
+ANALYSIS_STORE_PATH = Path(os.getenv("ANALYSIS_STORE_PATH", str(STATE_DIR / "analysis.db")))
+ANALYSIS_PRECOMPUTE = _env_bool("ANALYSIS_PRECOMPUTE", False)
+
+# Materials worker processes (see app/materials_pool.py). 0 runs jobs in a
+# thread of the middleware process instead.
+MATERIALS_WORKERS = int(os.getenv("MATERIALS_WORKERS", str(min(4, os.cpu_count() or 1))))
+MATERIALS_JOB_TIMEOUT = _env_float("MATERIALS_JOB_TIMEOUT", 120.0)
+MATERIALS_PREWARM = _env_bool("MATERIALS_PREWARM", True)
+# /materials/analyze_batch limits
+MATERIALS_BATCH_MAX_ITEMS = int(os.getenv("MATERIALS_BATCH_MAX_ITEMS", "1000"))
+MATERIALS_BATCH_MAX_FILE_BYTES = int(os.getenv("MATERIALS_BATCH_MAX_FILE_BYTES", str(20 * 1024 * 1024)))
+
+# Trajectory frame serving (see app/trajectory.py)
+TRAJECTORY_BATCH_FRAMES = int(os.getenv("TRAJECTORY_BATCH_FRAMES", "32"))
+TRAJECTORY_INDEX_CACHE = int(os.getenv("TRAJECTORY_INDEX_CACHE", "64"))
+
+# Structure uploads (see app/uploads.py)
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(1024 * 1024 * 1024)))
+UPLOAD_HANDLE_HISTORY = int(os.getenv("UPLOAD_HANDLE_HISTORY", "1000"))
+
+# File downloads (see app/downloads.py). Text files at least this large are
+# compressed on the fly when the client accepts gzip or zstd.
+DOWNLOAD_COMPRESS_MIN_BYTES = int(os.getenv("DOWNLOAD_COMPRESS_MIN_BYTES", "1024"))
+
+# Opt-in record/replay of /run and /send_message responses (see
+# app/response_cache.py). RESPONSE_CACHE_MODE is off, cache (serve recordings,
+# record misses), record (always call Agentom and record) or replay
+# (recordings only; a miss is a 503). RESPONSE_CACHE_PACE is fast or realtime.
+RESPONSE_CACHE_MODE = os.getenv("RESPONSE_CACHE_MODE", "off").lower()
+RESPONSE_CACHE_PACE = os.getenv("RESPONSE_CACHE_PACE", "fast").lower()
+RESPONSE_CACHE_DIR = Path(os.getenv("RESPONSE_CACHE_DIR", str(STATE_DIR / "responses")))
+RESPONSE_CACHE_MAX_RECORDING_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_RECORDING_BYTES", str(64 * 1024 * 1024)))
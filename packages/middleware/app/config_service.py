@@ -0,0 +1,196 @@
+"""
+Shared `config/config.json`.
+
+The file is parsed and validated once into an `AppConfig`, and `get()` hands
+out the cached model, so hot paths (archive cleanup, archive endpoints) no
+longer open the file. External edits are picked up by a `watchfiles` watcher
+on the config folder, or, without `watchfiles`, by an mtime check at most
+every CONFIG_POLL_INTERVAL seconds. A file that fails validation is logged and
+ignored; the last good configuration stays in effect.
+
+`update()` validates first, then writes a temporary file and renames it over
+config.json, under a lock, so concurrent writers are serialized and readers
+(including the agent server) never see a half-written file. Subscribers are
+called with the old and new configuration after every change.
+"""
+import asyncio
+import json
+import logging
+import os
+import stat
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Callable, List, Optional
+
+from pydantic import BaseModel, ConfigDict, field_validator
+
+from .config import CONFIG_FILE, CONFIG_POLL_INTERVAL, ROOT_DIR
+
+try:
+    import watchfiles
+except ImportError:  # optional dependency
+    watchfiles = None
+
+logger = logging.getLogger(__name__)
+
+_LOG_LEVELS = ("CRITICAL", "ERROR", "WARNING", "INFO", "DEBUG")
+
+
+class AppConfig(BaseModel):
+    """config.json; keys the middleware does not use are kept as they are."""
+
+    model_config = ConfigDict(extra="allow")
+
+    OUTPUT_ARCHIVE_DIR: str = "./outputs_archive"
+    WORKSPACE_DIR: Optional[str] = None
+    LOG_LEVEL: str = "INFO"
+    LOG_TO_FILE: bool = True
+
+    @field_validator("LOG_LEVEL")
+    @classmethod
+    def _check_log_level(cls, value: str) -> str:
+        if value.upper() not in _LOG_LEVELS:
+            raise ValueError(f"LOG_LEVEL must be one of {', '.join(_LOG_LEVELS)}")
+        return value.upper()
+
+    @property
+    def archive_root(self) -> Path:
+        """OUTPUT_ARCHIVE_DIR; relative paths are taken from the repo root."""
+        p = Path(self.OUTPUT_ARCHIVE_DIR)
+        return p if p.is_absolute() else ROOT_DIR / p
+
+
+Subscriber = Callable[[AppConfig, AppConfig], None]
+
+
+class ConfigService:
+    def __init__(self, path: Path = CONFIG_FILE, poll_interval: float = CONFIG_POLL_INTERVAL):
+        self.path = path
+        self.poll_interval = poll_interval
+        self._config = AppConfig()
+        self._signature = None
+        self._checked_at = 0.0
+        self._lock = threading.RLock()
+        self._subscribers: List[Subscriber] = []
+        self._task: Optional[asyncio.Task] = None
+        self._stop_event: Optional[asyncio.Event] = None
+        self.reload()
+
+    def _stat_signature(self):
+        try:
+            st = self.path.stat()
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def get(self) -> AppConfig:
+        """Current configuration; only re-checks the file when no watcher is running."""
+        if self._task is None and time.monotonic() - self._checked_at >= self.poll_interval:
+            self.reload()
+        return self._config
+
+    def reload(self, force: bool = False) -> AppConfig:
+        """Re-read config.json if it changed since the last load."""
+        with self._lock:
+            self._checked_at = time.monotonic()
+            signature = self._stat_signature()
+            if signature == self._signature and not force:
+                return self._config
+            if signature is None:
+                new = AppConfig()
+            else:
+                try:
+                    with open(self.path, "r") as f:
+                        new = AppConfig.model_validate(json.load(f))
+                except (OSError, ValueError) as e:
+                    # ValidationError is a ValueError; keep the last good configuration
+                    logger.error(f"Ignoring invalid {self.path}: {e}")
+                    self._signature = signature
+                    return self._config
+            self._signature = signature
+            self._apply(new)
+            return new
+
+    def _file_mode(self) -> int:
+        """Permissions of the current config.json, or 0644 minus the umask for a new one."""
+        try:
+            return stat.S_IMODE(os.stat(self.path).st_mode)
+        except FileNotFoundError:
+            umask = os.umask(0)
+            os.umask(umask)
+            return 0o644 & ~umask
+
+    def update(self, data: dict) -> AppConfig:
+        """Validate `data` and atomically replace config.json with it. Raises ValidationError."""
+        new = AppConfig.model_validate(data)
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(prefix=f".{self.path.name}.", suffix=".tmp", dir=self.path.parent)
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump(new.model_dump(exclude_unset=True), f, indent=2)
+                    f.flush()
+                    os.fsync(f.fileno())
+                # mkstemp creates the file 0600; keep config.json readable by Agentom
+                os.chmod(tmp, self._file_mode())
+                os.replace(tmp, self.path)
+            except BaseException:
+                Path(tmp).unlink(missing_ok=True)
+                raise
+            self._signature = self._stat_signature()
+            self._checked_at = time.monotonic()
+            self._apply(new)
+        return new
+
+    def _apply(self, new: AppConfig):
+        old, self._config = self._config, new
+        if old == new:
+            return
+        for subscriber in list(self._subscribers):
+            try:
+                subscriber(old, new)
+            except Exception as e:
+                logger.error(f"Config subscriber failed: {e}")
+
+    def subscribe(self, subscriber: Subscriber):
+        self._subscribers.append(subscriber)
+
+    def unsubscribe(self, subscriber: Subscriber):
+        if subscriber in self._subscribers:
+            self._subscribers.remove(subscriber)
+
+    async def _watch(self):
+        try:
+            async for batch in watchfiles.awatch(self.path.parent, watch_filter=None, stop_event=self._stop_event):
+                if any(Path(p).name == self.path.name for _, p in batch):
+                    await asyncio.to_thread(self.reload)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Config watcher stopped, falling back to mtime checks: {e}")
+        finally:
+            self._task = None
+
+    def start(self):
+        if watchfiles is None or not self.path.parent.is_dir():
+            return
+        if self._task is not None:
+            return
+        self.reload()
+        self._stop_event = asyncio.Event()
+        self._task = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        task = self._task
+        if task is not None:
+            self._stop_event.set()
+            try:
+                await asyncio.wait_for(task, timeout=2)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                pass
+            self._task = None
+
+
+config_service = ConfigService()
@@ -0,0 +1,126 @@
+"""
+Serving workspace files.
+
+`file_response` builds the response for one file:
+
+- plain downloads are a starlette `FileResponse`, which streams the file in
+  chunks (or hands the path to the server via `http.response.pathsend` where
+  supported) and answers `Range`/`If-Range` requests, so nothing is loaded
+  into memory;
+- every response carries an `ETag` derived from inode, size and mtime, and a
+  matching `If-None-Match` gets `304 Not Modified`;
+- text formats (structures, logs, VASP outputs) are compressed on the fly
+  with zstd (optional `zstandard` package) or gzip when the client accepts
+  it and no range was requested. Compression runs chunk by chunk in a worker
+  thread.
+"""
+import asyncio
+import mimetypes
+import os
+import zlib
+from pathlib import Path
+from typing import Optional
+
+from fastapi import Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
+
+from .config import DOWNLOAD_COMPRESS_MIN_BYTES
+from .file_index import STRUCTURE_EXTENSIONS
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+TEXT_EXTENSIONS = STRUCTURE_EXTENSIONS | {".json", ".log", ".txt", ".csv", ".out", ".dat", ".md", ".xml", ".yaml", ".yml"}
+# Extension-less VASP files
+TEXT_NAMES = ("POSCAR", "CONTCAR", "OUTCAR", "OSZICAR", "XDATCAR", "CHGCAR", "CHG", "LOCPOT", "ELFCAR", "DOSCAR", "EIGENVAL", "PROCAR", "INCAR", "KPOINTS")
+
+_CHUNK_SIZE = 1024 * 1024
+
+
+def is_text_file(name: str) -> bool:
+    if os.path.splitext(name)[1].lower() in TEXT_EXTENSIONS:
+        return True
+    return name.upper().startswith(TEXT_NAMES)
+
+
+def file_etag(st: os.stat_result) -> str:
+    return f'"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}"'
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    # Weak comparison; compressed variants carry the same tag with a suffix
+    bare = etag.strip('"')
+    return any(tag.removeprefix("W/").strip('"').split("+")[0] == bare for tag in candidates)
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """Preferred encoding the client accepts: zstd (if available), then gzip."""
+    accepted = {}
+    for part in accept_encoding.lower().split(","):
+        token, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        accepted[token.strip()] = q
+    if zstandard is not None and accepted.get("zstd", 0) > 0:
+        return "zstd"
+    if accepted.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+async def _compressed(path: Path, encoding: str):
+    if encoding == "zstd":
+        compressor = zstandard.ZstdCompressor(level=3).compressobj()
+    else:
+        compressor = zlib.compressobj(1, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def step(f):
+        chunk = f.read(_CHUNK_SIZE)
+        return compressor.compress(chunk) if chunk else None
+
+    f = await asyncio.to_thread(open, path, "rb")
+    try:
+        while True:
+            data = await asyncio.to_thread(step, f)
+            if data is None:
+                break
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        f.close()
+
+
+def file_response(request: Request, path: Path, download: bool = False) -> Response:
+    """Response for `path`, honouring If-None-Match, Range and Accept-Encoding."""
+    st = path.stat()
+    etag = file_etag(st)
+    media_type = "text/plain; charset=utf-8" if is_text_file(path.name) else (mimetypes.guess_type(path.name)[0] or "application/octet-stream")
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if download:
+        headers["Content-Disposition"] = f'attachment; filename="{path.name}"'
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    encoding = None
+    if is_text_file(path.name) and st.st_size >= DOWNLOAD_COMPRESS_MIN_BYTES and "range" not in request.headers:
+        encoding = choose_encoding(request.headers.get("accept-encoding", ""))
+    if encoding is None:
+        return FileResponse(path, media_type=media_type, headers={**headers, "Vary": "Accept-Encoding"}, stat_result=st)
+
+    headers.update({
+        "ETag": f'"{etag[1:-1]}+{encoding}"',
+        "Content-Encoding": encoding,
+        "Vary": "Accept-Encoding",
+    })
+    return StreamingResponse(_compressed(path, encoding), media_type=media_type, headers=headers)
@@ -0,0 +1,194 @@
+"""
+In-memory index of files in a set of workspace directories.
+
+Each index keeps `path -> (mtime, size)` for the files it tracks plus the
+newest entry, so "latest structure file" lookups are O(1). The index is kept
+current by the workspace watcher; a full `os.scandir` pass (reusing the
+directory entries' stat results) runs on first use, whenever the watcher is
+unavailable and the entries are older than FILE_INDEX_TTL, and every
+FILE_INDEX_RESCAN_INTERVAL seconds as a safety net for missed events.
+
+Listeners registered with `add_listener` are called with `(path, mtime, size)`
+for every file that appears or changes after the first scan.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from .config import FILE_INDEX_TTL, FILE_INDEX_RESCAN_INTERVAL, FILE_LISTING_INDEXES
+from .watcher import workspace_watcher
+
+logger = logging.getLogger(__name__)
+
+STRUCTURE_EXTENSIONS = frozenset({".cif", ".poscar", ".extxyz", ".vasp", ".xyz", ".pdb"})
+
+
+def is_structure_file(name: str) -> bool:
+    return os.path.splitext(name)[1].lower() in STRUCTURE_EXTENSIONS
+
+
+class FileIndex:
+    def __init__(self, dirs: Iterable[Path], match: Optional[Callable[[str], bool]] = None):
+        self.dirs = [os.path.abspath(d) for d in dirs]
+        self._dir_set = set(self.dirs)
+        self.match = match or (lambda name: True)
+        self._entries: Dict[str, Tuple[float, int]] = {}
+        self._latest: Optional[Tuple[float, str]] = None
+        self._scanned_at = 0.0
+        self._lock = threading.Lock()
+        self._listeners: List[Callable[[Path, float, int], None]] = []
+        workspace_watcher.subscribe(self._on_changes)
+
+    def close(self):
+        workspace_watcher.unsubscribe(self._on_changes)
+        self._listeners.clear()
+
+    def add_listener(self, listener: Callable[[Path, float, int], None]):
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[Path, float, int], None]):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def _notify(self, changed: List[Tuple[str, float, int]]):
+        for path, mtime, size in changed:
+            for listener in list(self._listeners):
+                try:
+                    listener(Path(path), mtime, size)
+                except Exception as e:
+                    logger.error(f"File index listener failed: {e}")
+
+    # -- maintenance --------------------------------------------------------
+
+    def _recompute_latest(self):
+        if self._entries:
+            path, (mtime, _) = max(self._entries.items(), key=lambda item: item[1][0])
+            self._latest = (mtime, path)
+        else:
+            self._latest = None
+
+    def rescan(self):
+        """Rebuild the index with one scandir pass per directory."""
+        entries = {}
+        for d in self.dirs:
+            try:
+                with os.scandir(d) as it:
+                    for entry in it:
+                        if not self.match(entry.name):
+                            continue
+                        try:
+                            if not entry.is_file():
+                                continue
+                            st = entry.stat()
+                        except OSError:
+                            continue
+                        entries[entry.path] = (st.st_mtime, st.st_size)
+            except FileNotFoundError:
+                continue
+        with self._lock:
+            changed = []
+            if self._scanned_at != 0.0:
+                changed = [(path, mtime, size) for path, (mtime, size) in entries.items()
+                           if self._entries.get(path, (None,))[0] != mtime]
+            self._entries = entries
+            self._recompute_latest()
+            self._scanned_at = time.monotonic()
+        self._notify(sorted(changed, key=lambda item: item[1]))
+
+    def _ensure_fresh(self):
+        age = time.monotonic() - self._scanned_at
+        limit = FILE_INDEX_RESCAN_INTERVAL if workspace_watcher.available else FILE_INDEX_TTL
+        if self._scanned_at == 0.0 or age >= limit:
+            self.rescan()
+
+    def _on_changes(self, changes):
+        changed = []
+        with self._lock:
+            for kind, path in changes:
+                if os.path.dirname(path) not in self._dir_set or not self.match(os.path.basename(path)):
+                    continue
+                try:
+                    st = os.stat(path) if kind != "deleted" else None
+                except OSError:
+                    st = None
+                if st is None or not os.path.isfile(path):
+                    if self._entries.pop(path, None) is not None and self._latest and self._latest[1] == path:
+                        self._recompute_latest()
+                    continue
+                if self._entries.get(path) == (st.st_mtime, st.st_size):
+                    continue
+                self._entries[path] = (st.st_mtime, st.st_size)
+                changed.append((path, st.st_mtime, st.st_size))
+                if self._latest is None or st.st_mtime >= self._latest[0]:
+                    self._latest = (st.st_mtime, path)
+                elif self._latest[1] == path:
+                    self._recompute_latest()
+        self._notify(changed)
+
+    # -- queries ------------------------------------------------------------
+
+    def latest(self, since: Optional[float] = None) -> Optional[Tuple[Path, float]]:
+        """Newest tracked file and its mtime, optionally only if modified at or after `since`."""
+        self._ensure_fresh()
+        with self._lock:
+            latest = self._latest
+        if latest is None or (since is not None and latest[0] < since):
+            return None
+        return Path(latest[1]), latest[0]
+
+    def entries(self) -> List[Tuple[Path, float, int]]:
+        """All tracked files as (path, mtime, size), newest first."""
+        self._ensure_fresh()
+        with self._lock:
+            items = list(self._entries.items())
+        items.sort(key=lambda item: item[1][0], reverse=True)
+        return [(Path(path), mtime, size) for path, (mtime, size) in items]
+
+
+_indexes: Dict[Tuple[Tuple[str, ...], Callable], FileIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_structure_index(dirs: Iterable[Path]) -> FileIndex:
+    """Shared structure-file index for a set of directories."""
+    dirs = tuple(os.path.abspath(d) for d in dirs)
+    key = (dirs, is_structure_file)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = FileIndex(dirs, is_structure_file)
+        return index
+
+
+def _any_file(name: str) -> bool:
+    return True
+
+
+_listing_indexes: "OrderedDict[str, FileIndex]" = OrderedDict()
+
+
+def get_listing_index(directory: Path) -> FileIndex:
+    """Index of every file in one directory, for listings. The least recently used are dropped."""
+    directory = os.path.abspath(directory)
+    with _indexes_lock:
+        index = _listing_indexes.get(directory)
+        if index is None:
+            index = _listing_indexes[directory] = FileIndex([directory], _any_file)
+        _listing_indexes.move_to_end(directory)
+        while len(_listing_indexes) > FILE_LISTING_INDEXES:
+            _listing_indexes.popitem(last=False)[1].close()
+        return index
+
+
+def drop_indexes_under(root: Path):
+    """Forget indexes for directories below `root` (e.g. an evicted session workspace)."""
+    root = os.path.abspath(root)
+    with _indexes_lock:
+        for key in [k for k in _indexes if all(d == root or d.startswith(root + os.sep) for d in k[0])]:
+            _indexes.pop(key).close()
+        for key in [d for d in _listing_indexes if d == root or d.startswith(root + os.sep)]:
+            _listing_indexes.pop(key).close()
@@ -0,0 +1,96 @@
+"""Process-wide pooled HTTP client used for every call to the Agentom server."""
+import logging
+from typing import Optional
+
+import httpx
+
+from .config import (
+    AGENTOM_MAX_CONNECTIONS,
+    AGENTOM_MAX_KEEPALIVE_CONNECTIONS,
+    AGENTOM_KEEPALIVE_EXPIRY,
+    AGENTOM_HTTP2,
+    AGENTOM_CONNECT_TIMEOUT,
+    AGENTOM_READ_TIMEOUT,
+    AGENTOM_WRITE_TIMEOUT,
+    AGENTOM_POOL_TIMEOUT,
+    AGENTOM_STREAM_READ_TIMEOUT,
+)
+
+logger = logging.getLogger(__name__)
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _http2_enabled() -> bool:
+    if not AGENTOM_HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        logger.warning("AGENTOM_HTTP2 is set but the 'h2' package is missing; falling back to HTTP/1.1 "
+                       "(install with `pip install httpx[http2]`)")
+        return False
+    return True
+
+
+def default_timeout() -> httpx.Timeout:
+    return httpx.Timeout(
+        connect=AGENTOM_CONNECT_TIMEOUT,
+        read=AGENTOM_READ_TIMEOUT,
+        write=AGENTOM_WRITE_TIMEOUT,
+        pool=AGENTOM_POOL_TIMEOUT,
+    )
+
+
+def stream_timeout() -> httpx.Timeout:
+    """Timeout for long-lived streaming responses such as `/run`."""
+    return httpx.Timeout(
+        connect=AGENTOM_CONNECT_TIMEOUT,
+        read=AGENTOM_STREAM_READ_TIMEOUT,
+        write=AGENTOM_WRITE_TIMEOUT,
+        pool=AGENTOM_POOL_TIMEOUT,
+    )
+
+
+def create_client(http2: Optional[bool] = None) -> httpx.AsyncClient:
+    if http2 is None:
+        http2 = _http2_enabled()
+    limits = httpx.Limits(
+        max_connections=AGENTOM_MAX_CONNECTIONS,
+        max_keepalive_connections=AGENTOM_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=AGENTOM_KEEPALIVE_EXPIRY,
+    )
+    return httpx.AsyncClient(
+        limits=limits,
+        timeout=default_timeout(),
+        http2=http2,
+        headers={"Content-Type": "application/json"},
+    )
+
+
+async def start_client() -> httpx.AsyncClient:
+    """Create the shared client. Called once from the app lifespan."""
+    global _client
+    if _client is None or _client.is_closed:
+        http2 = _http2_enabled()
+        _client = create_client(http2=http2)
+        logger.info(
+            "Agentom client ready (max_connections=%s, keepalive=%s, http2=%s)",
+            AGENTOM_MAX_CONNECTIONS, AGENTOM_MAX_KEEPALIVE_CONNECTIONS, http2,
+        )
+    return _client
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def get_client() -> httpx.AsyncClient:
+    """Return the shared client, creating it lazily if the lifespan hook has not run."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = create_client()
+    return _client
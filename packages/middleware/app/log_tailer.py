@@ -0,0 +1,213 @@
+"""
+Shared tailer for the agent's `*.log` files.
+
+One background task follows every log file in LOGS_DIR, reading each file
+once (in a worker thread) and fanning the new lines out to all `/logs/stream`
+subscribers. It wakes on workspace watcher events and only polls every
+LOG_POLL_INTERVAL seconds when no watcher is available. Files that appear
+later are followed from their first byte, and a file that is replaced or
+truncated (rotation) is re-read from the start.
+
+Each line is identified by `<file name>:<byte offset after the line>`, which
+is used as the SSE event id so clients can resume with `Last-Event-ID`.
+"""
+import asyncio
+import logging
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+from .config import LOGS_DIR, LOG_POLL_INTERVAL, LOG_READ_CHUNK, LOG_SUBSCRIBER_QUEUE
+from .watcher import workspace_watcher
+
+logger = logging.getLogger(__name__)
+
+# (file name, file generation, [(end offset, line), ...]); the generation
+# changes whenever the file is rotated or truncated.
+Batch = Tuple[str, int, List[Tuple[int, str]]]
+
+
+def read_lines(path: Path, start: int, end: Optional[int] = None, chunk: int = LOG_READ_CHUNK) -> Tuple[int, List[Tuple[int, str]]]:
+    """Read complete lines from `start` (up to `end`). Returns the new offset and (end offset, line) pairs."""
+    lines = []
+    with open(path, "rb") as f:
+        f.seek(start)
+        limit = chunk if end is None else max(0, min(chunk, end - start))
+        data = f.read(limit)
+    if not data:
+        return start, lines
+    cut = data.rfind(b"\n")
+    if cut == -1:
+        if len(data) < limit:
+            # Partial line still being written; wait for the rest
+            return start, lines
+        cut = len(data) - 1  # line longer than a whole chunk: emit what we have
+    offset = start
+    for raw in data[:cut + 1].splitlines(keepends=True):
+        offset += len(raw)
+        lines.append((offset, raw.decode("utf-8", errors="replace").rstrip("\r\n")))
+    return offset, lines
+
+
+class LogSubscriber:
+    def __init__(self, positions: Dict[str, Tuple[int, int]]):
+        self.queue: "asyncio.Queue[Batch]" = asyncio.Queue(maxsize=LOG_SUBSCRIBER_QUEUE)
+        # (generation, offset) delivered so far per file
+        self.positions = dict(positions)
+        self.lagged = False
+
+    def offer(self, batch: Batch):
+        if self.lagged:
+            return
+        try:
+            self.queue.put_nowait(batch)
+        except asyncio.QueueFull:
+            # Too slow to keep up: drop the buffer and catch up from disk later
+            self.lagged = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+
+    def accept(self, batch: Batch) -> List[Tuple[int, str]]:
+        """Lines of `batch` this subscriber has not seen yet; advances its position."""
+        name, generation, lines = batch
+        seen_generation, seen_offset = self.positions.get(name, (generation, 0))
+        if seen_generation != generation:
+            seen_offset = 0
+        fresh = [(end, line) for end, line in lines if end > seen_offset]
+        if fresh:
+            self.positions[name] = (generation, fresh[-1][0])
+        return fresh
+
+
+class _FileState:
+    def __init__(self, path: Path, offset: int, inode: int):
+        self.path = path
+        self.offset = offset
+        self.inode = inode
+        self.generation = 0
+
+
+class LogTailer:
+    def __init__(self, logs_dir: Path = LOGS_DIR):
+        self.logs_dir = logs_dir
+        self._files: Dict[str, _FileState] = {}
+        self._subscribers: Set[LogSubscriber] = set()
+        self._dirty: Set[str] = set()
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._subscribers)
+
+    def positions(self) -> Dict[str, Tuple[int, int]]:
+        return {name: (state.generation, state.offset) for name, state in self._files.items()}
+
+    # -- lifecycle ----------------------------------------------------------
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self.logs_dir.mkdir(parents=True, exist_ok=True)
+            # Existing content is history: start tailing at the current end of each file
+            for path in self.logs_dir.glob("*.log"):
+                st = path.stat()
+                self._files[path.name] = _FileState(path, st.st_size, st.st_ino)
+            self._wake = asyncio.Event()
+            workspace_watcher.subscribe(self._on_changes)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        workspace_watcher.unsubscribe(self._on_changes)
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def subscribe(self) -> LogSubscriber:
+        self._ensure_started()
+        subscriber = LogSubscriber(self.positions())
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: LogSubscriber):
+        self._subscribers.discard(subscriber)
+
+    # -- reading ------------------------------------------------------------
+
+    def _on_changes(self, changes):
+        logs_dir = os.path.abspath(self.logs_dir)
+        for _, path in changes:
+            if path.endswith(".log") and os.path.dirname(path) == logs_dir:
+                self._dirty.add(os.path.basename(path))
+                self._wake.set()
+
+    async def _run(self):
+        while True:
+            timeout = LOG_POLL_INTERVAL if not workspace_watcher.available else max(LOG_POLL_INTERVAL, 5.0)
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                # Poll (no watcher) or periodic safety net: look at every file
+                self._dirty.update(p.name for p in self.logs_dir.glob("*.log"))
+            self._wake.clear()
+            dirty, self._dirty = self._dirty, set()
+            for name in sorted(dirty):
+                try:
+                    await self._read_file(name)
+                except Exception as e:
+                    logger.error(f"Failed to tail log {name}: {e}")
+
+    async def _read_file(self, name: str):
+        path = self.logs_dir / name
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            self._files.pop(name, None)
+            return
+        state = self._files.get(name)
+        if state is None:
+            # New file: follow it from the beginning
+            state = self._files[name] = _FileState(path, 0, st.st_ino)
+        elif st.st_ino != state.inode or st.st_size < state.offset:
+            logger.info(f"Log {name} was rotated or truncated; restarting from the beginning")
+            state.offset, state.inode = 0, st.st_ino
+            state.generation += 1
+        while state.offset < st.st_size:
+            state.offset, lines = await asyncio.to_thread(read_lines, path, state.offset)
+            if not lines:
+                break
+            batch = (name, state.generation, lines)
+            for subscriber in list(self._subscribers):
+                subscriber.offer(batch)
+
+    def resume_positions(self, subscriber: LogSubscriber, name: str, offset: int):
+        """Rewind a subscriber to `offset` in `name` (from a Last-Event-ID)."""
+        state = self._files.get(name)
+        if state is None:
+            return
+        if offset > state.offset:
+            # The file is shorter than the client's position: it was rotated meanwhile
+            offset = 0
+        subscriber.positions[name] = (state.generation, offset)
+
+    async def catch_up(self, subscriber: LogSubscriber) -> List[Batch]:
+        """Read from disk whatever the tailer has passed since the subscriber's positions."""
+        batches = []
+        for name, state in list(self._files.items()):
+            generation, end = state.generation, state.offset
+            seen_generation, start = subscriber.positions.get(name, (generation, 0))
+            if seen_generation != generation:
+                start = 0
+            while start < end:
+                offset, lines = await asyncio.to_thread(read_lines, state.path, start, end)
+                if not lines:
+                    break
+                batches.append((name, generation, lines))
+                start = offset
+        return batches
+
+
+log_tailer = LogTailer()
@@ -1,9 +1,22 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
+import asyncio
 import logging
-from .routers import agent, files, logs, config, materials
-from .services import archive_workspace, cleanup_workspace
+from .routers import agent, files, logs, config, materials, archive, trajectory, uploads, metrics
+from .archive_jobs import archive_queue, schedule_workspace_cleanup
+from .http_client import start_client, close_client
+from .workspace import workspace_manager
+from .watcher import workspace_watcher
+from .log_tailer import log_tailer
+from .metrics import MetricsMiddleware
+from .materials_pool import materials_pool
+from .session_cache import session_cache
+from .config_service import config_service
+from .config import ANALYSIS_PRECOMPUTE
+from .analysis_store import analysis_store
+from .state import state
+from .services import ensure_workspace_dirs
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -11,11 +24,38 @@ logger = logging.getLogger(__name__)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup logic (if any)
+    # Startup logic
+    await start_client()
+    config_service.start()
+    ensure_workspace_dirs()
+    workspace_watcher.start()
+    await asyncio.to_thread(workspace_manager.start)
+    if workspace_manager.leader:
+        # Only one worker re-queues archive jobs left over from a previous run
+        archive_queue.recover()
+    materials_pool.start()
+    eviction_task = asyncio.create_task(workspace_manager.run_eviction_loop())
+    precompute_task = None
+    if ANALYSIS_PRECOMPUTE and workspace_manager.leader:
+        # The store is shared, so one worker warming it up is enough
+        precompute_task = asyncio.create_task(materials.precompute_analysis())
     yield
     # Shutdown logic
     logger.info("Shutting down middleware...")
-    cleanup_workspace()
+    eviction_task.cancel()
+    if precompute_task is not None:
+        precompute_task.cancel()
+    await log_tailer.stop()
+    await workspace_watcher.stop()
+    await config_service.stop()
+    await close_client()
+    if await asyncio.to_thread(workspace_manager.shutdown):
+        schedule_workspace_cleanup()
+    archive_queue.shutdown(wait=True)
+    materials_pool.shutdown(wait=True)
+    session_cache.close()
+    analysis_store.close()
+    state.close()
 
 app = FastAPI(
     title="AtomClay Backend", 
@@ -32,12 +72,19 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-route latency histograms for /metrics
+app.add_middleware(MetricsMiddleware)
+
 # Include routers
 app.include_router(agent.router)
 app.include_router(files.router)
 app.include_router(logs.router)
 app.include_router(config.router)
 app.include_router(materials.router)
+app.include_router(archive.router)
+app.include_router(trajectory.router)
+app.include_router(uploads.router)
+app.include_router(metrics.router)
 
 @app.get("/")
 async def root():
@@ -0,0 +1,219 @@
+"""
+Worker processes for pymatgen/spglib work.
+
+Parsing and symmetry analysis are CPU-bound and hold the GIL, so running them
+in a request handler stalls every other endpoint (SSE streams, /run proxying)
+for as long as a large structure takes. `MaterialsPool` runs them in a
+`ProcessPoolExecutor` instead:
+
+- workers are started with `spawn` and import pymatgen once in their
+  initializer, and `start()` submits warm-up jobs so the first real request
+  does not pay for the import (MATERIALS_PREWARM). The middleware process
+  itself never imports pymatgen unless jobs run in its threads, and then
+  the warm-up imports it in the background after startup;
+- every job has a timeout (MATERIALS_JOB_TIMEOUT). A job that is still queued
+  is cancelled; a job that is already running cannot be interrupted, so the
+  pool is replaced and the old workers are terminated. Other jobs that were
+  queued or running in the old pool are resubmitted to the new one (within
+  their own deadline) instead of failing;
+- a request that is cancelled (client gone, server shutting down) cancels its
+  job if it has not started yet.
+
+With MATERIALS_WORKERS=0 jobs run in a thread of the middleware process,
+which keeps the event loop responsive but still competes for the GIL.
+"""
+import asyncio
+import logging
+import multiprocessing
+import threading
+import time
+import weakref
+from concurrent.futures import BrokenExecutor, Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from .config import MATERIALS_JOB_TIMEOUT, MATERIALS_PREWARM, MATERIALS_WORKERS
+from .metrics import materials_job_seconds
+
+logger = logging.getLogger(__name__)
+
+# Times a job is resubmitted after the pool it was in was replaced
+_MAX_RESUBMITS = 2
+
+
+class MaterialsJobTimeout(Exception):
+    pass
+
+
+class MaterialsPoolUnavailable(Exception):
+    pass
+
+
+def _init_worker():
+    # Pay for the pymatgen/spglib import once per worker, not per job
+    from .structures import preload
+
+    preload()
+
+
+def _ping() -> bool:
+    return True
+
+
+class MaterialsPool:
+    def __init__(self, workers: int = MATERIALS_WORKERS, timeout: Optional[float] = MATERIALS_JOB_TIMEOUT):
+        self.workers = workers
+        self.timeout = timeout
+        self._executor: Optional[Executor] = None
+        # Pools replaced by `_restart`; their jobs are resubmitted
+        self._replaced: "weakref.WeakSet[Executor]" = weakref.WeakSet()
+        self._lock = threading.Lock()
+        self.stats = {"submitted": 0, "completed": 0, "failed": 0, "cancelled": 0, "timeouts": 0, "restarts": 0}
+        self.inflight = 0
+
+    @property
+    def uses_processes(self) -> bool:
+        return self.workers > 0
+
+    def _create_executor(self) -> Executor:
+        if not self.uses_processes:
+            return ThreadPoolExecutor(max_workers=4, thread_name_prefix="materials")
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+        )
+
+    def _get_executor(self) -> Executor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = self._create_executor()
+            return self._executor
+
+    def start(self):
+        """Create the pool and, if enabled, warm up every worker in the background."""
+        executor = self._get_executor()
+        if not MATERIALS_PREWARM:
+            return
+        if self.uses_processes:
+            for _ in range(self.workers):
+                executor.submit(_ping)
+            logger.info(f"Warming up {self.workers} materials worker(s)")
+        else:
+            from .structures import preload
+
+            executor.submit(preload)
+            logger.info("Importing the materials libraries in the background")
+
+    def _restart(self, broken: Executor):
+        """Replace `broken` with a fresh pool and kill its workers."""
+        with self._lock:
+            if self._executor is not broken:
+                return  # someone else already restarted it
+            self._executor = None
+            self._replaced.add(broken)
+            self.stats["restarts"] += 1
+        logger.warning("Restarting materials worker pool")
+        processes = list((getattr(broken, "_processes", None) or {}).values())
+        for process in processes:
+            process.terminate()
+        broken.shutdown(wait=False, cancel_futures=True)
+        if self.uses_processes and MATERIALS_PREWARM:
+            self.start()
+
+    def _submit(self, fn: Callable[..., Any], args: tuple):
+        executor = self._get_executor()
+        try:
+            return executor, executor.submit(fn, *args)
+        except (BrokenExecutor, RuntimeError):
+            self._restart(executor)
+            executor = self._get_executor()
+            return executor, executor.submit(fn, *args)
+
+    async def run(self, fn: Callable[..., Any], *args, timeout: Optional[float] = None) -> Any:
+        """Run `fn(*args)` in a worker and return its result.
+
+        Raises MaterialsJobTimeout when the job exceeds `timeout` (default
+        MATERIALS_JOB_TIMEOUT) and MaterialsPoolUnavailable when its worker
+        kept dying. A job lost because the pool was replaced for another job
+        is resubmitted. Exceptions raised by `fn` propagate unchanged.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        self.stats["submitted"] += 1
+        self.inflight += 1
+        job = getattr(fn, "__name__", str(fn))
+        started = time.monotonic()
+        outcome = "failed"
+        resubmits = 0
+        try:
+            while True:
+                executor, future = self._submit(fn, args)
+                remaining = None if timeout is None else max(0.0, timeout - (time.monotonic() - started))
+                waiter = asyncio.wrap_future(future)
+                try:
+                    # asyncio.wait does not raise when the job is cancelled, so a
+                    # CancelledError here always comes from our caller
+                    done, _ = await asyncio.wait({waiter}, timeout=remaining)
+                except asyncio.CancelledError:
+                    outcome = "cancelled"
+                    self.stats["cancelled"] += 1
+                    waiter.cancel()  # also cancels the job if it has not started
+                    raise
+                if not done:
+                    outcome = "timeout"
+                    self.stats["timeouts"] += 1
+                    running = not future.cancel()
+                    waiter.cancel()
+                    if running:
+                        # Already running in a worker: the only way to stop it is to kill the worker
+                        self._restart(executor)
+                    raise MaterialsJobTimeout(f"Materials job exceeded {timeout:g}s")
+                if waiter.cancelled():
+                    # Cancelled by the shutdown of its pool, not by our caller
+                    replaced = executor in self._replaced
+                    if replaced and resubmits < _MAX_RESUBMITS:
+                        resubmits += 1
+                        logger.info(f"Resubmitting materials job {job} after its worker pool was replaced")
+                        continue
+                    self.stats["failed"] += 1
+                    raise MaterialsPoolUnavailable(
+                        "Materials worker pool was restarted repeatedly" if replaced else "Materials worker pool was shut down")
+                try:
+                    result = waiter.result()
+                    break
+                except BrokenExecutor as e:
+                    self._restart(executor)
+                    if resubmits < _MAX_RESUBMITS:
+                        resubmits += 1
+                        logger.info(f"Resubmitting materials job {job} after its worker pool was replaced")
+                        continue
+                    outcome = "worker_died"
+                    self.stats["failed"] += 1
+                    raise MaterialsPoolUnavailable(f"Materials worker died: {e}")
+                except Exception:
+                    self.stats["failed"] += 1
+                    raise
+            outcome = "completed"
+        finally:
+            self.inflight -= 1
+            materials_job_seconds.observe(time.monotonic() - started, job=job, outcome=outcome)
+        self.stats["completed"] += 1
+        logger.debug(f"Materials job {job} took {time.monotonic() - started:.3f}s")
+        return result
+
+    def info(self) -> dict:
+        return {
+            **self.stats,
+            "workers": self.workers,
+            "mode": "process" if self.uses_processes else "thread",
+            "inflight": self.inflight,
+            "timeout": self.timeout,
+        }
+
+    def shutdown(self, wait: bool = True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+
+
+materials_pool = MaterialsPool()
@@ -0,0 +1,248 @@
+"""
+In-process metrics in the Prometheus text format, served at `/metrics`.
+
+Counters and histograms are updated where things happen: the timing
+middleware (`MetricsMiddleware`, per route), Agentom calls, `services`
+phases, materials jobs and coalesced calls. Gauges that mirror existing state (pool sizes,
+subscribers, caches) and counters kept by other modules since startup
+(`CallbackCounter`, e.g. cache hits) are read through callbacks at scrape
+time, so the hot paths do not pay for them.
+
+Each worker process keeps its own metrics and labels every sample with
+`worker` (its process id); a scrape shows the worker that answered it.
+"""
+import bisect
+import os
+import threading
+import time
+from contextlib import ContextDecorator
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; covers sub-millisecond cache hits up to multi-minute runs
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+_WORKER = str(os.getpid())
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    pairs = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    def samples(self) -> Iterable[Tuple[str, Sequence[str], Sequence[str], float]]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.name, self.labelnames, key, value
+
+
+class _Timer(ContextDecorator):
+    def __init__(self, histogram: "Histogram", labels: Dict[str, str]):
+        self.histogram = histogram
+        self.labels = labels
+
+    def _recreate_cm(self):
+        # Used as a decorator: a fresh timer per call, so concurrent calls do not share a start time
+        return _Timer(self.histogram, self.labels)
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [bucket counts..., sum, count]
+        self._values: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            if index < len(self.buckets):
+                state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def time(self, **labels) -> _Timer:
+        """Context manager / decorator observing the elapsed seconds."""
+        return _Timer(self, labels)
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(state)) for key, state in self._values.items()]
+        names = self.labelnames + ("le",)
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                yield f"{self.name}_bucket", names, key + (_format_value(bound),), cumulative
+            yield f"{self.name}_bucket", names, key + ("+Inf",), state[-1]
+            yield f"{self.name}_sum", self.labelnames, key, state[-2]
+            yield f"{self.name}_count", self.labelnames, key, state[-1]
+
+
+class Gauge(_Metric):
+    """Value read from `callback` at scrape time; it returns a number or {label values: number}."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, callback: Callable[[], object], labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self.callback = callback
+
+    def samples(self):
+        value = self.callback()
+        if isinstance(value, dict):
+            for key, v in value.items():
+                yield self.name, self.labelnames, key if isinstance(key, tuple) else (key,), v
+        elif value is not None:
+            yield self.name, self.labelnames, (), value
+
+
+class CallbackCounter(Gauge):
+    """Like `Gauge`, for totals that only go up (stats another module keeps since startup)."""
+
+    kind = "counter"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            try:
+                samples = list(metric.samples())
+            except Exception as e:  # a broken callback must not break the scrape
+                lines.append(f"# {metric.name} unavailable: {e}")
+                continue
+            lines.extend(metric.header())
+            for name, labelnames, values, value in samples:
+                labels = _format_labels(("worker",) + tuple(labelnames), (_WORKER,) + tuple(values))
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+http_request_seconds = Histogram(
+    "http_request_duration_seconds", "Time until the response was fully sent, per route", ("method", "route", "status"))
+http_first_byte_seconds = Histogram(
+    "http_response_first_byte_seconds", "Time until response headers were sent, per route", ("method", "route"))
+agentom_request_seconds = Histogram(
+    "agentom_request_duration_seconds", "Agentom calls until response headers", ("call", "outcome"))
+agentom_run_first_byte_seconds = Histogram(
+    "agentom_run_first_byte_seconds", "Time from sending /run upstream to its first body chunk")
+agentom_run_stream_seconds = Histogram(
+    "agentom_run_stream_seconds", "Total duration of proxied /run streams", ("outcome",))
+services_phase_seconds = Histogram(
+    "services_phase_duration_seconds", "Workspace service phases (archive, cleanup, persist, scan)", ("phase",))
+materials_job_seconds = Histogram(
+    "materials_job_duration_seconds", "Materials jobs from submission to result", ("job", "outcome"))
+singleflight_calls = Counter(
+    "singleflight_calls_total", "Calls that ran (leader) or waited for an identical call in flight (coalesced)", ("name", "result"))
+response_cache_requests = Counter(
+    "response_cache_requests_total", "Response cache lookups (hit, miss) and stored recordings (recorded)", ("route", "result"))
+
+
+class MetricsMiddleware:
+    """Times every HTTP request by its route template.
+
+    Plain ASGI (not BaseHTTPMiddleware), so streaming responses pass through
+    untouched and their full duration is measured.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = "500"
+        first_byte: Optional[float] = None
+
+        async def timed_send(message: Message):
+            nonlocal status, first_byte
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+                first_byte = time.perf_counter() - started
+            await send(message)
+
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            route = getattr(scope.get("route"), "path", None) or "<unmatched>"
+            method = scope["method"]
+            if first_byte is not None:
+                http_first_byte_seconds.observe(first_byte, method=method, route=route)
+            http_request_seconds.observe(time.perf_counter() - started, method=method, route=route, status=status)
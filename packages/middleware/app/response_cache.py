@@ -0,0 +1,289 @@
+"""
+Opt-in record/replay cache for `/run` and `/send_message`.
+
+Deterministic conversations (saved demo workflows, regression tests, load
+tests) do not need to reach Agentom and the LLM every time. With
+RESPONSE_CACHE_MODE set, upstream responses are recorded to disk together
+with the time at which each chunk arrived, and identical requests are
+answered from the recording:
+
+- `off` (default): every request goes to Agentom;
+- `cache`: recordings are replayed, misses go to Agentom and are recorded;
+- `record`: every request goes to Agentom and its response is (re)recorded;
+- `replay`: only recordings are served; a miss is answered with 503, so
+  Agentom is never contacted (offline demos and load tests).
+
+A request is keyed by its route, its JSON body without the user and session
+ids, the hash of the input structure, and the keys of the earlier turns of
+the same session. So the third message of a replayed workflow only matches
+the third message of the recorded one, even in a new session. Replays
+rewrite the recorded user and session ids to the current ones and are sent
+as fast as the client reads (RESPONSE_CACHE_PACE=fast) or at the recorded
+pace (`realtime`). Chunks are stored decoded, as sent to the browser (no
+Content-Encoding).
+
+Only responses are replayed; files the agent wrote while the recording was
+made are not recreated.
+"""
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from fastapi.responses import StreamingResponse
+
+from .config import RESPONSE_CACHE_DIR, RESPONSE_CACHE_MAX_RECORDING_BYTES, RESPONSE_CACHE_MODE, RESPONSE_CACHE_PACE
+from .metrics import response_cache_requests
+from .state import state
+
+logger = logging.getLogger(__name__)
+
+MODES = ("off", "cache", "record", "replay")
+PACES = ("fast", "realtime")
+
+# Request fields that differ between otherwise identical turns
+_ID_FIELDS = ("userId", "sessionId", "user_id", "session_id")
+# Turn chains of abandoned sessions age out of the shared state
+_CHAIN_TTL = 7 * 24 * 3600
+# Recording file format; version 1 could hold still-compressed upstream bytes
+_FORMAT = 2
+
+
+class Recording:
+    """Status, media type, the ids of the recorded session, and (seconds since the request, bytes) chunks."""
+
+    def __init__(self, route: str, status: int, media_type: str, ids: Dict[str, str], chunks: Optional[List[Tuple[float, bytes]]] = None):
+        self.route = route
+        self.status = status
+        self.media_type = media_type
+        self.ids = ids
+        self.chunks = chunks if chunks is not None else []
+
+    def body(self) -> bytes:
+        return b"".join(chunk for _, chunk in self.chunks)
+
+    def dumps(self) -> str:
+        meta = {
+            "format": _FORMAT, "route": self.route, "status": self.status, "media_type": self.media_type,
+            "ids": self.ids, "created": time.time(),
+        }
+        lines = [json.dumps(meta)]
+        lines += [json.dumps([round(offset, 4), base64.b64encode(chunk).decode("ascii")]) for offset, chunk in self.chunks]
+        return "\n".join(lines) + "\n"
+
+    @classmethod
+    def loads(cls, text: str) -> "Recording":
+        lines = text.splitlines()
+        meta = json.loads(lines[0])
+        if meta.get("format") != _FORMAT:
+            raise ValueError(f"unsupported recording format {meta.get('format')}")
+        chunks = [(offset, base64.b64decode(data)) for offset, data in map(json.loads, lines[1:])]
+        return cls(meta["route"], meta["status"], meta["media_type"], meta["ids"], chunks)
+
+
+def _rewrite(chunk: bytes, replacements: List[Tuple[bytes, bytes]]) -> bytes:
+    for old, new in replacements:
+        chunk = chunk.replace(old, new)
+    return chunk
+
+
+class _StreamRewriter:
+    """Applies `_rewrite` to a chunked stream, including ids split across chunks.
+
+    The end of each chunk that could be the start of a recorded id is held back
+    and sent with the next chunk.
+    """
+
+    def __init__(self, replacements: List[Tuple[bytes, bytes]]):
+        self.replacements = replacements
+        self.pending = b""
+
+    def _held(self, data: bytes) -> int:
+        held = 0
+        for old, _ in self.replacements:
+            for k in range(min(len(old) - 1, len(data)), held, -1):
+                if data.endswith(old[:k]):
+                    held = k
+                    break
+        return held
+
+    def feed(self, chunk: bytes) -> bytes:
+        if not self.replacements:
+            return chunk
+        data = _rewrite(self.pending + chunk, self.replacements)
+        held = self._held(data)
+        self.pending = data[len(data) - held:] if held else b""
+        return data[:len(data) - held]
+
+    def flush(self) -> bytes:
+        pending, self.pending = self.pending, b""
+        return pending
+
+
+class Recorder:
+    """Collects a live upstream response; `finish` stores it if it completed."""
+
+    def __init__(self, cache: "ResponseCache", key: str, recording: Recording, user_id: str, session_id: str, started: Optional[float] = None):
+        self.cache = cache
+        self.key = key
+        self.recording = recording
+        self.user_id = user_id
+        self.session_id = session_id
+        # perf_counter() when the request was sent upstream; chunk offsets are relative to it
+        self.started = time.perf_counter() if started is None else started
+        self.size = 0
+
+    def add(self, chunk: bytes):
+        if self.size > self.cache.max_recording_bytes:
+            return
+        self.size += len(chunk)
+        self.recording.chunks.append((time.perf_counter() - self.started, chunk))
+
+    async def finish(self, completed: bool):
+        if not completed or self.recording.status != 200:
+            return
+        if self.size > self.cache.max_recording_bytes:
+            logger.info(f"Not recording {self.recording.route} response of more than {self.cache.max_recording_bytes} bytes")
+            return
+        try:
+            await asyncio.to_thread(self.cache.save, self.key, self.recording)
+        except OSError as e:
+            logger.error(f"Could not store recorded {self.recording.route} response: {e}")
+            return
+        response_cache_requests.inc(route=self.recording.route, result="recorded")
+        await asyncio.to_thread(self.cache.advance, self.user_id, self.session_id, self.key)
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        root: Path = RESPONSE_CACHE_DIR,
+        mode: str = RESPONSE_CACHE_MODE,
+        pace: str = RESPONSE_CACHE_PACE,
+        max_recording_bytes: int = RESPONSE_CACHE_MAX_RECORDING_BYTES,
+    ):
+        if mode not in MODES:
+            raise ValueError(f"Unknown RESPONSE_CACHE_MODE: {mode!r} (expected {', '.join(MODES)})")
+        if pace not in PACES:
+            raise ValueError(f"Unknown RESPONSE_CACHE_PACE: {pace!r} (expected {', '.join(PACES)})")
+        self.root = Path(root)
+        self.mode = mode
+        self.pace = pace
+        self.max_recording_bytes = max_recording_bytes
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    @property
+    def reads(self) -> bool:
+        """Whether recordings are served."""
+        return self.mode in ("cache", "replay")
+
+    def _chain_key(self, user_id: str, session_id: str) -> str:
+        return f"responses:chain:{user_id}/{session_id}"
+
+    def key(self, route: str, body: dict, user_id: str, session_id: str, structure_digest: Optional[str] = None) -> str:
+        """Cache key of one turn: route, body without ids, input structure and the session's earlier turns.
+
+        Reads the state backend; call it from a thread (as `lookup`, which reads the recording).
+        """
+        normalized = {k: v for k, v in body.items() if k not in _ID_FIELDS}
+        digest = hashlib.sha256()
+        digest.update(route.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(json.dumps(normalized, sort_keys=True, separators=(",", ":")).encode("utf-8"))
+        digest.update(b"\0")
+        digest.update((structure_digest or "").encode("utf-8"))
+        digest.update(b"\0")
+        digest.update((state.get(self._chain_key(user_id, session_id)) or "").encode("utf-8"))
+        return digest.hexdigest()
+
+    def advance(self, user_id: str, session_id: str, key: str):
+        """Record that the session's turn `key` happened, so the next turn is keyed after it."""
+        state.set(self._chain_key(user_id, session_id), key, ttl=_CHAIN_TTL)
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.jsonl"
+
+    def load(self, key: str) -> Optional[Recording]:
+        try:
+            return Recording.loads(self._path(key).read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, IndexError) as e:
+            logger.error(f"Ignoring unreadable recorded response {key}: {e}")
+            return None
+
+    def save(self, key: str, recording: Recording):
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix=f".{key}.", suffix=".tmp", dir=path.parent)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(recording.dumps())
+            os.replace(tmp, path)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+
+    def lookup(self, route: str, key: str) -> Optional[Recording]:
+        """The recording to serve for `key`, or None if the request has to go upstream."""
+        if not self.reads:
+            return None
+        recording = self.load(key)
+        response_cache_requests.inc(route=route, result="hit" if recording is not None else "miss")
+        return recording
+
+    def recorder(
+        self, route: str, key: str, status: int, media_type: str, user_id: str, session_id: str, started: Optional[float] = None
+    ) -> Recorder:
+        recording = Recording(route, status, media_type, {"userId": user_id, "sessionId": session_id})
+        return Recorder(self, key, recording, user_id, session_id, started)
+
+    def _replacements(self, recording: Recording, user_id: str, session_id: str) -> List[Tuple[bytes, bytes]]:
+        pairs = [(recording.ids.get("sessionId"), session_id), (recording.ids.get("userId"), user_id)]
+        return [(old.encode(), new.encode()) for old, new in pairs if old and old != new]
+
+    async def replay_body(self, recording: Recording, user_id: str, session_id: str, key: str) -> bytes:
+        """Whole body of a recording for the current session, after the recorded delay in realtime pace."""
+        if self.pace == "realtime" and recording.chunks:
+            await asyncio.sleep(recording.chunks[-1][0])
+        await asyncio.to_thread(self.advance, user_id, session_id, key)
+        return _rewrite(recording.body(), self._replacements(recording, user_id, session_id))
+
+    async def replay_stream(self, recording: Recording, user_id: str, session_id: str, key: str) -> StreamingResponse:
+        """Streaming response replaying a recording for the current session."""
+        rewriter = _StreamRewriter(self._replacements(recording, user_id, session_id))
+        realtime = self.pace == "realtime"
+
+        async def chunks():
+            started = time.perf_counter()
+            for offset, chunk in recording.chunks:
+                if realtime:
+                    delay = offset - (time.perf_counter() - started)
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                data = rewriter.feed(chunk)
+                if data:
+                    yield data
+            rest = rewriter.flush()
+            if rest:
+                yield rest
+
+        await asyncio.to_thread(self.advance, user_id, session_id, key)
+        return StreamingResponse(
+            chunks(),
+            status_code=recording.status,
+            media_type=recording.media_type,
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "X-Response-Cache": "hit"},
+        )
+
+
+response_cache = ResponseCache()
@@ -1,16 +1,73 @@
 from fastapi import APIRouter, HTTPException
-from fastapi.responses import StreamingResponse
-import requests
+from starlette.concurrency import run_in_threadpool
+import hashlib
 import httpx
+import json
+import time
 import uuid
 import logging
+from typing import Optional
 from ..models import CreateSessionRequest, CreateSessionResponse, SendMessageRequest, SendMessageResponse
-from ..services import check_new_session, persist_structure_file, cleanup_workspace
+from ..services import persist_structure_file
+from ..uploads import UploadGone, place_upload, upload_registry
+from ..workspace import workspace_manager
 from ..config import AGENTOM_BASE_URL, APP_NAME
+from ..http_client import get_client
+from ..metrics import agentom_request_seconds
+from ..response_cache import response_cache
+from ..run_proxy import RunStreamResponse, open_run, run_limiter
+from ..session_cache import session_cache
+from ..singleflight import single_flight
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+async def _agentom_post(client: httpx.AsyncClient, call: str, url: str, payload: dict) -> httpx.Response:
+    """POST to Agentom, recording the call's latency."""
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        response = await client.post(url, json=payload)
+        outcome = str(response.status_code)
+        return response
+    finally:
+        agentom_request_seconds.observe(time.perf_counter() - started, call=call, outcome=outcome)
+
+@single_flight("ensure_session", key=lambda client, session_url, user_id, session_id, state: (user_id, session_id))
+async def _ensure_session(client: httpx.AsyncClient, session_url: str, user_id: str, session_id: str, state: dict):
+    """Create the session in Agentom; an already existing session is fine. Concurrent calls for one session share the request."""
+    try:
+        response = await _agentom_post(client, "ensure_session", session_url, state)
+    except httpx.HTTPError as e:
+        logger.warning(f"Could not create session {session_id} before run: {e!r}")
+        return
+    # Agentom rejects creating a session that already exists with 400/409
+    if response.is_success or response.status_code in (400, 409):
+        await run_in_threadpool(session_cache.mark_live, user_id, session_id)
+    else:
+        logger.warning(f"Creating session {session_id} returned {response.status_code}")
+
+async def _structure_digest(payload: Optional[dict]) -> Optional[str]:
+    """Hash of a run's input structure, for the response cache key."""
+    if not payload:
+        return None
+    if payload.get("handle"):
+        # Same bytes under a new handle are the same input
+        upload = await run_in_threadpool(upload_registry.get, payload["handle"])
+        content = upload.sha256 if upload is not None else payload["handle"]
+        return f"{content}:{payload.get('fileName') or ''}"
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+def _cache_miss(route: str):
+    """In replay mode, requests without a recording are not sent to Agentom."""
+    if response_cache.mode == "replay":
+        raise HTTPException(status_code=503, detail=f"No recorded {route} response for this request (RESPONSE_CACHE_MODE=replay)")
+
+async def _release_run(workspace, claim: str):
+    """Give up the session's run claim and the workspace lease taken by /run."""
+    await run_in_threadpool(workspace_manager.release_session, workspace, claim)
+    workspace_manager.release(workspace)
+
 @router.post("/run")
 async def run_agent(request: dict):
     structure_payload = request.pop("structure", None)
@@ -25,61 +82,108 @@ async def run_agent(request: dict):
     if not user_id or not session_id:
         raise HTTPException(status_code=400, detail="userId and sessionId are required")
 
-    # Detect new session and cleanup
-    check_new_session(session_id)
+    # Recorded responses are replayed without touching the workspace or Agentom
+    cache_key = None
+    if response_cache.enabled:
+        digest = await _structure_digest(structure_payload)
+        cache_key = await run_in_threadpool(response_cache.key, "/run", request, user_id, session_id, digest)
+        recording = await run_in_threadpool(response_cache.lookup, "/run", cache_key)
+        if recording is not None:
+            return await response_cache.replay_stream(recording, user_id, session_id, cache_key)
+        _cache_miss("/run")
 
-    if structure_payload:
-        persist_structure_file(structure_payload)
+    # Each session works in its own workspace tree; hold it for the duration of the run
+    try:
+        workspace = workspace_manager.acquire(user_id, session_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # One run per session at a time, across all workers
+    claim = await run_in_threadpool(workspace_manager.claim_session, workspace)
+    if claim is None:
+        workspace_manager.release(workspace)
+        raise HTTPException(status_code=409, detail=f"A run is already in progress for session {session_id}")
+    workspace.ensure_dirs()
 
-    # First, create the session if not exists
-    session_url = f"{AGENTOM_BASE_URL}/apps/{APP_NAME}/users/{user_id}/sessions/{session_id}"
     try:
-        async with httpx.AsyncClient() as client:
-            await client.post(session_url, json={}, headers={"Content-Type": "application/json"})
-        # Ignore if it already exists or fails, as long as we try
-    except:
-        pass  # Continue anyway
+        if workspace.shared_fallback:
+            # The agent works in the shared tree; clear out the previous session's files
+            await run_in_threadpool(workspace_manager.switch_shared_workspace, workspace)
+        if structure_payload and structure_payload.get("handle"):
+            # Uploaded beforehand through /uploads; link it into this session's inputs
+            upload = await run_in_threadpool(upload_registry.get, structure_payload["handle"])
+            if upload is None:
+                raise HTTPException(status_code=404, detail=f"Upload {structure_payload['handle']} not found")
+            try:
+                await run_in_threadpool(place_upload, upload, workspace.agent_inputs_dir, structure_payload.get("fileName"))
+            except UploadGone as e:
+                raise HTTPException(status_code=410, detail=str(e))
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+        elif structure_payload:
+            await run_in_threadpool(persist_structure_file, structure_payload, workspace.agent_inputs_dir)
+    except Exception:
+        await _release_run(workspace, claim)
+        raise
+
+    # Create the session in Agentom unless it is already known to exist
+    session_url = f"{AGENTOM_BASE_URL}/apps/{APP_NAME}/users/{user_id}/sessions/{session_id}"
+    client = get_client()
+    cached = await run_in_threadpool(session_cache.is_live, user_id, session_id)
+    if not cached:
+        await _ensure_session(client, session_url, user_id, session_id, workspace.agent_state())
 
     # Now forward the /run request to agentom
     url = f"{AGENTOM_BASE_URL}/run"
-    
-    async def stream_generator():
-        async with httpx.AsyncClient() as client:
-            try:
-                async with client.stream("POST", url, json=request, headers={"Content-Type": "application/json"}, timeout=None) as response:
-                    response.raise_for_status()
-                    async for chunk in response.aiter_bytes():
-                        yield chunk
-            except httpx.HTTPStatusError as e:
-                # If we can't raise HTTP exception here easily because headers are sent, 
-                # we might yield an error message or log it. 
-                # But StreamingResponse might have already started.
-                # For now, let's just log or yield a specific error structure if possible.
-                # But since we are proxying, maybe just let it fail.
-                pass
-            except Exception as e:
-                pass
-
     try:
-        return StreamingResponse(stream_generator(), media_type="application/json")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to run agent: {str(e)}")
+        await run_limiter.acquire()
+    except BaseException:
+        await _release_run(workspace, claim)
+        raise
+    started = time.perf_counter()
+    try:
+        try:
+            upstream = await open_run(client, url, request)
+        except HTTPException as e:
+            if e.status_code != 404:
+                raise
+            await run_in_threadpool(session_cache.invalidate, user_id, session_id)
+            if not cached:
+                raise
+            # Agentom lost the session since it was cached (e.g. it restarted)
+            logger.info(f"Session {session_id} is gone from Agentom; creating it again")
+            await _ensure_session(client, session_url, user_id, session_id, workspace.agent_state())
+            upstream = await open_run(client, url, request)
+    except BaseException:
+        run_limiter.release()
+        await _release_run(workspace, claim)
+        raise
+    await run_in_threadpool(session_cache.mark_live, user_id, session_id)
+
+    async def finish():
+        run_limiter.release()
+        await _release_run(workspace, claim)
+
+    recorder = None
+    if cache_key is not None:
+        media_type = upstream.headers.get("content-type", "application/json")
+        recorder = response_cache.recorder("/run", cache_key, upstream.status_code, media_type, user_id, session_id, started)
+    return RunStreamResponse(upstream, on_close=finish, started=started, recorder=recorder)
 
 @router.post("/create_session", response_model=CreateSessionResponse)
 async def create_session(request: CreateSessionRequest):
-    # Cleanup workspace before starting new session
-    cleanup_workspace()
-
     # Generate unique user_id and session_id
     user_id = f"u_{uuid.uuid4().hex[:6]}"
     session_id = f"s_{uuid.uuid4().hex[:6]}"
 
+    # Register the session's workspace; its directories are created on first use
+    workspace = workspace_manager.get(user_id, session_id)
+
     # Call agentom to create session
     url = f"{AGENTOM_BASE_URL}/apps/{APP_NAME}/users/{user_id}/sessions/{session_id}"
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, json={}, headers={"Content-Type": "application/json"})
-            response.raise_for_status()
+        response = await _agentom_post(get_client(), "create_session", url, workspace.agent_state())
+        response.raise_for_status()
+        await run_in_threadpool(session_cache.mark_live, user_id, session_id)
         # Assuming success, return the ids
         return CreateSessionResponse(user_id=user_id, session_id=session_id)
     except httpx.HTTPError as e:
@@ -88,14 +192,30 @@ async def create_session(request: CreateSessionRequest):
 @router.post("/send_message", response_model=SendMessageResponse)
 async def send_message(request: SendMessageRequest):
     url = f"{AGENTOM_BASE_URL}/apps/{APP_NAME}/users/{request.user_id}/sessions/{request.session_id}"
+    # Assuming sending message is POST to the same URL with message
+    data = {"message": request.message}
+    cache_key = None
+    if response_cache.enabled:
+        cache_key = await run_in_threadpool(response_cache.key, "/send_message", data, request.user_id, request.session_id)
+        recording = await run_in_threadpool(response_cache.lookup, "/send_message", cache_key)
+        if recording is not None:
+            body = await response_cache.replay_body(recording, request.user_id, request.session_id, cache_key)
+            return SendMessageResponse(response=body.decode("utf-8"))
+        _cache_miss("/send_message")
+    started = time.perf_counter()
     try:
-        # Assuming sending message is POST to the same URL with message
-        data = {"message": request.message}
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, json=data, headers={"Content-Type": "application/json"})
-            response.raise_for_status()
-            # Assuming the response is JSON with the agent's response
-            result = response.json()
-        return SendMessageResponse(response=result.get("response", str(result)))
+        response = await _agentom_post(get_client(), "send_message", url, data)
+        response.raise_for_status()
+        # Assuming the response is JSON with the agent's response
+        result = response.json()
+        reply = result.get("response", str(result))
+        if cache_key is not None:
+            recorder = response_cache.recorder(
+                "/send_message", cache_key, 200, "text/plain", request.user_id, request.session_id, started)
+            recorder.add(reply.encode("utf-8"))
+            await recorder.finish(True)
+        return SendMessageResponse(response=reply)
     except httpx.HTTPError as e:
+        if isinstance(e, httpx.HTTPStatusError) and e.response.status_code == 404:
+            await run_in_threadpool(session_cache.invalidate, request.user_id, request.session_id)
         raise HTTPException(status_code=500, detail=f"Failed to send message: {str(e)}")
@@ -0,0 +1,116 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool, iterate_in_threadpool
+from pathlib import Path
+from typing import Optional
+import logging
+from ..archive_jobs import archive_queue, schedule_workspace_cleanup
+from ..archive_store import get_archive_store
+from ..services import get_archive_root
+from ..workspace import workspace_manager
+
+router = APIRouter(
+    prefix="/archive",
+    tags=["archive"]
+)
+
+logger = logging.getLogger(__name__)
+
+@router.get("/jobs")
+async def list_archive_jobs():
+    """List recent archive jobs, newest last."""
+    return {"pending": archive_queue.pending(), "jobs": [job.to_dict() for job in archive_queue.list()]}
+
+@router.get("/jobs/{job_id}")
+async def get_archive_job(job_id: str):
+    job = archive_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown archive job: {job_id}")
+    return job.to_dict()
+
+@router.post("/sessions/{user_id}/{session_id}")
+async def archive_session(user_id: str, session_id: str):
+    """Close a session's workspace and archive it in the background."""
+    try:
+        job = await run_in_threadpool(workspace_manager.close, user_id, session_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"job": job.to_dict() if job else None}
+
+@router.post("/workspace")
+async def archive_shared_workspace():
+    """Archive and clear the shared (non-session) workspace in the background."""
+    job = schedule_workspace_cleanup()
+    return {"job": job.to_dict() if job else None}
+
+def _store():
+    return get_archive_store(get_archive_root())
+
+@router.get("/runs")
+async def list_archived_runs():
+    """List archived runs, oldest first."""
+    store = _store()
+    runs = await run_in_threadpool(store.list)
+    return {"runs": runs}
+
+@router.get("/runs/{archive_id}")
+async def get_archived_run(archive_id: str):
+    manifest = await run_in_threadpool(_store().get_manifest, archive_id)
+    if manifest is None:
+        raise HTTPException(status_code=404, detail=f"Unknown archive: {archive_id}")
+    files = [{k: v for k, v in entry.items() if k != "chunks"} for entry in manifest["files"]]
+    return {**manifest, "files": files}
+
+@router.get("/runs/{archive_id}/files/{file_path:path}")
+async def download_archived_file(archive_id: str, file_path: str):
+    """Stream one file out of an archived run without restoring it."""
+    store = _store()
+    entry = await run_in_threadpool(store.file_entry, archive_id, file_path)
+    if entry is None:
+        raise HTTPException(status_code=404, detail=f"{file_path} not found in archive {archive_id}")
+    return StreamingResponse(
+        iterate_in_threadpool(store.iter_file(entry)),
+        media_type="application/octet-stream",
+        headers={
+            "Content-Length": str(entry["size"]),
+            "Content-Disposition": f'attachment; filename="{Path(entry["path"]).name}"',
+        },
+    )
+
+@router.post("/runs/{archive_id}/restore")
+async def restore_archived_run(archive_id: str, user_id: Optional[str] = None, session_id: Optional[str] = None):
+    """Restore an archived run into the folder a session's agent writes to, or into `<archive>/restored/<id>`."""
+    store = _store()
+    if user_id and session_id:
+        try:
+            workspace = workspace_manager.get(user_id, session_id)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        target = workspace.ensure_dirs().agent_outputs_dir
+    else:
+        target = store.root / "restored" / archive_id
+    try:
+        restored = await run_in_threadpool(store.restore, archive_id, target)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        logger.error(f"Failed to restore archive {archive_id}: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to restore archive: {str(e)}")
+    return {"archive_id": archive_id, "target": str(target), "files": len(restored)}
+
+@router.delete("/runs/{archive_id}")
+async def delete_archived_run(archive_id: str):
+    deleted = await run_in_threadpool(_store().delete, archive_id)
+    if not deleted:
+        raise HTTPException(status_code=404, detail=f"Unknown archive: {archive_id}")
+    return {"deleted": archive_id}
+
+@router.post("/retention")
+async def apply_archive_retention():
+    """Apply ARCHIVE_MAX_AGE_DAYS / ARCHIVE_MAX_BYTES now instead of after the next archive job."""
+    store = _store()
+    evicted = await run_in_threadpool(store.enforce_retention)
+    usage = await run_in_threadpool(store.disk_usage)
+    return {"evicted": evicted, "disk_usage": usage}
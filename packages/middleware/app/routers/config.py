@@ -1,18 +1,23 @@
 from fastapi import APIRouter, HTTPException
-import json
+from pydantic import ValidationError
+from starlette.concurrency import run_in_threadpool
 import logging
-from ..config import CONFIG_FILE
+from ..config_service import config_service
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
 @router.post("/set_config")
 async def set_config(config: dict):
-    """Set the configuration for the agent server."""
+    """Set the configuration for the agent server.
+
+    The new configuration is validated, then replaces config.json atomically.
+    """
     try:
-        with open(CONFIG_FILE, 'w') as f:
-            json.dump(config, f, indent=2)
+        await run_in_threadpool(config_service.update, config)
         return {"message": "Config updated successfully"}
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False, include_context=False))
     except Exception as e:
         logger.error(f"Failed to update config: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to update config: {str(e)}")
@@ -1,44 +1,256 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Header, Request
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from contextlib import contextmanager
+from typing import Optional
+import json
 import logging
-from ..services import get_final_structure_file
+import os
+from ..config import FILE_INDEX_TTL, SSE_KEEPALIVE_INTERVAL, OUTPUTS_DIR
+from ..downloads import file_response
+from ..file_index import get_listing_index
+from ..services import ensure_workspace_dirs, get_final_structure_file, resolve_workspace_path
+from ..singleflight import single_flight
+from ..state import state
+from ..structure_diff import load_snapshot, structure_versions
+from ..structure_feed import StructureFeed, shared_feed
+from ..structures import format_for_filename
+from ..watcher import workspace_watcher
+from ..workspace import workspace_manager
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-_last_structure_info = None
+# Last structure returned per (session, client) is kept in the shared state, so
+# polls answered by different workers agree. Abandoned clients age out.
+_CURSOR_TTL = 24 * 3600
+
+def _cursor_key(workspace, client_id: Optional[str]) -> str:
+    return f"structure:cursor:{workspace.name if workspace else ''}:{client_id or ''}"
+
+def _get_workspace(user_id: Optional[str], session_id: Optional[str]):
+    if not (user_id and session_id):
+        return None
+    try:
+        return workspace_manager.get(user_id, session_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@contextmanager
+def _leased_workspace(user_id: Optional[str], session_id: Optional[str]):
+    """The session's workspace (None without ids), held so idle eviction leaves it alone meanwhile."""
+    if _get_workspace(user_id, session_id) is None:
+        yield None
+        return
+    with workspace_manager.lease(user_id, session_id) as workspace:
+        yield workspace
 
 @router.get("/get_final_structure")
-async def get_final_structure():
-    """Retrieve the final structure file from the outputs directory."""
-    global _last_structure_info
+@single_flight("get_final_structure")
+async def get_final_structure(
+    user_id: Optional[str] = None,
+    session_id: Optional[str] = None,
+    client_id: Optional[str] = None,
+    diff: bool = False,
+    version: Optional[str] = None,
+):
+    """Retrieve the final structure file from the outputs directory.
+
+    When `user_id` and `session_id` are given, the session's own workspace is searched.
+    A structure is returned once per `client_id`; prefer `/structures/subscribe` over polling.
+
+    With `diff=true` every answer carries a `version`. Passing the last one back as
+    `version` returns only the atoms that changed since (`delta`, see
+    app/structure_diff.py) instead of `content`, when that is smaller.
+
+    Identical polls in flight at the same time (several tabs, retries) share one answer.
+    """
+    with _leased_workspace(user_id, session_id) as workspace:
+        return await _final_structure(workspace, client_id, diff, version)
+
+async def _final_structure(workspace, client_id: Optional[str], diff: bool, version: Optional[str]):
+    cursor_key = _cursor_key(workspace, client_id)
     try:
-        structure_file = get_final_structure_file()
+        if workspace:
+            structure_file = await run_in_threadpool(workspace.find_latest_structure)
+        else:
+            structure_file = await run_in_threadpool(get_final_structure_file)
         if structure_file is None:
-            logger.info("No structure file found")
+            logger.debug("No structure file found")
             return None
-        
+
         # Check if the structure is new
         current_mtime = structure_file.stat().st_mtime
         current_path = str(structure_file)
-        
-        logger.info(f"Checking structure: {current_path} (mtime={current_mtime})")
-        
-        if _last_structure_info == (current_path, current_mtime):
-            logger.info("No new structure generated (matches last memory).")
+
+        logger.debug(f"Checking structure: {current_path} (mtime={current_mtime})")
+
+        current = json.dumps([current_path, current_mtime])
+        if await run_in_threadpool(state.get, cursor_key) == current:
+            logger.debug("No new structure generated (matches last memory).")
             return None
 
-        _last_structure_info = (current_path, current_mtime)
-        
+        await run_in_threadpool(state.set, cursor_key, current, ttl=_CURSOR_TTL)
+
         content = structure_file.read_text(encoding="utf-8")
         file_name = structure_file.name
-        
+
         logger.info(f"Returning structure: {file_name}")
-        return {
-            "fileName": file_name,
-            "content": content
-        }
+        if diff:
+            result = await _structure_update(cursor_key, version, file_name, content)
+        else:
+            result = {
+                "fileName": file_name,
+                "content": content
+            }
+        # Found in the shared workspace through the shared fallback, not in the session's own tree
+        result["shared"] = bool(workspace) and workspace.is_shared(structure_file)
+        return result
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Failed to retrieve structure: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to retrieve structure: {str(e)}")
+
+async def _structure_update(client_key: str, version: Optional[str], file_name: str, content: str) -> dict:
+    """Delta against the client's `version` when possible, else the full content with a new version."""
+    fmt = format_for_filename(file_name)
+    if fmt is not None:
+        try:
+            snapshot = await load_snapshot(content, fmt)
+            update = await run_in_threadpool(structure_versions.respond, client_key, version, snapshot)
+        except Exception as e:
+            logger.warning(f"Sending {file_name} in full, could not diff it: {e}")
+        else:
+            if "delta" in update:
+                return {"fileName": file_name, **update}
+            return {"fileName": file_name, "content": content, **update}
+    return {"fileName": file_name, "content": content, "version": None}
+
+async def _structure_events(feed: StructureFeed, cursor: Optional[int]):
+    def frame(event, payload):
+        return f"id: {event.seq}\nevent: structure\ndata: {json.dumps(payload)}\n\n"
+
+    with feed.subscribe() as subscription:
+        if cursor is not None and cursor > feed.seq:
+            # Cursor from before a restart; sequence numbers started over
+            cursor = None
+        if cursor is None:
+            # New client: start with the structure that is current right now
+            current = await run_in_threadpool(feed.current)
+            cursor = feed.seq
+            if current is not None:
+                try:
+                    yield frame(current, await run_in_threadpool(current.payload))
+                except FileNotFoundError:
+                    pass
+
+        idle = 0.0
+        while True:
+            subscription.event.clear()
+            events, missed = feed.events_after(cursor)
+            if missed:
+                # The client fell behind the retained history; skip to the newest structure
+                current = await run_in_threadpool(feed.current)
+                events = [current] if current is not None else []
+                cursor = feed.seq
+            for event in events:
+                cursor = max(cursor, event.seq)
+                try:
+                    payload = await run_in_threadpool(event.payload)
+                except FileNotFoundError:
+                    continue
+                yield frame(event, payload)
+                idle = 0.0
+
+            timeout = SSE_KEEPALIVE_INTERVAL if workspace_watcher.available else FILE_INDEX_TTL
+            if not await subscription.wait(timeout):
+                feed.poll_sources()
+                idle += timeout
+                if idle >= SSE_KEEPALIVE_INTERVAL:
+                    idle = 0.0
+                    yield ": keep-alive\n\n"
+
+async def _subscription_events(user_id: Optional[str], session_id: Optional[str], cursor: Optional[int]):
+    # The lease lasts as long as the client is connected, so the workspace
+    # (and its feed) is not evicted while someone is still listening
+    with _leased_workspace(user_id, session_id) as workspace:
+        feed = workspace.structure_feed() if workspace else shared_feed()
+        async for chunk in _structure_events(feed, cursor):
+            yield chunk
+
+@router.get("/structures/subscribe")
+async def subscribe_structures(
+    user_id: Optional[str] = None,
+    session_id: Optional[str] = None,
+    cursor: Optional[int] = None,
+    last_event_id: Optional[str] = Header(None),
+):
+    """Server-sent events for every new or changed structure file.
+
+    Each event carries `seq`, `fileName`, `mtime`, `size`, `content` (null with
+    `truncated: true` for files above STRUCTURE_PUSH_MAX_BYTES) and `shared`. Reconnecting clients
+    resume from `Last-Event-ID` (or `cursor`) without receiving duplicates.
+    """
+    _get_workspace(user_id, session_id)  # reject invalid ids before the stream starts
+    if cursor is None and last_event_id:
+        try:
+            cursor = int(last_event_id)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Invalid Last-Event-ID: {last_event_id}")
+    return StreamingResponse(
+        _subscription_events(user_id, session_id, cursor),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+def _outputs_path(path: str, user_id: Optional[str], session_id: Optional[str]):
+    workspace = _get_workspace(user_id, session_id)
+    if workspace:
+        workspace.ensure_dirs()
+        ensure_workspace_dirs()
+        root = workspace.agent_outputs_dir
+    else:
+        ensure_workspace_dirs()
+        root = OUTPUTS_DIR
+    try:
+        return root, resolve_workspace_path(path, root)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/files")
+async def list_files(path: str = "", user_id: Optional[str] = None, session_id: Optional[str] = None):
+    """List one folder of the outputs directory (the session's, with `user_id`/`session_id`).
+
+    File entries come from a cached, watcher-maintained index, so repeated
+    listings do not stat every file.
+    """
+    root, directory = _outputs_path(path, user_id, session_id)
+    if not directory.is_dir():
+        raise HTTPException(status_code=404, detail=f"Folder not found: {path}")
+    entries = await run_in_threadpool(get_listing_index(directory).entries)
+
+    def subdirs():
+        with os.scandir(directory) as it:
+            return sorted(entry.name for entry in it if entry.is_dir() and not entry.name.startswith("."))
+
+    return {
+        "path": str(directory.relative_to(root)).replace(os.sep, "/") if directory != root else "",
+        "dirs": await run_in_threadpool(subdirs),
+        "files": [
+            {"name": p.name, "size": size, "mtime": mtime}
+            for p, mtime, size in entries if not p.name.startswith(".")
+        ],
+    }
+
+@router.get("/files/{path:path}")
+async def download_file(request: Request, path: str, user_id: Optional[str] = None, session_id: Optional[str] = None, download: bool = False):
+    """Serve a file from the outputs directory.
+
+    Supports `Range` requests, `ETag`/`If-None-Match` and on-the-fly gzip/zstd
+    for text formats. `download=true` asks the browser to save the file.
+    """
+    _, file_path = _outputs_path(path, user_id, session_id)
+    if not file_path.is_file():
+        raise HTTPException(status_code=404, detail=f"File not found: {path}")
+    return file_response(request, file_path, download)
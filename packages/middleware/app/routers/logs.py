@@ -1,50 +1,59 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Header
 from fastapi.responses import StreamingResponse
-import glob
-import os
+from typing import Optional
 import asyncio
 import logging
-import time
-from ..config import LOGS_DIR
+from ..config import SSE_KEEPALIVE_INTERVAL
+from ..log_tailer import log_tailer
 from ..services import ensure_workspace_dirs
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-@router.get("/logs/stream")
-async def stream_logs():
-    ensure_workspace_dirs()
-    
-    # Wait for a log file to appear (timeout 10s)
-    start_time = time.time()
-    latest_file = None
-    
-    while time.time() - start_time < 10:
-        list_of_files = glob.glob(str(LOGS_DIR / "*.log"))
-        if list_of_files:
-            latest_file = max(list_of_files, key=os.path.getctime)
-            break
-        await asyncio.sleep(0.5)
+def _frames(name, lines):
+    return "".join(f"id: {name}:{end}\ndata: {line}\n\n" for end, line in lines)
 
-    if not latest_file:
-        # If no logs yet, just return empty stream or wait? 
-        # Better to return error or wait. Let's return a comment.
-        async def empty_gen():
-            yield ": No logs found\n\n"
-        return StreamingResponse(empty_gen(), media_type="text/event-stream")
+async def _log_events(last_event_id: Optional[str]):
+    subscriber = log_tailer.subscribe()
+    try:
+        if last_event_id and ":" in last_event_id:
+            name, _, offset = last_event_id.rpartition(":")
+            try:
+                log_tailer.resume_positions(subscriber, name, int(offset))
+            except ValueError:
+                pass
+            subscriber.lagged = True  # read the gap from disk first
 
-    async def log_generator():
-        try:
-            with open(latest_file, "r", encoding="utf-8") as f:
-                # Go to the end of the file to only stream new logs
-                f.seek(0, 2)
-                while True:
-                    line = f.readline()
-                    if line:
-                        yield f"data: {line.strip()}\n\n"
-                    else:
-                        await asyncio.sleep(0.1)
-        except Exception as e:
-            yield f"data: Error reading log: {str(e)}\n\n"
+        while True:
+            if subscriber.lagged:
+                subscriber.lagged = False
+                batches = await log_tailer.catch_up(subscriber)
+            else:
+                try:
+                    batches = [await asyncio.wait_for(subscriber.queue.get(), SSE_KEEPALIVE_INTERVAL)]
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                # Drain whatever else is already buffered into the same write
+                while not subscriber.queue.empty():
+                    batches.append(subscriber.queue.get_nowait())
+            chunk = "".join(_frames(batch[0], subscriber.accept(batch)) for batch in batches)
+            if chunk:
+                yield chunk
+    finally:
+        log_tailer.unsubscribe(subscriber)
 
-    return StreamingResponse(log_generator(), media_type="text/event-stream")
+@router.get("/logs/stream")
+async def stream_logs(last_event_id: Optional[str] = Header(None)):
+    """Stream new agent log lines as server-sent events.
+
+    Every `*.log` file in the logs folder is followed, including files created or
+    rotated later. Each line is one event whose id is `<file>:<byte offset>`, so a
+    reconnecting client resumes where it left off via `Last-Event-ID`.
+    """
+    ensure_workspace_dirs()
+    return StreamingResponse(
+        _log_events(last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -1,12 +1,24 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File, Body
-from pydantic import BaseModel
-from typing import Optional, Dict, Any
-import tempfile
-import os
+from fastapi import APIRouter, HTTPException, Response, UploadFile, File
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, model_validator
+from typing import Optional, Dict, Any, List
+import asyncio
+import gzip
+import json
 import logging
-from pymatgen.core import Structure
-from pymatgen.io.cif import CifWriter
-from pymatgen.symmetry.analyzer import SpacegroupAnalyzer
+import tarfile
+import time
+import zipfile
+from ..analysis_store import analysis_store
+from ..archive_store import get_archive_store
+from ..config import ANALYSIS_ANGLE_TOLERANCE, ANALYSIS_SYMPREC, MATERIALS_BATCH_MAX_ITEMS, MATERIALS_BATCH_MAX_FILE_BYTES, OUTPUTS_DIR
+from ..materials_pool import materials_pool, MaterialsJobTimeout, MaterialsPoolUnavailable
+from ..services import get_archive_root
+from ..singleflight import single_flight
+from ..uploads import UploadGone, upload_registry
+from ..structure_cache import structure_cache, content_key, upload_key
+from ..structures import compute, compute_file, derived_name, format_for_filename, msgpack, BINARY_LAYOUT, PARSE_LAYOUTS, SUPPORTED_TARGET_FORMATS
 
 router = APIRouter(
     prefix="/materials",
@@ -16,119 +28,314 @@ router = APIRouter(
 logger = logging.getLogger(__name__)
 
 class StructureData(BaseModel):
-    structure_string: str
-    format: str = "poscar"  # cif, poscar, json
+    structure_string: Optional[str] = None
+    handle: Optional[str] = None  # from POST /uploads, instead of structure_string
+    format: str = "poscar"  # cif, poscar, json; an upload's own format wins unless set
+
+    @model_validator(mode="after")
+    def _one_source(self):
+        if (self.structure_string is None) == (self.handle is None):
+            raise ValueError("Provide either structure_string or handle")
+        return self
+
+class BatchItem(StructureData):
+    id: Optional[str] = None  # echoed back to match results to inputs
+
+async def _job(data: StructureData, op: str, *args):
+    """(cache key, worker function and arguments, input size) for a request."""
+    if data.handle is None:
+        key = content_key(data.structure_string, data.format)
+        return key, (compute, op, data.structure_string, data.format, *args), len(data.structure_string)
+    upload = await run_in_threadpool(upload_registry.get, data.handle)
+    if upload is None:
+        raise HTTPException(status_code=404, detail=f"Upload {data.handle} not found")
+    try:
+        await run_in_threadpool(upload.check)
+    except UploadGone as e:
+        raise HTTPException(status_code=410, detail=str(e))
+    fmt = data.format if "format" in data.model_fields_set or not upload.format else upload.format
+    # The worker reads the file itself; the text never passes through this process
+    return upload_key(upload.sha256, fmt), (compute_file, op, str(upload.path), fmt, *args), upload.size
+
+async def _compute(data: StructureData, op: str, *args):
+    """Result of a materials operation, from the cache or a worker process."""
+    key, job, size = await _job(data, op, *args)
+    name = derived_name(op, *args)
+    result = structure_cache.lookup(key, name)
+    if result is None and op == "analyze":
+        # Analyzed before, possibly by an earlier process; one indexed SQLite read
+        result = await run_in_threadpool(analysis_store.get_text, key, *args)
+        if result is not None:
+            structure_cache.store(key, name, result, size)
+    if result is None:
+        result = await _run_job(key, name, job, size)
+    return result
+
+@single_flight("materials_job", key=lambda key, name, job, size: (key, name))
+async def _run_job(key: str, name: str, job: tuple, size: int):
+    """Run a job in the materials workers and store its result; identical requests in flight share it."""
+    try:
+        result = await materials_pool.run(*job)
+    except MaterialsJobTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except MaterialsPoolUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    structure_cache.store(key, name, result, size)
+    op, args = job[1], job[4:]
+    if op == "analyze":
+        await run_in_threadpool(analysis_store.put_text, key, *args, result)
+    return result
+
+def _tolerances(symprec: Optional[float] = None, angle_tolerance: Optional[float] = None):
+    """(symprec, angle_tolerance) for spglib, defaulting to ANALYSIS_SYMPREC / ANALYSIS_ANGLE_TOLERANCE."""
+    symprec = ANALYSIS_SYMPREC if symprec is None else symprec
+    angle_tolerance = ANALYSIS_ANGLE_TOLERANCE if angle_tolerance is None else angle_tolerance
+    if symprec <= 0:
+        raise HTTPException(status_code=400, detail="symprec must be positive")
+    return symprec, angle_tolerance
 
 @router.post("/analyze")
-async def analyze_structure(data: StructureData):
+async def analyze_structure(data: StructureData, symprec: Optional[float] = None, angle_tolerance: Optional[float] = None):
     """
     Analyze a structure using Pymatgen locally.
     Returns symmetry, chemical formula, and other basic properties.
+
+    `symprec` (Angstrom) and `angle_tolerance` (degrees) are passed to spglib.
+    Results are kept in a persistent store, so structures seen before are
+    answered without running spglib again.
     """
     try:
-        # Load structure
-        if data.format.lower() == "cif":
-            structure = Structure.from_str(data.structure_string, fmt="cif")
-        elif data.format.lower() == "poscar":
-            structure = Structure.from_str(data.structure_string, fmt="poscar")
-        elif data.format.lower() == "json":
-            import json
-            d = json.loads(data.structure_string)
-            structure = Structure.from_dict(d)
-        else:
-            # Fallback to auto-detect if possible or default to CIF
-            structure = Structure.from_str(data.structure_string, fmt="cif")
-
-        # Analyze
-        sga = SpacegroupAnalyzer(structure)
-        symmetry = sga.get_symmetry_dataset()
-        
-        return {
-            "formula": structure.composition.reduced_formula,
-            "num_sites": structure.num_sites,
-            "volume": structure.volume,
-            "density": structure.density,
-            "is_ordered": structure.is_ordered,
-            "symmetry": {
-                "symbol": symmetry["international"],
-                "number": symmetry["number"],
-                "hall": symmetry["hall"]
-            }
-        }
+        return await _compute(data, "analyze", *_tolerances(symprec, angle_tolerance))
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error analyzing structure: {str(e)}")
         raise HTTPException(status_code=400, detail=f"Analysis failed: {str(e)}")
 
 @router.post("/parse")
-async def parse_structure(data: StructureData):
+async def parse_structure(data: StructureData, layout: str = "atoms"):
     """
     Parse a structure and return atoms and lattice for visualization.
     Replaces frontend CIF parsing.
+
+    `layout=columnar` returns flat coordinate and species arrays instead of one
+    object per atom. `layout=binary` returns the raw little-endian buffer
+    described by the `X-Layout` header (lattice, positions as float32, species as
+    uint16 indices into `X-Elements`); `layout=msgpack` wraps the same buffers in
+    MessagePack.
     """
+    layout = layout.lower()
+    if layout not in PARSE_LAYOUTS:
+        raise HTTPException(status_code=400, detail=f"Unsupported layout: {layout}")
+    if layout == "msgpack" and msgpack is None:
+        raise HTTPException(status_code=400, detail="The msgpack layout requires the 'msgpack' package")
     try:
-        # Load structure
-        if data.format.lower() == "cif":
-            structure = Structure.from_str(data.structure_string, fmt="cif")
-        elif data.format.lower() == "poscar":
-            structure = Structure.from_str(data.structure_string, fmt="poscar")
-        elif data.format.lower() == "json":
-            import json
-            d = json.loads(data.structure_string)
-            structure = Structure.from_dict(d)
+        if layout == "atoms":
+            result = await _compute(data, "parse")
         else:
-            # Fallback to auto-detect if possible or default to CIF
-            structure = Structure.from_str(data.structure_string, fmt="cif")
-
-        # Extract data for frontend
-        lattice = structure.lattice.matrix.tolist()
-        atoms = []
-        for site in structure:
-            try:
-                element = site.specie.symbol
-            except:
-                # For disordered structures, take the element with highest occupancy
-                element = site.species.most_common(1)[0][0].symbol
-
-            atoms.append({
-                "element": element,
-                "x": site.x,
-                "y": site.y,
-                "z": site.z
-            })
-            
-        return {
-            "atoms": atoms,
-            "lattice": lattice
-        }
+            result = await _compute(data, "parse", layout)
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error parsing structure: {str(e)}")
         raise HTTPException(status_code=400, detail=f"Parsing failed: {str(e)}")
 
+    if layout in ("binary", "msgpack"):
+        return Response(
+            content=result["body"],
+            media_type="application/octet-stream" if layout == "binary" else "application/x-msgpack",
+            headers={
+                "X-Atom-Count": str(result["num_atoms"]),
+                "X-Elements": ",".join(result["elements"]),
+                "X-Layout": BINARY_LAYOUT,
+            },
+        )
+    return result
+
 @router.post("/convert")
 async def convert_structure(data: StructureData, target_format: str = "cif"):
     """
     Convert structure format locally.
     """
+    target_format = target_format.lower()
+    if target_format not in SUPPORTED_TARGET_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported target format: {target_format}")
     try:
-        # Load (reuse logic or refactor)
-        if data.format.lower() == "cif":
-            structure = Structure.from_str(data.structure_string, fmt="cif")
-        elif data.format.lower() == "poscar":
-            structure = Structure.from_str(data.structure_string, fmt="poscar")
-        else:
-            structure = Structure.from_str(data.structure_string, fmt="cif")
-
-        if target_format.lower() == "cif":
-            return {"structure_string": structure.to(fmt="cif"), "format": "cif"}
-        elif target_format.lower() == "poscar":
-            return {"structure_string": structure.to(fmt="poscar"), "format": "poscar"}
-        elif target_format.lower() == "json":
-            return {"structure_string": structure.to_json(), "format": "json"}
-        else:
-            raise HTTPException(status_code=400, detail=f"Unsupported target format: {target_format}")
+        return await _compute(data, "convert", target_format)
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error converting structure: {str(e)}")
         raise HTTPException(status_code=400, detail=f"Conversion failed: {str(e)}")
+
+def _read_archive(fileobj, limit: int) -> List[Dict[str, Any]]:
+    """Structure files inside a zip or tar archive as batch items (`error` set for unreadable ones)."""
+    members = []
+    if zipfile.is_zipfile(fileobj):
+        fileobj.seek(0)
+        archive = zipfile.ZipFile(fileobj)
+        for info in archive.infolist():
+            if not info.is_dir():
+                members.append((info.filename, info.file_size, lambda info=info: archive.read(info)))
+    else:
+        fileobj.seek(0)
+        try:
+            archive = tarfile.open(fileobj=fileobj, mode="r:*")
+        except tarfile.TarError:
+            raise ValueError("Upload is neither a zip nor a tar archive")
+        for info in archive.getmembers():
+            if info.isfile():
+                members.append((info.name, info.size, lambda info=info: archive.extractfile(info).read()))
+
+    items = []
+    for name, size, read in members:
+        fmt = format_for_filename(name)
+        if fmt is None or "__MACOSX" in name:
+            continue
+        if len(items) >= limit:
+            raise ValueError(f"Archive holds more than {limit} structures")
+        item = {"id": name, "format": fmt, "structure_string": None, "error": None}
+        if size > MATERIALS_BATCH_MAX_FILE_BYTES:
+            item["error"] = f"File is larger than {MATERIALS_BATCH_MAX_FILE_BYTES} bytes"
+        else:
+            try:
+                data = read()
+                if name.lower().endswith(".gz"):
+                    data = gzip.decompress(data)
+                item["structure_string"] = data.decode("utf-8")
+            except (OSError, UnicodeDecodeError, zipfile.BadZipFile, tarfile.TarError) as e:
+                item["error"] = f"Could not read file: {e}"
+        items.append(item)
+    return items
+
+async def _analyze_item(index: int, item: Dict[str, Any], semaphore: asyncio.Semaphore) -> Dict[str, Any]:
+    line = {"index": index, "id": item.get("id")}
+    if item.get("error"):
+        return {**line, "ok": False, "status": 400, "error": item["error"]}
+    async with semaphore:
+        try:
+            data = StructureData(**{k: item[k] for k in ("structure_string", "handle", "format") if k in item})
+            result = await _compute(data, "analyze", *_tolerances())
+            return {**line, "ok": True, "result": result}
+        except HTTPException as e:
+            return {**line, "ok": False, "status": e.status_code, "error": e.detail}
+        except Exception as e:
+            return {**line, "ok": False, "status": 400, "error": f"Analysis failed: {str(e)}"}
+
+async def _batch_lines(items: List[Dict[str, Any]]):
+    # Keep a couple of jobs queued per worker; job timeouts start at submission
+    semaphore = asyncio.Semaphore(max(1, materials_pool.workers) * 2)
+    tasks = [asyncio.create_task(_analyze_item(i, item, semaphore)) for i, item in enumerate(items)]
+    failed = 0
+    try:
+        for finished in asyncio.as_completed(tasks):
+            line = await finished
+            failed += not line["ok"]
+            yield json.dumps(line) + "\n"
+        yield json.dumps({"done": True, "total": len(tasks), "failed": failed}) + "\n"
+    finally:
+        # Client went away: drop whatever has not run yet
+        for task in tasks:
+            task.cancel()
+
+def _batch_response(items: List[Dict[str, Any]]) -> StreamingResponse:
+    return StreamingResponse(
+        _batch_lines(items),
+        media_type="application/x-ndjson",
+        headers={"X-Batch-Size": str(len(items))},
+    )
+
+@router.post("/analyze_batch")
+async def analyze_batch(structures: List[BatchItem]):
+    """
+    Analyze many structures in parallel.
+    Streams one NDJSON line per structure as soon as it is done (in completion
+    order, with its `index` and `id`), then a final `{"done": true}` summary.
+    A structure that fails is reported on its own line and does not stop the batch.
+    """
+    if len(structures) > MATERIALS_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {MATERIALS_BATCH_MAX_ITEMS} structures per batch")
+    return _batch_response([item.model_dump(exclude_unset=True) for item in structures])
+
+@router.post("/analyze_batch/archive")
+async def analyze_batch_archive(archive: UploadFile = File(...)):
+    """
+    Analyze every structure file (cif, POSCAR/CONTCAR/.vasp, json; optionally .gz)
+    inside an uploaded zip or tar archive. Results stream like `/analyze_batch`,
+    with the member path as `id`.
+    """
+    try:
+        items = await run_in_threadpool(_read_archive, archive.file, MATERIALS_BATCH_MAX_ITEMS)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return _batch_response(items)
+
+_precompute = {"running": False, "analyzed": 0, "failed": 0, "skipped": 0, "finished_at": None}
+
+def _precompute_sources():
+    """(name, read) for every structure file in OUTPUTS_DIR and in the archive."""
+    sources = []
+    if OUTPUTS_DIR.is_dir():
+        for path in OUTPUTS_DIR.rglob("*"):
+            if format_for_filename(path.name) and path.is_file() and path.stat().st_size <= MATERIALS_BATCH_MAX_FILE_BYTES:
+                sources.append((path.name, path.read_bytes))
+    store = get_archive_store(get_archive_root())
+    for run in store.list():
+        manifest = store.get_manifest(run["id"]) or {"files": []}
+        for entry in manifest["files"]:
+            if format_for_filename(entry["path"]) and entry["size"] <= MATERIALS_BATCH_MAX_FILE_BYTES:
+                sources.append((entry["path"], lambda entry=entry: b"".join(store.iter_file(entry))))
+    return sources
+
+async def precompute_analysis():
+    """Analyze every stored structure with the default tolerances, one job at a time."""
+    if _precompute["running"]:
+        return
+    _precompute.update(running=True, analyzed=0, failed=0, skipped=0, finished_at=None)
+    try:
+        sources = await run_in_threadpool(_precompute_sources)
+        logger.info(f"Precomputing symmetry analysis for {len(sources)} structure files")
+        for name, read in sources:
+            try:
+                data = await run_in_threadpool(read)
+                if name.lower().endswith(".gz"):
+                    data = gzip.decompress(data)
+                item = StructureData(structure_string=data.decode("utf-8"), format=format_for_filename(name))
+            except (OSError, UnicodeDecodeError, ValueError):
+                _precompute["skipped"] += 1
+                continue
+            try:
+                await _compute(item, "analyze", *_tolerances())
+                _precompute["analyzed"] += 1
+            except Exception as e:
+                _precompute["failed"] += 1
+                logger.debug(f"Precompute skipped {name}: {e}")
+        logger.info(f"Symmetry precompute done: {_precompute['analyzed']} analyzed, {_precompute['failed']} failed")
+    finally:
+        _precompute.update(running=False, finished_at=time.time())
+
+@router.post("/analysis/precompute")
+async def start_precompute():
+    """Start analyzing every structure in the outputs folder and the archive in the background."""
+    started = not _precompute["running"]
+    if started:
+        asyncio.create_task(precompute_analysis())
+    return {"started": started, **_precompute}
+
+@router.get("/analysis/stats")
+async def analysis_stats():
+    """Persistent analysis store counters and the state of the last precompute run."""
+    return {"store": await run_in_threadpool(analysis_store.info), "precompute": dict(_precompute)}
+
+@router.get("/cache/stats")
+async def cache_stats():
+    """Hit/miss counters and memory use of the parsed-structure cache."""
+    return structure_cache.info()
+
+@router.get("/pool/stats")
+async def pool_stats():
+    """Job counters of the materials worker pool."""
+    return materials_pool.info()
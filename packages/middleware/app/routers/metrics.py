@@ -0,0 +1,44 @@
+from fastapi import APIRouter, Response
+import logging
+from ..archive_jobs import archive_queue
+from ..log_tailer import log_tailer
+from ..materials_pool import materials_pool
+from ..metrics import CONTENT_TYPE, REGISTRY, CallbackCounter, Gauge
+from ..run_proxy import run_limiter
+from ..session_cache import session_cache
+from ..singleflight import inflight as singleflight_inflight
+from ..structure_cache import structure_cache
+from ..structure_diff import structure_versions
+from ..structure_feed import total_subscribers
+from ..workspace import workspace_manager
+
+router = APIRouter(tags=["metrics"])
+logger = logging.getLogger(__name__)
+
+# Existing state, read at scrape time
+Gauge("sse_subscribers", "Connected server-sent event clients", lambda: {
+    "structures": total_subscribers(),
+    "logs": log_tailer.subscribers,
+}, ("stream",))
+Gauge("runs_active", "Proxied /run streams", lambda: run_limiter.active)
+Gauge("runs_waiting", "/run requests waiting for a free slot", lambda: run_limiter.waiting)
+CallbackCounter("runs_rejected_total", "/run requests rejected because all slots were busy", lambda: run_limiter.rejected)
+Gauge("materials_jobs_inflight", "Materials jobs submitted and not finished", lambda: materials_pool.inflight)
+CallbackCounter("materials_jobs_total", "Materials jobs by final state",
+                lambda: {k: materials_pool.stats[k] for k in ("submitted", "completed", "failed", "cancelled", "timeouts")}, ("state",))
+CallbackCounter("materials_pool_restarts_total", "Materials worker pool restarts", lambda: materials_pool.stats["restarts"])
+Gauge("structure_cache_bytes", "Memory used by the parsed-structure cache", lambda: structure_cache.info()["bytes"])
+CallbackCounter("structure_cache_lookups_total", "Parsed-structure cache lookups",
+                lambda: {k: structure_cache.stats[k] for k in ("hits", "misses", "derived_hits", "derived_misses")}, ("result",))
+CallbackCounter("structure_diff_responses_total", "/get_final_structure?diff=true answers by kind",
+                lambda: {"delta": structure_versions.stats["deltas"], "full": structure_versions.stats["full"]}, ("kind",))
+CallbackCounter("session_cache_lookups_total", "Known-session cache lookups",
+                lambda: {k: session_cache.info()[k] for k in ("hits", "misses")}, ("result",))
+Gauge("workspaces_registered", "Session workspaces registered in this worker", lambda: len(workspace_manager.active()))
+Gauge("singleflight_inflight", "Coalesced computations in flight", singleflight_inflight, ("name",))
+Gauge("archive_jobs_pending", "Archive jobs queued or running", archive_queue.pending)
+
+@router.get("/metrics")
+async def metrics():
+    """Metrics in the Prometheus text exposition format."""
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
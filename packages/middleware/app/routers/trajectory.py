@@ -0,0 +1,169 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from typing import Optional
+import json
+import logging
+from ..config import TRAJECTORY_BATCH_FRAMES, WORKSPACE_DIR, OUTPUTS_DIR, SESSIONS_DIR, ARCHIVE_STAGING_DIR
+from ..file_index import get_structure_index
+from ..materials_pool import materials_pool, MaterialsJobTimeout, MaterialsPoolUnavailable
+from ..services import resolve_workspace_path
+from ..trajectory import FrameIndex, TRAJECTORY_LAYOUTS, get_frame_index, read_frames, trajectory_format
+from ..workspace import workspace_manager
+
+router = APIRouter(
+    prefix="/materials/trajectory",
+    tags=["materials"]
+)
+
+logger = logging.getLogger(__name__)
+
+# Parts of the shared workspace that belong to sessions, or wait to be archived
+_PRIVATE_DIRS = (SESSIONS_DIR, ARCHIVE_STAGING_DIR)
+
+def _search_roots(user_id: Optional[str], session_id: Optional[str]):
+    """(roots a `path` is resolved against, in order; directories searched for the newest trajectory)."""
+    if not (user_id and session_id):
+        return [WORKSPACE_DIR], [WORKSPACE_DIR, OUTPUTS_DIR]
+    try:
+        workspace = workspace_manager.get(user_id, session_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    roots, search_dirs = [workspace.root], [workspace.root, workspace.outputs_dir]
+    if workspace.shared_fallback:
+        # The agent writes to the shared workspace
+        roots.append(WORKSPACE_DIR)
+        search_dirs += [WORKSPACE_DIR, OUTPUTS_DIR]
+    return roots, search_dirs
+
+def _is_private(file_path) -> bool:
+    return any(d.resolve() == file_path or d.resolve() in file_path.parents for d in _PRIVATE_DIRS)
+
+def _resolve(path: str, roots):
+    """`path` below the first root that has it. Session trees are not reachable through the shared workspace."""
+    error, missing = None, None
+    for root in roots:
+        try:
+            file_path = resolve_workspace_path(path, root)
+        except ValueError as e:
+            error = e
+            continue
+        if root == WORKSPACE_DIR and _is_private(file_path):
+            error = ValueError(f"Path is outside the workspace: {path}")
+            continue
+        if file_path.is_file():
+            return file_path
+        missing = missing or file_path
+    if missing is not None:
+        return missing
+    raise error
+
+async def _open_index(path: Optional[str], user_id: Optional[str], session_id: Optional[str]) -> FrameIndex:
+    """Frame index of `path` (relative to the workspace), or of the newest trajectory file."""
+    roots, search_dirs = _search_roots(user_id, session_id)
+    if path:
+        try:
+            file_path = await run_in_threadpool(_resolve, path, roots)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    else:
+        entries = await run_in_threadpool(get_structure_index(search_dirs).entries)
+        file_path = next((p for p, _, _ in entries if trajectory_format(p.name)), None)
+        if file_path is None:
+            raise HTTPException(status_code=404, detail="No trajectory file found")
+    if not file_path.is_file():
+        raise HTTPException(status_code=404, detail=f"File not found: {path}")
+    if trajectory_format(file_path.name) is None:
+        raise HTTPException(status_code=400, detail=f"Not a trajectory file: {file_path.name}")
+    try:
+        return await run_in_threadpool(get_frame_index, file_path)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _check_layout(layout: str) -> str:
+    layout = layout.lower()
+    if layout not in TRAJECTORY_LAYOUTS:
+        raise HTTPException(status_code=400, detail=f"Unsupported layout: {layout}")
+    return layout
+
+async def _read(index: FrameIndex, specs, layout: str):
+    try:
+        return await materials_pool.run(read_frames, str(index.path), index.format, specs, layout)
+    except MaterialsJobTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except MaterialsPoolUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error reading frames of {index.path}: {str(e)}")
+        raise HTTPException(status_code=400, detail=f"Reading frames failed: {str(e)}")
+
+async def _frame_lines(index: FrameIndex, specs, layout: str):
+    for i in range(0, len(specs), TRAJECTORY_BATCH_FRAMES):
+        try:
+            payloads = await _read(index, specs[i:i + TRAJECTORY_BATCH_FRAMES], layout)
+        except HTTPException as e:
+            yield json.dumps({"error": e.detail, "status": e.status_code}) + "\n"
+            return
+        yield "".join(json.dumps(payload) + "\n" for payload in payloads)
+
+@router.get("")
+async def trajectory_info(path: Optional[str] = None, user_id: Optional[str] = None, session_id: Optional[str] = None):
+    """Frame count of a trajectory file (extxyz/xyz or XDATCAR).
+
+    `path` is relative to the (session) workspace; without it the newest
+    extxyz/xyz file is used.
+    """
+    index = await _open_index(path, user_id, session_id)
+    return index.info()
+
+@router.get("/frames")
+async def trajectory_frames(
+    path: Optional[str] = None,
+    start: Optional[int] = None,
+    stop: Optional[int] = None,
+    stride: int = 1,
+    layout: str = "columnar",
+    user_id: Optional[str] = None,
+    session_id: Optional[str] = None,
+):
+    """Stream frames `start:stop:stride` as newline-delimited JSON, one frame per line.
+
+    Only the selected frames are read from disk. A failure part-way through is
+    reported as a final `{"error": ...}` line.
+    """
+    layout = _check_layout(layout)
+    if stride < 1:
+        raise HTTPException(status_code=400, detail="stride must be at least 1")
+    index = await _open_index(path, user_id, session_id)
+    specs = index.select(start, stop, stride)
+    return StreamingResponse(
+        _frame_lines(index, specs, layout),
+        media_type="application/x-ndjson",
+        headers={"X-Frame-Count": str(len(index)), "X-Frames-Selected": str(len(specs))},
+    )
+
+@router.get("/frames/{number}")
+async def trajectory_frame(
+    number: int,
+    path: Optional[str] = None,
+    layout: str = "columnar",
+    user_id: Optional[str] = None,
+    session_id: Optional[str] = None,
+):
+    """One frame; negative numbers count from the end."""
+    layout = _check_layout(layout)
+    index = await _open_index(path, user_id, session_id)
+    if not -len(index) <= number < len(index):
+        raise HTTPException(status_code=404, detail=f"Frame {number} out of range ({len(index)} frames)")
+    stop = number + 1 if number != -1 else None
+    return (await _read(index, index.select(number, stop), layout))[0]
+
+@router.get("/latest")
+async def trajectory_latest(
+    path: Optional[str] = None,
+    layout: str = "columnar",
+    user_id: Optional[str] = None,
+    session_id: Optional[str] = None,
+):
+    """The last complete frame."""
+    return await trajectory_frame(-1, path, layout, user_id, session_id)
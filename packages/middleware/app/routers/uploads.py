@@ -0,0 +1,90 @@
+from fastapi import APIRouter, HTTPException, Request
+from starlette.concurrency import run_in_threadpool
+from typing import Optional
+import logging
+from ..config import INPUTS_DIR
+from ..services import ensure_workspace_dirs
+from ..uploads import UploadTooLarge, multipart_file, receive_upload, upload_registry
+from ..workspace import workspace_manager
+
+router = APIRouter(
+    prefix="/uploads",
+    tags=["uploads"]
+)
+
+logger = logging.getLogger(__name__)
+
+# Request body schema of POST /uploads, which reads the multipart body itself
+_MULTIPART_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {"multipart/form-data": {"schema": {
+            "type": "object",
+            "properties": {"file": {"type": "string", "format": "binary"}},
+            "required": ["file"],
+        }}},
+    },
+}
+
+async def _store(chunks, file_name: str, gzipped: bool, user_id: Optional[str], session_id: Optional[str]) -> dict:
+    try:
+        if user_id and session_id:
+            with workspace_manager.lease(user_id, session_id) as workspace:
+                workspace.ensure_dirs()
+                upload = await receive_upload(chunks, workspace.inputs_dir, file_name, gzipped, owner=workspace.key)
+        else:
+            ensure_workspace_dirs()
+            upload = await receive_upload(chunks, INPUTS_DIR, file_name, gzipped)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except (ValueError, EOFError) as e:
+        # invalid ids or file name, broken gzip data
+        raise HTTPException(status_code=400, detail=str(e))
+    except OSError as e:
+        logger.error(f"Failed to store upload {file_name}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to store upload: {str(e)}")
+    return upload.to_dict()
+
+@router.post("", openapi_extra=_MULTIPART_BODY)
+async def upload_structure(
+    request: Request,
+    user_id: Optional[str] = None,
+    session_id: Optional[str] = None,
+    gzip: Optional[bool] = None,
+):
+    """Upload a structure file (multipart field `file`) into the session's inputs folder.
+
+    Returns a `handle` that `/run` (`structure.handle`) and `/materials/*`
+    (`handle` instead of `structure_string`) accept. `.gz` files, or any file
+    with `gzip=true`, are decompressed while being stored. The body is
+    streamed to disk as it arrives, so the size cap applies while reading.
+    """
+    try:
+        file_name, chunks = await multipart_file(request.stream(), request.headers.get("content-type", ""))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    gzipped = gzip if gzip is not None else file_name.lower().endswith(".gz")
+    return await _store(chunks, file_name, gzipped, user_id, session_id)
+
+@router.put("/{file_name}")
+async def upload_structure_raw(
+    file_name: str,
+    request: Request,
+    user_id: Optional[str] = None,
+    session_id: Optional[str] = None,
+):
+    """Upload a structure file as the raw request body, streamed straight to disk.
+
+    Send `Content-Encoding: gzip` for a compressed body. Returns the same
+    handle as `POST /uploads`.
+    """
+    gzipped = request.headers.get("content-encoding", "").lower() == "gzip"
+    return await _store(request.stream(), file_name, gzipped, user_id, session_id)
+
+@router.get("/{handle}")
+async def get_upload(handle: str):
+    """Metadata of an upload."""
+    upload = await run_in_threadpool(upload_registry.get, handle)
+    if upload is None:
+        raise HTTPException(status_code=404, detail=f"Upload {handle} not found")
+    return upload.to_dict()
@@ -0,0 +1,212 @@
+"""
+Streaming proxy for Agentom `/run`.
+
+`open_run` sends the request upstream and checks the status before anything
+is returned to the browser, so connection failures and upstream error
+statuses become ordinary HTTP errors. `RunStreamResponse` then relays the
+body with three concurrent tasks:
+
+- a pump reading upstream chunks into a bounded queue (RUN_STREAM_BUFFER).
+  When a slow client lets the queue fill up, the pump stops reading and TCP
+  flow control pushes back on Agentom instead of buffering in memory;
+- a sender writing queued chunks to the client;
+- a watcher for `http.disconnect`. A client that goes away cancels the pump
+  and closes the upstream connection, so Agentom does not keep running (and
+  spending tokens) for nobody.
+
+Errors after the response has started (idle/read timeouts, upstream resets)
+are sent as a final, well-formed error frame in the stream's own framing:
+an `event: error` for SSE, one JSON line otherwise. `RunLimiter` caps the
+number of concurrent runs (MAX_CONCURRENT_RUNS). The cap is per worker
+process: with N uvicorn workers up to N x MAX_CONCURRENT_RUNS runs are
+proxied at once. With a `recorder`, upstream
+chunks are also handed to the response cache (see app/response_cache.py).
+"""
+import asyncio
+import json
+import logging
+import time
+from typing import Awaitable, Callable, Optional
+
+import httpx
+from fastapi import HTTPException
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+from .config import MAX_CONCURRENT_RUNS, RUN_IDLE_TIMEOUT, RUN_QUEUE_TIMEOUT, RUN_STREAM_BUFFER
+from .http_client import stream_timeout
+from .metrics import agentom_request_seconds, agentom_run_first_byte_seconds, agentom_run_stream_seconds
+from .response_cache import Recorder
+
+logger = logging.getLogger(__name__)
+
+# Upstream error bodies are only read up to this size
+_MAX_ERROR_BODY = 64 * 1024
+
+
+class RunLimiter:
+    def __init__(self, limit: int = MAX_CONCURRENT_RUNS, queue_timeout: float = RUN_QUEUE_TIMEOUT):
+        self.limit = limit
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(limit)
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+
+    async def acquire(self):
+        """Take a run slot, waiting up to `queue_timeout`; 503 when none frees up."""
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=503,
+                detail=f"Too many concurrent runs (limit {self.limit} per worker)",
+                headers={"Retry-After": "5"},
+            )
+        finally:
+            self.waiting -= 1
+        self.active += 1
+
+    def release(self):
+        self.active -= 1
+        self._semaphore.release()
+
+    def info(self) -> dict:
+        return {"limit": self.limit, "active": self.active, "waiting": self.waiting, "rejected": self.rejected}
+
+
+run_limiter = RunLimiter()
+
+
+async def open_run(client: httpx.AsyncClient, url: str, payload: dict) -> httpx.Response:
+    """Start the upstream run and return the streaming response once its status is known."""
+    request = client.build_request("POST", url, json=payload, timeout=stream_timeout())
+    started = time.perf_counter()
+    try:
+        upstream = await client.send(request, stream=True)
+    except httpx.TimeoutException as e:
+        agentom_request_seconds.observe(time.perf_counter() - started, call="run", outcome="timeout")
+        raise HTTPException(status_code=504, detail=f"Agentom did not respond: {e!r}")
+    except httpx.HTTPError as e:
+        agentom_request_seconds.observe(time.perf_counter() - started, call="run", outcome="error")
+        raise HTTPException(status_code=502, detail=f"Agentom unreachable: {e!r}")
+    agentom_request_seconds.observe(time.perf_counter() - started, call="run", outcome=str(upstream.status_code))
+    if upstream.status_code >= 400:
+        body = b""
+        try:
+            async for chunk in upstream.aiter_bytes():
+                body += chunk
+                if len(body) >= _MAX_ERROR_BODY:
+                    break
+        except httpx.HTTPError:
+            pass
+        finally:
+            await upstream.aclose()
+        detail = f"Agentom returned {upstream.status_code}: {body[:_MAX_ERROR_BODY].decode('utf-8', errors='replace')}"
+        # Client errors (e.g. unknown session) keep their status; server errors become 502
+        raise HTTPException(status_code=upstream.status_code if upstream.status_code < 500 else 502, detail=detail)
+    return upstream
+
+
+def error_frame(media_type: str, kind: str, message: str) -> bytes:
+    payload = json.dumps({"error": {"type": kind, "message": message}})
+    if media_type.startswith("text/event-stream"):
+        return f"event: error\ndata: {payload}\n\n".encode()
+    return f"\n{payload}\n".encode()
+
+
+class RunStreamResponse(Response):
+    def __init__(
+        self,
+        upstream: httpx.Response,
+        on_close: Callable[[], Awaitable[None]],
+        idle_timeout: Optional[float] = RUN_IDLE_TIMEOUT,
+        buffer: int = RUN_STREAM_BUFFER,
+        started: Optional[float] = None,
+        recorder: Optional[Recorder] = None,
+    ):
+        self.upstream = upstream
+        self.on_close = on_close
+        self.idle_timeout = idle_timeout
+        self.buffer = buffer
+        self.status_code = upstream.status_code
+        self.media_type = upstream.headers.get("content-type", "application/json")
+        self.background = None
+        self.init_headers({"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+        # perf_counter() when the run was sent upstream, for the first-byte and total stream metrics
+        self.started = time.perf_counter() if started is None else started
+        self.outcome = "completed"
+        self.recorder = recorder
+
+    async def _pump(self, queue: "asyncio.Queue[Optional[bytes]]"):
+        # Decoded bytes: Agentom may compress (httpx asks for gzip), but only the
+        # content type is passed on to the browser, not Content-Encoding
+        chunks = self.upstream.aiter_bytes().__aiter__()
+        first = True
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), self.idle_timeout)
+                except StopAsyncIteration:
+                    break
+                if first:
+                    agentom_run_first_byte_seconds.observe(time.perf_counter() - self.started)
+                    first = False
+                if self.recorder is not None:
+                    self.recorder.add(chunk)
+                # Blocks while the client is behind: backpressure instead of unbounded buffering
+                await queue.put(chunk)
+        except asyncio.TimeoutError:
+            self.outcome = "upstream_timeout"
+            logger.warning(f"Agentom run stream idle for {self.idle_timeout}s; aborting")
+            await queue.put(error_frame(self.media_type, "upstream_timeout", f"No data from Agentom for {self.idle_timeout}s"))
+        except httpx.TimeoutException as e:
+            self.outcome = "upstream_timeout"
+            logger.warning(f"Agentom run stream timed out: {e!r}")
+            await queue.put(error_frame(self.media_type, "upstream_timeout", f"Agentom read timed out: {e!r}"))
+        except httpx.HTTPError as e:
+            self.outcome = "upstream_error"
+            logger.error(f"Agentom run stream failed: {e!r}")
+            await queue.put(error_frame(self.media_type, "upstream_error", f"Agentom stream failed: {e!r}"))
+        await queue.put(None)
+
+    async def _forward(self, queue: "asyncio.Queue[Optional[bytes]]", send: Send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        while True:
+            chunk = await queue.get()
+            if chunk is None:
+                break
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    @staticmethod
+    async def _wait_disconnect(receive: Receive):
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        queue: "asyncio.Queue[Optional[bytes]]" = asyncio.Queue(maxsize=self.buffer)
+        pump = asyncio.create_task(self._pump(queue))
+        forward = asyncio.create_task(self._forward(queue, send))
+        disconnect = asyncio.create_task(self._wait_disconnect(receive))
+        try:
+            await asyncio.wait([forward, disconnect], return_when=asyncio.FIRST_COMPLETED)
+            if not forward.done() or isinstance(forward.exception(), OSError):
+                self.outcome = "client_disconnect"
+                logger.info("Client disconnected from /run; cancelling the upstream run")
+            elif forward.exception() is not None:
+                raise forward.exception()
+        finally:
+            for task in (pump, forward, disconnect):
+                task.cancel()
+            await asyncio.gather(pump, forward, disconnect, return_exceptions=True)
+            # Closing the upstream response drops the connection, which cancels the run in Agentom
+            await self.upstream.aclose()
+            agentom_run_stream_seconds.observe(time.perf_counter() - self.started, outcome=self.outcome)
+            await self.on_close()
+            if self.recorder is not None:
+                await self.recorder.finish(self.outcome == "completed")
@@ -1,61 +1,156 @@
-import json
+import errno
 import logging
 import shutil
-import glob
 import os
+import uuid
 from datetime import datetime
 from pathlib import Path
+from typing import Iterable, Optional
 from fastapi import HTTPException
-from .config import CONFIG_FILE, WORKSPACE_DIR, INPUTS_DIR, LOGS_DIR, OUTPUTS_DIR, TEMP_DIR, BASE_DIR, ROOT_DIR
+from .config import WORKSPACE_DIR, INPUTS_DIR, LOGS_DIR, OUTPUTS_DIR, TEMP_DIR, BASE_DIR, ARCHIVE_STAGING_DIR, ARCHIVE_BACKEND
+from .archive_store import get_archive_store
+from .config_service import AppConfig, config_service
+from .file_index import get_structure_index
+from .metrics import services_phase_seconds
+from .singleflight import single_flight
 
 logger = logging.getLogger(__name__)
 
-# Track the last session ID to detect new sessions
-_last_seen_session_id = None
-
 def ensure_workspace_dirs():
     for dir_path in [INPUTS_DIR, LOGS_DIR, OUTPUTS_DIR]:
         dir_path.mkdir(parents=True, exist_ok=True)
 
-def archive_workspace():
-    """Archives outputs from the workspace to the archive directory."""
-    logger.info("Archiving workspace outputs...")
-    
-    # Determine archive directory
-    archive_root = ROOT_DIR / "outputs_archive"
-    if CONFIG_FILE.exists():
+def get_archive_root() -> Path:
+    """Resolve OUTPUT_ARCHIVE_DIR from config.json (relative paths are taken from the repo root)."""
+    return config_service.get().archive_root
+
+def _log_archive_root_change(old: AppConfig, new: AppConfig):
+    if old.archive_root != new.archive_root:
+        logger.info(f"Archive root changed from {old.archive_root} to {new.archive_root}")
+
+config_service.subscribe(_log_archive_root_change)
+
+def resolve_workspace_path(relative: str, root: Path = WORKSPACE_DIR) -> Path:
+    """Absolute path of `relative` below `root`; ValueError if it points outside of it."""
+    root = root.resolve()
+    path = (root / relative).resolve()
+    if path != root and root not in path.parents:
+        raise ValueError(f"Path is outside the workspace: {relative}")
+    return path
+
+def move_tree(src: Path, dest: Path):
+    """Move a file or directory tree.
+
+    Uses a single atomic rename when source and destination share a filesystem,
+    otherwise copies the tree in bulk and deletes the source.
+    """
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.rename(src, dest)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    if src.is_dir():
+        shutil.copytree(src, dest, symlinks=True)
+        shutil.rmtree(src)
+    else:
+        shutil.copy2(src, dest)
+        src.unlink()
+
+def remove_tree(path: Path):
+    if path.is_dir() and not path.is_symlink():
+        shutil.rmtree(path, ignore_errors=True)
+    elif path.exists() or path.is_symlink():
+        path.unlink()
+
+# Suffix of staged trees that are only deleted, never archived (inputs, tmp)
+DISCARD_SUFFIX = ".discard"
+
+def detach_dir(path: Path, discard: bool = False) -> Optional[Path]:
+    """Move a non-empty directory aside into the staging area and recreate it empty.
+
+    The move is a rename, so the directory is immediately reusable while the
+    staged copy is archived or deleted in the background. Returns the staged path.
+    With `discard`, the staged name says it is to be deleted, so startup recovery
+    does not archive it.
+    """
+    if not path.exists() or not any(path.iterdir()):
+        return None
+    ARCHIVE_STAGING_DIR.mkdir(parents=True, exist_ok=True)
+    staged = ARCHIVE_STAGING_DIR / f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}_{path.name}"
+    if discard:
+        staged = staged.with_name(staged.name + DISCARD_SUFFIX)
+    move_tree(path, staged)
+    path.mkdir(parents=True, exist_ok=True)
+    return staged
+
+def detach_root_files(root: Path = WORKSPACE_DIR) -> Optional[Path]:
+    """Move the loose files at the top of `root` into a staged directory that is only deleted.
+
+    Subdirectories stay in place. Returns the staged path, or None if there were no files.
+    """
+    if not root.exists():
+        return None
+    files = [item for item in root.iterdir() if item.is_file() or item.is_symlink()]
+    if not files:
+        return None
+    staged = ARCHIVE_STAGING_DIR / f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}_root{DISCARD_SUFFIX}"
+    staged.mkdir(parents=True, exist_ok=True)
+    for item in files:
         try:
-            with open(CONFIG_FILE, 'r') as f:
-                config = json.load(f)
-                if "OUTPUT_ARCHIVE_DIR" in config:
-                    p = Path(config["OUTPUT_ARCHIVE_DIR"])
-                    if p.is_absolute():
-                        archive_root = p
-                    else:
-                        archive_root = ROOT_DIR / p
-        except Exception:
-            pass
-            
+            os.rename(item, staged / item.name)
+        except OSError as e:
+            logger.error(f"Failed to move {item} out of the workspace root: {e}")
+    return staged
+
+@services_phase_seconds.time(phase="archive")
+def archive_workspace(outputs_dir: Path = OUTPUTS_DIR, label: Optional[str] = None):
+    """Archives outputs from the workspace to the archive directory.
+
+    Returns the archive manifest path (store backend) or archive folder (directory backend).
+    """
+    logger.info(f"Archiving workspace outputs from {outputs_dir}...")
+    if not outputs_dir.exists() or not any(outputs_dir.iterdir()):
+        logger.info("Nothing to archive.")
+        return None
+
+    if ARCHIVE_BACKEND == "store":
+        store = get_archive_store(get_archive_root())
+        manifest = store.add_tree(outputs_dir, label=label)
+        remove_tree(outputs_dir)
+        if outputs_dir == OUTPUTS_DIR:
+            outputs_dir.mkdir(parents=True, exist_ok=True)
+        store.enforce_retention()
+        return store.manifests_dir / f"{manifest['id']}.json"
+
     # Create timestamped folder
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    archive_path = archive_root / timestamp
-    archive_path.mkdir(parents=True, exist_ok=True)
-    
-    # Transfer outputs to archive
-    if OUTPUTS_DIR.exists():
-        for item in OUTPUTS_DIR.iterdir():
-            try:
-                dest = archive_path / item.name
-                if item.is_file():
-                    shutil.move(str(item), str(dest))
-                elif item.is_dir():
-                    shutil.move(str(item), str(dest))
-                logger.info(f"Archived {item.name} to {dest}")
-            except Exception as e:
-                logger.error(f"Failed to move {item} to archive: {e}")
+    archive_root = get_archive_root()
+    name = f"{timestamp}_{label}" if label else timestamp
+    archive_path = archive_root / name
+    suffix = 1
+    while archive_path.exists():
+        archive_path = archive_root / f"{name}-{suffix}"
+        suffix += 1
+
+    # Transfer outputs to archive in one move
+    try:
+        move_tree(outputs_dir, archive_path)
+    except Exception as e:
+        logger.error(f"Failed to move {outputs_dir} to archive: {e}")
+        raise
+    if outputs_dir == OUTPUTS_DIR:
+        outputs_dir.mkdir(parents=True, exist_ok=True)
     logger.info(f"Transferred outputs to target directory: {archive_path}")
+    return archive_path
 
+@services_phase_seconds.time(phase="cleanup")
 def cleanup_workspace():
+    """Archive and clear the shared workspace (inputs/outputs/tmp at the workspace root).
+
+    Runs synchronously; request handlers should use `archive_jobs.schedule_workspace_cleanup` instead.
+    """
     logger.info("Cleaning up workspace...")
     
     # 1. Archive existing outputs
@@ -67,10 +162,7 @@ def cleanup_workspace():
         if d.exists():
             for item in d.iterdir():
                 try:
-                    if item.is_file() or item.is_symlink():
-                        item.unlink()
-                    elif item.is_dir():
-                        shutil.rmtree(item)
+                    remove_tree(item)
                 except Exception as e:
                     logger.error(f"Failed to delete {item} in {d}: {e}")
             logger.info(f"Cleared directory: {d}")
@@ -87,14 +179,8 @@ def cleanup_workspace():
     
     logger.info("Workspace cleanup complete.")
 
-def check_new_session(session_id: str):
-    global _last_seen_session_id
-    if session_id != _last_seen_session_id:
-        logger.info(f"New session detected: {session_id} (old: {_last_seen_session_id})")
-        cleanup_workspace()
-        _last_seen_session_id = session_id
-
-def persist_structure_file(structure: dict):
+@services_phase_seconds.time(phase="persist")
+def persist_structure_file(structure: dict, inputs_dir: Path = INPUTS_DIR):
     if not structure:
         return None
 
@@ -110,10 +196,10 @@ def persist_structure_file(structure: dict):
         # If atomCount is not convertible, continue best-effort
         pass
 
-    ensure_workspace_dirs()
+    inputs_dir.mkdir(parents=True, exist_ok=True)
     file_name = structure.get("fileName") or "structure.poscar"
     safe_name = Path(file_name).name
-    target_path = INPUTS_DIR / safe_name
+    target_path = inputs_dir / safe_name
 
     try:
         target_path.write_text(content, encoding="utf-8")
@@ -123,18 +209,21 @@ def persist_structure_file(structure: dict):
         logger.exception("Failed to persist structure file")
         raise HTTPException(status_code=500, detail=f"Failed to save structure: {exc}")
 
-def get_final_structure_file():
-    """Find the most recently modified structure file in the workspace directory and its outputs subfolder."""
+@single_flight("structure_scan")
+@services_phase_seconds.time(phase="scan")
+def get_final_structure_file(search_dirs: Optional[Iterable[Path]] = None, since: Optional[float] = None):
+    """Find the most recently modified structure file in the given directories.
+
+    Defaults to the shared workspace root and its outputs subfolder. Files older
+    than `since` (a timestamp) are ignored. Lookups are served from a cached
+    index (see file_index.py) instead of globbing on every call. Concurrent
+    scans of the same directories from several threads share one.
+    """
     ensure_workspace_dirs()
-    structure_extensions = ['*.cif', '*.poscar', '*.extxyz', '*.vasp', '*.xyz', '*.POSCAR', '*.pdb']
-    candidates = []
-    for ext in structure_extensions:
-        candidates.extend(glob.glob(str(WORKSPACE_DIR / ext)))
-        candidates.extend(glob.glob(str(OUTPUTS_DIR / ext)))
-    logger.info(f"Found {len(candidates)} structure files: {[str(c) for c in candidates]}")
-    if not candidates:
+    if search_dirs is None:
+        search_dirs = [WORKSPACE_DIR, OUTPUTS_DIR]
+    latest = get_structure_index(search_dirs).latest(since=since)
+    if latest is None:
         return None
-    # Get the most recent file
-    latest_file = max(candidates, key=os.path.getmtime)
-    logger.info(f"Selected latest: {latest_file}")
-    return Path(latest_file)
+    logger.debug(f"Selected latest: {latest[0]}")
+    return latest[0]
@@ -0,0 +1,199 @@
+"""
+Known-live Agentom sessions.
+
+`/run` used to POST the session to Agentom before every turn in case it did
+not exist yet, which costs a full upstream round trip per chat turn. The
+cache remembers `(user_id, session_id)` pairs that Agentom has accepted
+(from `/create_session` or a first `/run`) for SESSION_CACHE_TTL seconds, so
+later turns go straight to `/run`. When Agentom answers that a session is
+missing (it was restarted, or dropped the session), the entry is invalidated
+and the session is created again.
+
+With a single worker (in-memory state backend) entries are kept in an
+append-only journal under STATE_DIR, so the cache survives middleware
+restarts; the journal is compacted when it is loaded. With a shared state
+backend (several workers) entries are stored there instead, and each worker
+keeps a local copy in front of it. Those calls block: use a thread.
+"""
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Tuple
+
+from .config import SESSION_CACHE_MAX, SESSION_CACHE_TTL, STATE_DIR
+from .state import StateBackend, state
+
+logger = logging.getLogger(__name__)
+
+SessionKey = Tuple[str, str]
+
+
+class SessionCache:
+    def __init__(
+        self,
+        ttl: float = SESSION_CACHE_TTL,
+        max_entries: int = SESSION_CACHE_MAX,
+        path: Optional[Path] = STATE_DIR / "sessions.jsonl",
+        state: StateBackend = state,
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.state = state
+        # Workers share the state backend; a journal per process would be rewritten by each of them
+        self.path = None if state.shared else path
+        self._entries: "OrderedDict[SessionKey, float]" = OrderedDict()  # key -> expiry (epoch seconds)
+        self._lock = threading.Lock()
+        self._journal = None
+        self._journal_lines = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        if self.path is not None and ttl > 0:
+            self._load()
+
+    def _load(self):
+        now = time.time()
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        key = (record["user_id"], record["session_id"])
+                    except (ValueError, KeyError, TypeError):
+                        continue  # torn last line after a crash
+                    if record.get("expires") is None:
+                        self._entries.pop(key, None)
+                    elif record["expires"] > now:
+                        self._entries[key] = record["expires"]
+                        self._entries.move_to_end(key)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Could not read session cache {self.path}: {e}")
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        self._compact()
+        if self._entries:
+            logger.info(f"Loaded {len(self._entries)} known sessions from {self.path}")
+
+    def _compact(self):
+        """Rewrite the journal with only the live entries."""
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(prefix=f".{self.path.name}.", suffix=".tmp", dir=self.path.parent)
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    for (user_id, session_id), expires in self._entries.items():
+                        f.write(json.dumps({"user_id": user_id, "session_id": session_id, "expires": expires}) + "\n")
+                os.replace(tmp, self.path)
+            except BaseException:
+                Path(tmp).unlink(missing_ok=True)
+                raise
+            if self._journal is not None:
+                self._journal.close()
+            self._journal = open(self.path, "a", encoding="utf-8")
+            self._journal_lines = len(self._entries)
+        except OSError as e:
+            logger.warning(f"Session cache is not persisted ({self.path}): {e}")
+            self._journal = None
+
+    def _state_key(self, user_id: str, session_id: str) -> str:
+        return f"session:live:{user_id}/{session_id}"
+
+    def _publish(self, user_id: str, session_id: str, expires: Optional[float]):
+        if expires is None:
+            self.state.delete(self._state_key(user_id, session_id))
+        else:
+            self.state.set(self._state_key(user_id, session_id), repr(expires), ttl=max(1.0, expires - time.time()))
+
+    def _append(self, user_id: str, session_id: str, expires: Optional[float]):
+        if self._journal is None:
+            return
+        try:
+            self._journal.write(json.dumps({"user_id": user_id, "session_id": session_id, "expires": expires}) + "\n")
+            self._journal.flush()
+        except OSError as e:
+            logger.warning(f"Could not write session cache {self.path}: {e}")
+            return
+        self._journal_lines += 1
+        if self._journal_lines > 2 * len(self._entries) + 1000:
+            self._compact()
+
+    def is_live(self, user_id: str, session_id: str) -> bool:
+        """True if Agentom is known to have this session."""
+        key = (user_id, session_id)
+        with self._lock:
+            expires = self._entries.get(key)
+            if expires is not None and expires > time.time():
+                self.hits += 1
+                return True
+            if expires is not None:
+                del self._entries[key]
+        if self.state.shared:
+            # Created through another worker
+            stored = self.state.get(self._state_key(user_id, session_id))
+            if stored is not None and float(stored) > time.time():
+                with self._lock:
+                    self._entries[key] = float(stored)
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+                    self.hits += 1
+                return True
+        with self._lock:
+            self.misses += 1
+        return False
+
+    def mark_live(self, user_id: str, session_id: str):
+        if self.ttl <= 0:
+            return
+        key = (user_id, session_id)
+        expires = time.time() + self.ttl
+        with self._lock:
+            previous = self._entries.get(key)
+            self._entries[key] = expires
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            # Refreshing the journal on every turn is not needed; once per half TTL is enough
+            persist = previous is None or expires - previous > self.ttl / 2
+            if persist and not self.state.shared:
+                self._append(user_id, session_id, expires)
+        if persist and self.state.shared:
+            self._publish(user_id, session_id, expires)
+
+    def invalidate(self, user_id: str, session_id: str):
+        with self._lock:
+            known = self._entries.pop((user_id, session_id), None) is not None
+            if known:
+                self.invalidations += 1
+                if not self.state.shared:
+                    self._append(user_id, session_id, None)
+        if self.state.shared:
+            # Another worker may have stored it even if this one did not know it
+            self._publish(user_id, session_id, None)
+
+    def info(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "path": str(self.path) if self.path is not None else None,
+            }
+
+    def close(self):
+        with self._lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+
+
+session_cache = SessionCache()
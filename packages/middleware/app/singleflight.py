@@ -0,0 +1,134 @@
+"""
+Coalescing of concurrent identical calls ("single flight").
+
+Several browser tabs, or a frontend retrying a slow request, often ask for
+the same thing at the same moment: the same `/get_final_structure` poll, the
+same structure to analyze. `@single_flight(name)` makes concurrent calls
+with the same key share one execution. The first call (the leader) runs the
+function. Calls arriving while it is in flight wait for it and get the same
+result, or the same exception. Nothing is cached: once the leader finishes,
+the next call runs the function again.
+
+The key defaults to the function's arguments, normalized as canonical JSON
+(pydantic models by their fields, dict keys sorted). Pass `key=` to use
+something cheaper or more specific, e.g. a content hash instead of a large
+text.
+
+Coroutine functions run as a separate task, so a waiting caller that is
+cancelled (its client went away) does not cancel the computation the others
+are waiting for. Plain functions coalesce across threads, e.g. calls made
+through `run_in_threadpool`. Either way the flights are per process: calls
+answered by different workers are not shared.
+
+`singleflight_calls_total{name, result}` counts leaders and coalesced calls.
+"""
+import asyncio
+import functools
+import inspect
+import json
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from pydantic import BaseModel
+
+from .metrics import singleflight_calls
+
+# Flights per decorated function, for the in-flight gauge
+_groups: Dict[str, "SingleFlight"] = {}
+
+
+def _normalize(value: Any) -> Any:
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json")
+    return str(value)
+
+
+def request_key(*args, **kwargs) -> str:
+    """Canonical JSON of call arguments."""
+    return json.dumps([args, kwargs], sort_keys=True, separators=(",", ":"), default=_normalize)
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._tasks: Dict[Hashable, asyncio.Future] = {}
+        self._futures: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def inflight(self) -> int:
+        return len(self._tasks) + len(self._futures)
+
+    async def run(self, key: Hashable, fn: Callable, *args, **kwargs):
+        """`await fn(*args, **kwargs)`, shared with concurrent calls for the same key."""
+        task = self._tasks.get(key)
+        if task is None:
+            singleflight_calls.inc(name=self.name, result="leader")
+            task = asyncio.ensure_future(fn(*args, **kwargs))
+            self._tasks[key] = task
+            task.add_done_callback(functools.partial(self._done, key))
+        else:
+            singleflight_calls.inc(name=self.name, result="coalesced")
+        return await asyncio.shield(task)
+
+    def _done(self, key: Hashable, task: asyncio.Future):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        # Every waiter may have been cancelled; mark the exception as retrieved
+        if not task.cancelled():
+            task.exception()
+
+    def run_sync(self, key: Hashable, fn: Callable, *args, **kwargs):
+        """`fn(*args, **kwargs)`, shared with calls for the same key running in other threads."""
+        with self._lock:
+            future = self._futures.get(key)
+            leader = future is None
+            if leader:
+                future = self._futures[key] = Future()
+        if not leader:
+            singleflight_calls.inc(name=self.name, result="coalesced")
+            return future.result()
+        singleflight_calls.inc(name=self.name, result="leader")
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            self._finish(key)
+            future.set_exception(e)
+            raise
+        self._finish(key)
+        future.set_result(result)
+        return result
+
+    def _finish(self, key: Hashable):
+        # Calls arriving from now on start a new flight
+        with self._lock:
+            self._futures.pop(key, None)
+
+
+def single_flight(name: str, key: Optional[Callable[..., Hashable]] = None):
+    """Decorator: concurrent calls with the same key (default: `request_key` of the arguments) share one execution.
+
+    `name` labels the metrics and must be unique per decorated function.
+    """
+    make_key = key or request_key
+
+    def decorate(fn: Callable):
+        group = _groups[name] = SingleFlight(name)
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                return await group.run(make_key(*args, **kwargs), fn, *args, **kwargs)
+        else:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                return group.run_sync(make_key(*args, **kwargs), fn, *args, **kwargs)
+        wrapper.single_flight = group
+        return wrapper
+
+    return decorate
+
+
+def inflight() -> Dict[str, int]:
+    """Calls in flight per decorated function."""
+    return {name: group.inflight for name, group in _groups.items()}
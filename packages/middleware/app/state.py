@@ -0,0 +1,258 @@
+"""
+State shared between middleware worker processes.
+
+Workspace use counts and last-use times, session run ownership,
+`/get_final_structure` cursors and upload handles live in a small key-value
+store instead of module globals, so several uvicorn workers can serve the
+same sessions. STATE_BACKEND selects it:
+
+- `memory` (default): a dict in this process; only correct with one worker;
+- `sqlite`: a SQLite database in WAL mode (STATE_SQLITE_PATH), for workers
+  on one machine;
+- `redis`: a Redis-compatible server (STATE_REDIS_URL), requires the optional
+  `redis` package.
+
+Values are strings. Keys can expire, and leases are keys that only their
+owner may renew or release, which makes them usable as cross-process locks
+that free themselves when a worker dies.
+"""
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from .config import STATE_BACKEND, STATE_REDIS_URL, STATE_SQLITE_PATH
+
+try:
+    import redis
+except ImportError:  # optional dependency
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+# Identifies this process as a lease owner
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+class StateBackend:
+    # True when other processes see the same state
+    shared = False
+    name = "base"
+
+    def get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None):
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    def keys(self, prefix: str) -> List[str]:
+        raise NotImplementedError
+
+    def acquire_lease(self, key: str, owner: str, ttl: Optional[float]) -> bool:
+        """Take `key` for `owner` unless someone else holds it; renews a lease `owner` already holds."""
+        raise NotImplementedError
+
+    def release_lease(self, key: str, owner: str) -> bool:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class MemoryState(StateBackend):
+    name = "memory"
+
+    def __init__(self):
+        self._data: Dict[str, Tuple[str, Optional[float]]] = {}
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def _live(self, key: str, now: float) -> Optional[str]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        if item[1] is not None and item[1] <= now:
+            del self._data[key]
+            return None
+        return item[0]
+
+    def _purge(self, now: float):
+        # Expired keys nobody reads again are dropped every few thousand writes
+        self._writes += 1
+        if self._writes % 4096 == 0:
+            for key in [k for k, (_, expires) in self._data.items() if expires is not None and expires <= now]:
+                del self._data[key]
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            return self._live(key, time.time())
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None):
+        now = time.time()
+        with self._lock:
+            self._data[key] = (value, now + ttl if ttl else None)
+            self._purge(now)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def keys(self, prefix: str) -> List[str]:
+        now = time.time()
+        with self._lock:
+            return [k for k in list(self._data) if k.startswith(prefix) and self._live(k, now) is not None]
+
+    def acquire_lease(self, key: str, owner: str, ttl: Optional[float]) -> bool:
+        now = time.time()
+        with self._lock:
+            holder = self._live(key, now)
+            if holder is not None and holder != owner:
+                return False
+            self._data[key] = (owner, now + ttl if ttl else None)
+            return True
+
+    def release_lease(self, key: str, owner: str) -> bool:
+        with self._lock:
+            if self._live(key, time.time()) != owner:
+                return False
+            del self._data[key]
+            return True
+
+
+class SqliteState(StateBackend):
+    shared = True
+    name = "sqlite"
+
+    def __init__(self, path: Path = STATE_SQLITE_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._writes = 0
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL)")
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per thread; autocommit, each statement is its own transaction
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _purge(self, conn: sqlite3.Connection, now: float):
+        self._writes += 1
+        if self._writes % 1024 == 0:
+            conn.execute("DELETE FROM kv WHERE expires IS NOT NULL AND expires <= ?", (now,))
+
+    def get(self, key: str) -> Optional[str]:
+        row = self._connect().execute(
+            "SELECT value FROM kv WHERE key = ? AND (expires IS NULL OR expires > ?)", (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None):
+        now = time.time()
+        conn = self._connect()
+        conn.execute("INSERT OR REPLACE INTO kv (key, value, expires) VALUES (?, ?, ?)", (key, value, now + ttl if ttl else None))
+        self._purge(conn, now)
+
+    def delete(self, key: str):
+        self._connect().execute("DELETE FROM kv WHERE key = ?", (key,))
+
+    def keys(self, prefix: str) -> List[str]:
+        rows = self._connect().execute(
+            "SELECT key FROM kv WHERE substr(key, 1, ?) = ? AND (expires IS NULL OR expires > ?)",
+            (len(prefix), prefix, time.time()),
+        ).fetchall()
+        return [r[0] for r in rows]
+
+    def acquire_lease(self, key: str, owner: str, ttl: Optional[float]) -> bool:
+        now = time.time()
+        cursor = self._connect().execute(
+            "INSERT INTO kv (key, value, expires) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires = excluded.expires "
+            "WHERE kv.value = excluded.value OR (kv.expires IS NOT NULL AND kv.expires <= ?)",
+            (key, owner, now + ttl if ttl else None, now),
+        )
+        return cursor.rowcount == 1
+
+    def release_lease(self, key: str, owner: str) -> bool:
+        cursor = self._connect().execute("DELETE FROM kv WHERE key = ? AND value = ?", (key, owner))
+        return cursor.rowcount == 1
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+# Compare-and-set scripts, so only the lease owner can renew or release it
+_REDIS_ACQUIRE = """
+local holder = redis.call('GET', KEYS[1])
+if holder and holder ~= ARGV[1] then return 0 end
+if ARGV[2] == '' then redis.call('SET', KEYS[1], ARGV[1]) else redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2]) end
+return 1
+"""
+_REDIS_RELEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end
+return 0
+"""
+
+
+class RedisState(StateBackend):
+    shared = True
+    name = "redis"
+
+    def __init__(self, url: str = STATE_REDIS_URL, namespace: str = "atomclay:"):
+        if redis is None:
+            raise RuntimeError("STATE_BACKEND=redis requires the redis package (pip install redis)")
+        self.namespace = namespace
+        self._client = redis.Redis.from_url(url, decode_responses=True)
+        self._acquire = self._client.register_script(_REDIS_ACQUIRE)
+        self._release = self._client.register_script(_REDIS_RELEASE)
+
+    def get(self, key: str) -> Optional[str]:
+        return self._client.get(self.namespace + key)
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None):
+        self._client.set(self.namespace + key, value, px=int(ttl * 1000) if ttl else None)
+
+    def delete(self, key: str):
+        self._client.delete(self.namespace + key)
+
+    def keys(self, prefix: str) -> List[str]:
+        start = len(self.namespace)
+        return [k[start:] for k in self._client.scan_iter(match=f"{self.namespace}{prefix}*", count=1000)]
+
+    def acquire_lease(self, key: str, owner: str, ttl: Optional[float]) -> bool:
+        return bool(self._acquire(keys=[self.namespace + key], args=[owner, str(int(ttl * 1000)) if ttl else ""]))
+
+    def release_lease(self, key: str, owner: str) -> bool:
+        return bool(self._release(keys=[self.namespace + key], args=[owner]))
+
+    def close(self):
+        self._client.close()
+
+
+def create_state_backend(name: str = STATE_BACKEND) -> StateBackend:
+    if name == "memory":
+        return MemoryState()
+    if name == "sqlite":
+        return SqliteState()
+    if name == "redis":
+        return RedisState()
+    raise ValueError(f"Unknown STATE_BACKEND: {name!r} (expected memory, sqlite or redis)")
+
+
+state = create_state_backend()
@@ -0,0 +1,169 @@
+"""
+LRU cache of parsed structures and their derived results.
+
+Entries are keyed by a SHA-256 of `(format, structure_string)` and hold the
+parsed pymatgen `Structure` plus any results computed from it (analysis,
+parse payload, conversions), so repeated `/materials/*` calls for the same
+text skip both parsing and spglib. The cache is bounded by an estimate of
+the memory each entry holds (STRUCTURE_CACHE_MAX_BYTES).
+
+When materials jobs run in worker processes (see materials_pool.py), every
+worker keeps its own cache of parsed structures, and the main process only
+keeps the derived results through `lookup`/`store`.
+"""
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from .config import STRUCTURE_CACHE_MAX_BYTES
+
+logger = logging.getLogger(__name__)
+
+# Rough in-memory footprint of one pymatgen PeriodicSite
+_BYTES_PER_SITE = 2048
+
+
+def content_key(structure_string: str, fmt: str) -> str:
+    digest = hashlib.sha256()
+    digest.update(fmt.lower().encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(structure_string.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def upload_key(sha256: str, fmt: str) -> str:
+    """Cache key for an uploaded file, from the digest computed while it was stored."""
+    return f"upload:{fmt.lower()}:{sha256}"
+
+
+def _estimate_size(value: Any) -> int:
+    """Approximate payload size: raw length of str/bytes fields, a few bytes per scalar.
+
+    Walks the payload instead of serialising it, so `binary`/`msgpack` results
+    are sized by their byte length and storing stays cheap.
+    """
+    if isinstance(value, (bytes, bytearray, memoryview, str)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(_estimate_size(k) + _estimate_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sum(_estimate_size(item) for item in value)
+    if value is None or isinstance(value, (bool, int, float)):
+        return 8
+    nbytes = getattr(value, "nbytes", None)  # numpy arrays
+    return nbytes if isinstance(nbytes, int) else 1024
+
+
+class CacheEntry:
+    def __init__(self, key: str, structure: Any, text_size: int):
+        self.key = key
+        self.structure = structure
+        self.derived: Dict[Hashable, Any] = {}
+        num_sites = getattr(structure, "num_sites", 0) if structure is not None else 0
+        self.size = text_size + num_sites * _BYTES_PER_SITE
+
+
+class StructureCache:
+    def __init__(self, max_bytes: int = STRUCTURE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self.stats = {"hits": 0, "misses": 0, "derived_hits": 0, "derived_misses": 0, "evictions": 0}
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            _, entry = self._entries.popitem(last=False)
+            self._bytes -= entry.size
+            self.stats["evictions"] += 1
+
+    def _add(self, entry: CacheEntry):
+        self._entries[entry.key] = entry
+        self._bytes += entry.size
+        self._evict()
+
+    def get_entry(self, structure_string: str, fmt: str, loader: Callable[[str, str], Any]) -> CacheEntry:
+        """Return the entry for this text, parsing it with `loader` on a miss."""
+        key = content_key(structure_string, fmt)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return entry
+            self.stats["misses"] += 1
+        structure = loader(structure_string, fmt)
+        entry = CacheEntry(key, structure, len(structure_string))
+        with self._lock:
+            existing = self._entries.get(key)
+            if existing is not None:
+                return existing
+            if self.max_bytes > 0:
+                self._add(entry)
+        return entry
+
+    def derive(self, entry: CacheEntry, name: Hashable, compute: Callable[[Any], Any]) -> Any:
+        """Result of `compute(entry.structure)`, cached on the entry under `name`."""
+        with self._lock:
+            if name in entry.derived:
+                self.stats["derived_hits"] += 1
+                return entry.derived[name]
+            self.stats["derived_misses"] += 1
+        value = compute(entry.structure)
+        size = _estimate_size(value)
+        with self._lock:
+            if name not in entry.derived:
+                entry.derived[name] = value
+                entry.size += size
+                if entry.key in self._entries:
+                    self._bytes += size
+                    self._evict()
+        return value
+
+    def lookup(self, key: str, name: Hashable) -> Optional[Any]:
+        """Derived result by content key, without parsing. None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or name not in entry.derived:
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry.derived[name]
+
+    def store(self, key: str, name: Hashable, value: Any, text_size: int = 0):
+        """Remember a derived result computed elsewhere (e.g. in a worker process)."""
+        if self.max_bytes <= 0:
+            return
+        size = _estimate_size(value)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = CacheEntry(key, None, text_size)
+                self._add(entry)
+            if name not in entry.derived:
+                entry.derived[name] = value
+                entry.size += size
+                self._bytes += size
+                self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def info(self) -> dict:
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hit_rate": self.stats["hits"] / lookups if lookups else None,
+            }
+
+
+structure_cache = StructureCache()
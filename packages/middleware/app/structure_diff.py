@@ -0,0 +1,273 @@
+"""
+Incremental structure updates for `/get_final_structure?diff=true`.
+
+The atoms last sent to each polling client are kept as a baseline, tagged
+with a version string. When the client asks for the next structure and
+names the version it holds, the new structure is matched site by site
+against that baseline, and only the difference is returned:
+
+- `updated`: baseline indices whose position or element changed, with their
+  new element and Cartesian position;
+- `removed`: baseline indices that no longer exist;
+- `added`: new atoms (element and position), appended at the end;
+- `lattice`: the new lattice matrix, or null if unchanged.
+
+Clients apply `updated`, then `removed`, then `added`, in that order. The
+result is the new structure, though atoms may be ordered differently than in
+the file. Later diffs use the client's order.
+
+Matching is vectorized with NumPy in three passes:
+
+1. Same index: sites within STRUCTURE_DIFF_MATCH_RADIUS of their old position.
+   This covers relaxation steps and in-place substitutions.
+2. Exact position and element: covers atoms that shifted index because others
+   were inserted or deleted.
+3. Nearest neighbour among the few sites still unmatched: covers a moved
+   adsorbate.
+
+A difference touching more than STRUCTURE_DIFF_MAX_FRACTION of the atoms,
+an unknown version, or a file format pymatgen cannot read gets the full file
+instead. Baselines live in this worker's memory. A poll answered by another
+worker, or after a restart, gets the full file too.
+"""
+import logging
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+from .config import (
+    STRUCTURE_DIFF_MATCH_RADIUS,
+    STRUCTURE_DIFF_MAX_BYTES,
+    STRUCTURE_DIFF_MAX_FRACTION,
+    STRUCTURE_DIFF_TOLERANCE,
+)
+from .materials_pool import materials_pool
+from .singleflight import single_flight
+from .structure_cache import content_key, structure_cache
+from .structures import compute, derived_name
+
+logger = logging.getLogger(__name__)
+
+# Pass 3 compares every unmatched new site with every unmatched old one; above
+# this many pairs the leftovers are sent as removed + added instead
+_MAX_PAIRS = 1_000_000
+# Grid of fractional coordinates used as exact-position keys in pass 2 (17 bits per axis)
+_GRID = 1 << 17
+
+
+class Snapshot:
+    """Atoms of one structure: element table, per-site element index, Cartesian positions, lattice."""
+
+    def __init__(self, elements: List[str], species: np.ndarray, coords: np.ndarray, lattice: Optional[np.ndarray]):
+        self.elements = elements
+        self.species = species
+        self.coords = coords
+        self.lattice = lattice
+
+    @classmethod
+    def from_columns(cls, columns: Dict[str, Any]) -> "Snapshot":
+        """From a `columnar` parse payload (see structures.parse)."""
+        lattice = columns.get("lattice")
+        return cls(
+            list(columns["elements"]),
+            np.asarray(columns["species"], dtype=np.int64),
+            np.asarray(columns["positions"], dtype=np.float64).reshape(-1, 3),
+            np.asarray(lattice, dtype=np.float64) if lattice is not None else None,
+        )
+
+    @property
+    def nbytes(self) -> int:
+        return self.species.nbytes + self.coords.nbytes + 256
+
+    def __len__(self) -> int:
+        return len(self.species)
+
+
+def _wrap(delta: np.ndarray, lattice: Optional[np.ndarray]) -> np.ndarray:
+    """Minimum-image Cartesian displacements."""
+    if lattice is None:
+        return delta
+    frac = delta @ np.linalg.inv(lattice)
+    frac -= np.round(frac)
+    return frac @ lattice
+
+
+def _site_keys(species: np.ndarray, coords: np.ndarray, lattice: Optional[np.ndarray]) -> np.ndarray:
+    """One int64 per site combining its element and its position snapped to a grid."""
+    if lattice is None:
+        grid = np.round(coords * 1000).astype(np.int64) % _GRID
+    else:
+        grid = np.round((coords @ np.linalg.inv(lattice)) * _GRID).astype(np.int64) % _GRID
+    return ((species * _GRID + grid[:, 0]) * _GRID + grid[:, 1]) * _GRID + grid[:, 2]
+
+
+def diff(
+    old: Snapshot,
+    new: Snapshot,
+    tolerance: float = STRUCTURE_DIFF_TOLERANCE,
+    radius: float = STRUCTURE_DIFF_MATCH_RADIUS,
+    max_fraction: float = STRUCTURE_DIFF_MAX_FRACTION,
+) -> Optional[Tuple[Dict[str, Any], Snapshot]]:
+    """(delta, updated baseline) taking `old` to `new`, or None if the delta is too large to be worth it."""
+    # One element table for both, so element indices compare directly
+    lookup = {element: i for i, element in enumerate(old.elements)}
+    remap = np.array([lookup.setdefault(e, len(lookup)) for e in new.elements], dtype=np.int64)
+    elements = list(lookup)
+    new_species = remap[new.species] if len(new) else new.species
+    lattice = new.lattice
+
+    old_match = np.full(len(old), -1, dtype=np.int64)
+    new_match = np.full(len(new), -1, dtype=np.int64)
+
+    # 1. Same index, close to the old position
+    k = min(len(old), len(new))
+    if k:
+        distance = np.linalg.norm(_wrap(new.coords[:k] - old.coords[:k], lattice), axis=1)
+        same = np.nonzero(distance <= radius)[0]
+        old_match[same] = same
+        new_match[same] = same
+
+    # 2. Exact position and element, wherever the site moved in the list
+    rest_old = np.nonzero(old_match < 0)[0]
+    rest_new = np.nonzero(new_match < 0)[0]
+    if len(rest_old) and len(rest_new):
+        old_keys = _site_keys(old.species[rest_old], old.coords[rest_old], lattice)
+        new_keys = _site_keys(new_species[rest_new], new.coords[rest_new], lattice)
+        _, i, j = np.intersect1d(old_keys, new_keys, assume_unique=False, return_indices=True)
+        old_match[rest_old[i]] = rest_new[j]
+        new_match[rest_new[j]] = rest_old[i]
+        rest_old = np.nonzero(old_match < 0)[0]
+        rest_new = np.nonzero(new_match < 0)[0]
+
+    # 3. Nearest unmatched site of the same element within the radius, closest pairs first
+    if len(rest_old) and len(rest_new) and len(rest_old) * len(rest_new) <= _MAX_PAIRS:
+        delta = new.coords[rest_new][:, None, :] - old.coords[rest_old][None, :, :]
+        distance = np.linalg.norm(_wrap(delta.reshape(-1, 3), lattice), axis=1).reshape(len(rest_new), len(rest_old))
+        distance[new_species[rest_new][:, None] != old.species[rest_old][None, :]] = np.inf
+        pairs = np.argwhere(distance <= radius)
+        pairs = pairs[np.argsort(distance[pairs[:, 0], pairs[:, 1]], kind="stable")]
+        for a, b in pairs.tolist():
+            if new_match[rest_new[a]] < 0 and old_match[rest_old[b]] < 0:
+                new_match[rest_new[a]] = rest_old[b]
+                old_match[rest_old[b]] = rest_new[a]
+
+    matched_old = np.nonzero(old_match >= 0)[0]
+    matched_new = old_match[matched_old]
+    moved = np.linalg.norm(_wrap(new.coords[matched_new] - old.coords[matched_old], lattice), axis=1) > tolerance
+    changed = moved | (new_species[matched_new] != old.species[matched_old])
+    updated_old, updated_new = matched_old[changed], matched_new[changed]
+    removed = np.nonzero(old_match < 0)[0]
+    added = np.nonzero(new_match < 0)[0]
+    lattice_changed = (old.lattice is None) != (lattice is None) or (
+        lattice is not None and not np.allclose(old.lattice, lattice, rtol=0, atol=tolerance)
+    )
+
+    if len(updated_old) + len(removed) + len(added) > max_fraction * max(len(new), 1):
+        return None
+
+    # The client's atoms after applying the delta, in the client's order
+    species = old.species.copy()
+    coords = old.coords.copy()
+    species[updated_old] = new_species[updated_new]
+    coords[updated_old] = new.coords[updated_new]
+    keep = np.ones(len(old), dtype=bool)
+    keep[removed] = False
+    baseline = Snapshot(
+        elements,
+        np.concatenate([species[keep], new_species[added]]),
+        np.concatenate([coords[keep], new.coords[added]]),
+        lattice,
+    )
+    delta = {
+        "numAtoms": len(baseline),
+        "lattice": lattice.tolist() if lattice_changed and lattice is not None else None,
+        "updated": {
+            "indices": updated_old.tolist(),
+            "elements": [elements[i] for i in new_species[updated_new].tolist()],
+            "positions": new.coords[updated_new].tolist(),
+        },
+        "removed": removed.tolist(),
+        "added": {
+            "elements": [elements[i] for i in new_species[added].tolist()],
+            "positions": new.coords[added].tolist(),
+        },
+    }
+    return delta, baseline
+
+
+@single_flight("structure_snapshot", key=lambda key, content, fmt: key)
+async def _parse_columns(key: str, content: str, fmt: str) -> Dict[str, Any]:
+    columns = await materials_pool.run(compute, "parse", content, fmt, "columnar")
+    structure_cache.store(key, derived_name("parse", "columnar"), columns, len(content))
+    return columns
+
+
+async def load_snapshot(content: str, fmt: str) -> Snapshot:
+    """Atoms of a structure text, through the parse cache and the materials workers."""
+    key = content_key(content, fmt)
+    columns = structure_cache.lookup(key, derived_name("parse", "columnar"))
+    if columns is None:
+        columns = await _parse_columns(key, content, fmt)
+    return Snapshot.from_columns(columns)
+
+
+class StructureVersions:
+    """Baseline per client, bounded by STRUCTURE_DIFF_MAX_BYTES (least recently used first out)."""
+
+    def __init__(self, max_bytes: int = STRUCTURE_DIFF_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Hashable, Tuple[str, Snapshot]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"deltas": 0, "full": 0}
+
+    def _put(self, client: Hashable, snapshot: Snapshot) -> str:
+        version = uuid.uuid4().hex[:12]
+        with self._lock:
+            previous = self._entries.pop(client, None)
+            if previous is not None:
+                self._bytes -= previous[1].nbytes
+            if snapshot.nbytes <= self.max_bytes:
+                self._entries[client] = (version, snapshot)
+                self._bytes += snapshot.nbytes
+            while self._bytes > self.max_bytes and self._entries:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+        return version
+
+    def _get(self, client: Hashable, version: Optional[str]) -> Optional[Snapshot]:
+        if not version:
+            return None
+        with self._lock:
+            entry = self._entries.get(client)
+            if entry is None or entry[0] != version:
+                return None
+            self._entries.move_to_end(client)
+            return entry[1]
+
+    def respond(self, client: Hashable, version: Optional[str], snapshot: Snapshot) -> Dict[str, Any]:
+        """`{"version", "baseVersion", "delta"}` against the client's `version`, or `{"version"}` when it needs the full file."""
+        baseline = self._get(client, version)
+        result = diff(baseline, snapshot) if baseline is not None else None
+        if result is None:
+            self.stats["full"] += 1
+            return {"version": self._put(client, snapshot)}
+        delta, updated = result
+        self.stats["deltas"] += 1
+        return {"version": self._put(client, updated), "baseVersion": version, "delta": delta}
+
+    def forget(self, client: Hashable):
+        with self._lock:
+            entry = self._entries.pop(client, None)
+            if entry is not None:
+                self._bytes -= entry[1].nbytes
+
+    def info(self) -> dict:
+        with self._lock:
+            return {"clients": len(self._entries), "bytes": self._bytes, **self.stats}
+
+
+structure_versions = StructureVersions()
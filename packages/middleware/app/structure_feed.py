@@ -0,0 +1,201 @@
+"""
+Fan-out of structure-file changes to push subscribers.
+
+A `StructureFeed` listens to one or more file indexes (a session's own tree,
+plus the shared workspace with the shared fallback) and appends every new or
+changed structure file to a bounded event log with a monotonically increasing
+sequence number. Each subscriber keeps its own cursor into that log, so every
+client sees every change exactly once regardless of how many other clients
+are connected.
+"""
+import asyncio
+import logging
+import threading
+from collections import deque
+from pathlib import Path
+from typing import Dict, Hashable, List, Optional, Tuple
+
+from .config import WORKSPACE_DIR, OUTPUTS_DIR, STRUCTURE_FEED_HISTORY, STRUCTURE_PUSH_MAX_BYTES
+from .file_index import FileIndex, get_structure_index
+from .watcher import workspace_watcher
+
+logger = logging.getLogger(__name__)
+
+
+class StructureEvent:
+    def __init__(self, seq: int, path: Path, mtime: float, size: int, shared: bool = False):
+        self.seq = seq
+        self.path = path
+        self.mtime = mtime
+        self.size = size
+        self.shared = shared
+        self._content: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def payload(self) -> dict:
+        """Event body including the file content (read once and shared by all subscribers)."""
+        content = None
+        truncated = self.size > STRUCTURE_PUSH_MAX_BYTES
+        if not truncated:
+            with self._lock:
+                if self._content is None:
+                    self._content = self.path.read_text(encoding="utf-8")
+                content = self._content
+        return {
+            "seq": self.seq,
+            "fileName": self.path.name,
+            "mtime": self.mtime,
+            "size": self.size,
+            "content": content,
+            "truncated": truncated,
+            "shared": self.shared,
+        }
+
+
+class StructureFeed:
+    def __init__(self, sources: List[Tuple[FileIndex, Optional[float]]], history: int = STRUCTURE_FEED_HISTORY, root: Optional[Path] = None):
+        """`sources` is a list of (index, since); changes older than `since` are ignored.
+
+        Events for files outside `root` (a session's own tree) are tagged `shared`.
+        """
+        self.sources = sources
+        self.root = root
+        self._events: "deque[StructureEvent]" = deque(maxlen=history)
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = []
+        self._listeners = []
+        for index, since in sources:
+            listener = self._make_listener(since)
+            index.add_listener(listener)
+            self._listeners.append((index, listener))
+
+    def _make_listener(self, since: Optional[float]):
+        def listener(path: Path, mtime: float, size: int):
+            if since is None or mtime >= since:
+                self.publish(path, mtime, size)
+        return listener
+
+    def close(self):
+        for index, listener in self._listeners:
+            index.remove_listener(listener)
+        self._listeners = []
+        self._wake_all()
+
+    def publish(self, path: Path, mtime: float, size: int) -> StructureEvent:
+        with self._lock:
+            self._seq += 1
+            shared = self.root is not None and not path.is_relative_to(self.root)
+            event = StructureEvent(self._seq, path, mtime, size, shared)
+            self._events.append(event)
+        self._wake_all()
+        return event
+
+    def _wake_all(self):
+        with self._lock:
+            waiters = list(self._waiters)
+        for loop, waiter in waiters:
+            loop.call_soon_threadsafe(waiter.set)
+
+    @property
+    def seq(self) -> int:
+        return self._seq
+
+    def current(self) -> Optional[StructureEvent]:
+        """Event describing the newest structure right now, publishing one if the feed has none yet."""
+        best = None
+        for index, since in self.sources:
+            latest = index.latest(since=since)
+            if latest is not None and (best is None or latest[1] > best[1]):
+                best = latest
+        if best is None:
+            return None
+        with self._lock:
+            for event in reversed(self._events):
+                if event.path == best[0] and event.mtime == best[1]:
+                    return event
+        return self.publish(best[0], best[1], best[0].stat().st_size)
+
+    def events_after(self, cursor: int) -> Tuple[List[StructureEvent], bool]:
+        """Events with seq > cursor, and whether the cursor fell out of the retained history."""
+        with self._lock:
+            events = [e for e in self._events if e.seq > cursor]
+            missed = bool(self._events) and cursor < self._events[0].seq - 1
+        return events, missed
+
+    def poll_sources(self):
+        """Let the indexes rescan when no watcher is delivering change events."""
+        if not workspace_watcher.available:
+            for index, since in self.sources:
+                index.latest(since=since)
+
+    def subscribe(self) -> "Subscription":
+        subscription = Subscription(self)
+        with self._lock:
+            self._waiters.append((subscription.loop, subscription.event))
+        return subscription
+
+    def _unsubscribe(self, subscription: "Subscription"):
+        with self._lock:
+            self._waiters.remove((subscription.loop, subscription.event))
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._waiters)
+
+
+class Subscription:
+    """One client's registration on a feed. Clear, read events, then `wait` so no publish is missed."""
+
+    def __init__(self, feed: StructureFeed):
+        self.feed = feed
+        self.loop = asyncio.get_running_loop()
+        self.event = asyncio.Event()
+
+    async def wait(self, timeout: float) -> bool:
+        """Wait until something is published (True) or the timeout expires (False)."""
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def close(self):
+        self.feed._unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+_feeds: Dict[Hashable, StructureFeed] = {}
+_feeds_lock = threading.Lock()
+
+
+def get_feed(key: Hashable, sources: List[Tuple[FileIndex, Optional[float]]], root: Optional[Path] = None) -> StructureFeed:
+    with _feeds_lock:
+        feed = _feeds.get(key)
+        if feed is None:
+            feed = _feeds[key] = StructureFeed(sources, root=root)
+        return feed
+
+
+def shared_feed() -> StructureFeed:
+    """Feed for the shared (non-session) workspace."""
+    return get_feed(None, [(get_structure_index([WORKSPACE_DIR, OUTPUTS_DIR]), None)])
+
+
+def total_subscribers() -> int:
+    """Push subscribers across all feeds."""
+    with _feeds_lock:
+        feeds = list(_feeds.values())
+    return sum(feed.subscribers for feed in feeds)
+
+
+def drop_feed(key: Hashable):
+    with _feeds_lock:
+        feed = _feeds.pop(key, None)
+    if feed is not None:
+        feed.close()
@@ -0,0 +1,253 @@
+"""
+Pymatgen helpers shared by the /materials endpoints.
+
+Each function works on plain strings/dicts in and out so the results can be
+cached (see structure_cache.py) and serialized without touching pymatgen
+objects again. `compute` is the picklable entry point that materials_pool.py
+runs in worker processes.
+
+pymatgen (and with it scipy and spglib) is imported on first use, not when
+this module is imported, so the middleware starts without it. `preload`
+imports it ahead of time.
+"""
+import hashlib
+import json
+import os
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .analysis_store import analysis_store
+from .config import ANALYSIS_ANGLE_TOLERANCE, ANALYSIS_SYMPREC
+from .structure_cache import structure_cache
+
+try:
+    import msgpack
+except ImportError:  # optional dependency
+    msgpack = None
+
+if TYPE_CHECKING:
+    from pymatgen.core import Structure
+
+SUPPORTED_TARGET_FORMATS = ("cif", "poscar", "json")
+PARSE_LAYOUTS = ("atoms", "columnar", "binary", "msgpack")
+
+# Layout of the `binary` parse payload, little-endian, no padding
+BINARY_LAYOUT = "lattice:f32[9],positions:f32[3n],species:u16[n]"
+
+
+def format_for_filename(name: str) -> Optional[str]:
+    """Structure format `load_structure` understands for a file name, or None."""
+    lower = os.path.basename(name).lower()
+    if lower.endswith(".gz"):
+        lower = lower[:-3]
+    if lower.endswith(".cif"):
+        return "cif"
+    if lower.endswith(".json"):
+        return "json"
+    if lower.endswith((".vasp", ".poscar")) or lower.startswith(("poscar", "contcar")):
+        return "poscar"
+    return None
+
+
+def preload():
+    """Import the scientific stack now instead of on the first materials request."""
+    import ase.io  # noqa: F401
+    import pymatgen.core  # noqa: F401
+    import pymatgen.symmetry.analyzer  # noqa: F401
+
+
+def load_structure(structure_string: str, fmt: str) -> "Structure":
+    from pymatgen.core import Structure
+
+    fmt = fmt.lower()
+    if fmt == "cif":
+        return Structure.from_str(structure_string, fmt="cif")
+    elif fmt == "poscar":
+        return Structure.from_str(structure_string, fmt="poscar")
+    elif fmt == "json":
+        return Structure.from_dict(json.loads(structure_string))
+    # Fallback to auto-detect if possible or default to CIF
+    return Structure.from_str(structure_string, fmt="cif")
+
+
+def _dataset_value(dataset, key: str):
+    # spglib >= 2.5 returns an object; older versions return a dict
+    if isinstance(dataset, dict):
+        return dataset[key]
+    return getattr(dataset, key)
+
+
+def structure_key(structure: "Structure") -> str:
+    """Hash of a structure independent of file format, formatting and site order.
+
+    Lattice and fractional coordinates are rounded to 1e-5 so that a structure
+    written with fewer digits still maps to the same key.
+    """
+    lattice = np.round(structure.lattice.matrix, 5) + 0.0
+    frac = np.round(np.mod(structure.frac_coords, 1.0), 5) % 1.0 + 0.0
+    names, species = np.unique([site.species_string for site in structure.sites], return_inverse=True)
+    columns = [frac[:, 2], frac[:, 1], frac[:, 0], species]
+    magmoms = structure.site_properties.get("magmom")
+    if magmoms is not None:
+        # spglib takes magnetic moments into account
+        magmoms = np.round(np.asarray(magmoms, dtype=float).reshape(len(structure), -1), 3) + 0.0
+        columns = [*magmoms.T[::-1], *columns]
+    order = np.lexsort(columns)
+    digest = hashlib.sha256()
+    digest.update("\0".join(names).encode("utf-8"))
+    digest.update(lattice.tobytes())
+    digest.update(species[order].astype(np.int64).tobytes())
+    digest.update(frac[order].tobytes())
+    if magmoms is not None:
+        digest.update(magmoms[order].tobytes())
+    return digest.hexdigest()
+
+
+def analyze(structure: "Structure", symprec: float = ANALYSIS_SYMPREC, angle_tolerance: float = ANALYSIS_ANGLE_TOLERANCE) -> Dict[str, Any]:
+    """Symmetry, chemical formula, and other basic properties."""
+    from pymatgen.symmetry.analyzer import SpacegroupAnalyzer
+
+    sga = SpacegroupAnalyzer(structure, symprec=symprec, angle_tolerance=angle_tolerance)
+    symmetry = sga.get_symmetry_dataset()
+    return {
+        "formula": structure.composition.reduced_formula,
+        "num_sites": structure.num_sites,
+        "volume": structure.volume,
+        "density": float(structure.density),
+        "is_ordered": structure.is_ordered,
+        "symmetry": {
+            "symbol": _dataset_value(symmetry, "international"),
+            "number": int(_dataset_value(symmetry, "number")),
+            "hall": _dataset_value(symmetry, "hall"),
+            "symprec": symprec,
+            "angle_tolerance": angle_tolerance,
+        }
+    }
+
+
+def analyze_stored(structure: "Structure", symprec: float = ANALYSIS_SYMPREC, angle_tolerance: float = ANALYSIS_ANGLE_TOLERANCE) -> Dict[str, Any]:
+    """`analyze`, answered from the persistent store when this structure was analyzed before."""
+    key = structure_key(structure)
+    result = analysis_store.get(key, symprec, angle_tolerance)
+    if result is None:
+        result = analyze(structure, symprec, angle_tolerance)
+        analysis_store.put(key, symprec, angle_tolerance, result)
+    return result
+
+
+def site_element(site) -> str:
+    try:
+        return site.specie.symbol
+    except AttributeError:
+        # For disordered structures, take the element with highest occupancy
+        return site.species.most_common(1)[0][0].symbol
+
+
+def _majority_symbol(species) -> str:
+    if len(species) == 1:
+        return next(iter(species)).symbol
+    # Disordered site: take the element with the highest occupancy, like site_element
+    return max(species.items(), key=lambda item: item[1])[0].symbol
+
+
+def symbol_table(symbols) -> Tuple[List[str], np.ndarray]:
+    """Distinct symbols in order of first appearance, and each symbol's index into them."""
+    lookup: Dict[str, int] = {}
+    indices = [lookup.setdefault(symbol, len(lookup)) for symbol in symbols]
+    return list(lookup), np.array(indices, dtype=np.uint16)
+
+
+def species_table(structure: "Structure") -> Tuple[List[str], np.ndarray]:
+    """Element table of a structure and each site's index into it."""
+    return symbol_table(_majority_symbol(site.species) for site in structure.sites)
+
+
+def pack_columns(elements: List[str], species: np.ndarray, coords: np.ndarray, lattice: Optional[np.ndarray], layout: str) -> Dict[str, Any]:
+    """Atom payload in one of PARSE_LAYOUTS; `lattice` may be None for non-periodic data."""
+    if layout == "atoms":
+        return {
+            "atoms": [
+                {"element": elements[i], "x": x, "y": y, "z": z}
+                for i, (x, y, z) in zip(species.tolist(), coords.tolist())
+            ],
+            "lattice": lattice.tolist() if lattice is not None else None
+        }
+    if layout == "columnar":
+        return {
+            "num_atoms": len(species),
+            "elements": elements,
+            "species": species.tolist(),
+            "positions": coords.ravel().tolist(),
+            "lattice": lattice.tolist() if lattice is not None else None
+        }
+    lattice_buf = (lattice if lattice is not None else np.zeros((3, 3))).astype("<f4").tobytes()
+    positions_buf = coords.astype("<f4").tobytes()
+    species_buf = species.astype("<u2").tobytes()
+    if layout == "binary":
+        return {
+            "num_atoms": len(species),
+            "elements": elements,
+            "body": lattice_buf + positions_buf + species_buf,
+        }
+    if layout == "msgpack":
+        if msgpack is None:
+            raise ValueError("The msgpack layout requires the 'msgpack' package")
+        return {
+            "num_atoms": len(species),
+            "elements": elements,
+            "body": msgpack.packb({
+                "num_atoms": len(species),
+                "elements": elements,
+                "lattice": lattice_buf,
+                "positions": positions_buf,
+                "species": species_buf,
+            }),
+        }
+    raise ValueError(f"Unsupported layout: {layout}")
+
+
+def parse(structure: "Structure", layout: str = "atoms") -> Dict[str, Any]:
+    """Atoms and lattice for the visualizer.
+
+    `atoms` is one object per site. `columnar` gives flat `positions`
+    ([x0, y0, z0, x1, ...]) and `species` indices into `elements`. `binary`
+    and `msgpack` hold the same columns as packed float32/uint16 buffers.
+    """
+    elements, species = species_table(structure)
+    return pack_columns(elements, species, structure.cart_coords, structure.lattice.matrix, layout)
+
+
+def convert(structure: "Structure", target_format: str) -> Dict[str, Any]:
+    target_format = target_format.lower()
+    if target_format == "cif":
+        return {"structure_string": structure.to(fmt="cif"), "format": "cif"}
+    elif target_format == "poscar":
+        return {"structure_string": structure.to(fmt="poscar"), "format": "poscar"}
+    elif target_format == "json":
+        return {"structure_string": structure.to_json(), "format": "json"}
+    raise ValueError(f"Unsupported target format: {target_format}")
+
+
+def derived_name(op: str, *args):
+    """Cache key of an operation's result on a structure entry."""
+    return op if not args else (op,) + tuple(args)
+
+
+def compute(op: str, structure_string: str, fmt: str, *args):
+    """Run one materials operation, reusing this process's parsed-structure cache."""
+    operations = {
+        "analyze": analyze_stored,
+        "parse": parse,
+        "convert": convert,
+    }
+    if op not in operations:
+        raise ValueError(f"Unknown materials operation: {op}")
+    entry = structure_cache.get_entry(structure_string, fmt, load_structure)
+    return structure_cache.derive(entry, derived_name(op, *args), lambda s: operations[op](s, *args))
+
+
+def compute_file(op: str, path: str, fmt: str, *args):
+    """`compute` on the contents of a file (e.g. an upload)."""
+    with open(path, "r", encoding="utf-8") as f:
+        return compute(op, f.read(), fmt, *args)
@@ -0,0 +1,203 @@
+"""
+Frame indexes for multi-frame structure files (extxyz/xyz, XDATCAR).
+
+A `FrameIndex` records the byte range of every frame, so single frames or
+strided ranges can be read with one seek each instead of loading the whole
+file. The index is built by scanning line counts only, without parsing any
+coordinates, and is extended incrementally while a running MD job appends
+to the file. A frame that is still being written is not indexed until it is
+complete. Frames are decoded with ase by `read_frames`, which runs in the
+materials worker pool (ase is imported there, on first use).
+"""
+import io
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .config import TRAJECTORY_INDEX_CACHE
+from .structures import pack_columns, symbol_table
+
+logger = logging.getLogger(__name__)
+
+TRAJECTORY_EXTENSIONS = frozenset({".extxyz", ".xyz"})
+TRAJECTORY_LAYOUTS = ("atoms", "columnar")
+
+_ASE_FORMATS = {"extxyz": "extxyz", "xdatcar": "vasp-xdatcar"}
+_SCAN_BLOCK = 1024 * 1024
+
+# (frame start, frame end, header start, header end); the header is only used
+# by XDATCAR, whose frames need the cell/species block that precedes them.
+FrameSpec = Tuple[int, int, int, int]
+
+
+def trajectory_format(name: str) -> Optional[str]:
+    if "XDATCAR" in name.upper():
+        return "xdatcar"
+    if os.path.splitext(name)[1].lower() in TRAJECTORY_EXTENSIONS:
+        return "extxyz"
+    return None
+
+
+def _skip_lines(f, n: int) -> bool:
+    """Advance `f` past `n` newlines. False if the file ends first."""
+    while n > 0:
+        pos = f.tell()
+        block = f.read(_SCAN_BLOCK)
+        if not block:
+            return False
+        count = block.count(b"\n")
+        if count < n:
+            n -= count
+            continue
+        idx = -1
+        for _ in range(n):
+            idx = block.index(b"\n", idx + 1)
+        f.seek(pos + idx + 1)
+        return True
+    return True
+
+
+class FrameIndex:
+    def __init__(self, path: Path, fmt: str):
+        self.path = path
+        self.format = fmt
+        self.frames: List[Tuple[int, int, int]] = []  # (start, end, header number)
+        self.headers: List[Tuple[int, int, int]] = []  # (start, end, atoms per frame)
+        self._scanned = 0
+        self._inode: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.frames)
+
+    def refresh(self) -> int:
+        """Index frames appended since the last call; rescan if the file was replaced. Returns the frame count."""
+        with self._lock:
+            st = self.path.stat()
+            if st.st_ino != self._inode or st.st_size < self._scanned:
+                if self._inode is not None:
+                    logger.info(f"Trajectory {self.path} was replaced; rebuilding its frame index")
+                self.frames, self.headers, self._scanned = [], [], 0
+                self._inode = st.st_ino
+            if st.st_size > self._scanned:
+                with open(self.path, "rb") as f:
+                    f.seek(self._scanned)
+                    if self.format == "xdatcar":
+                        self._scan_xdatcar(f)
+                    else:
+                        self._scan_xyz(f)
+            return len(self.frames)
+
+    def _scan_xyz(self, f):
+        while True:
+            start = f.tell()
+            line = f.readline()
+            if not line.endswith(b"\n"):
+                return
+            if not line.strip():
+                self._scanned = f.tell()
+                continue
+            try:
+                count = int(line)
+            except ValueError:
+                raise ValueError(f"Expected an atom count at byte {start} of {self.path.name}")
+            # comment line plus one line per atom
+            if not _skip_lines(f, count + 1):
+                return
+            self.frames.append((start, f.tell(), -1))
+            self._scanned = f.tell()
+
+    def _scan_xdatcar(self, f):
+        while True:
+            start = f.tell()
+            line = f.readline()
+            if not line.endswith(b"\n"):
+                return
+            if b"configuration" in line:
+                if not self.headers:
+                    raise ValueError(f"Frame before the first header in {self.path.name}")
+                if not _skip_lines(f, self.headers[-1][2]):
+                    return
+                self.frames.append((start, f.tell(), len(self.headers) - 1))
+            elif line.strip():
+                # comment, scale, 3 lattice vectors, element symbols, element counts
+                lines = [f.readline() for _ in range(6)]
+                if not all(l.endswith(b"\n") for l in lines):
+                    return
+                try:
+                    count = sum(int(n) for n in lines[5].split())
+                except ValueError:
+                    raise ValueError(f"Unsupported XDATCAR header at byte {start} of {self.path.name}")
+                self.headers.append((start, f.tell(), count))
+            self._scanned = f.tell()
+
+    def select(self, start: Optional[int] = None, stop: Optional[int] = None, stride: int = 1) -> List[Tuple[int, FrameSpec]]:
+        """(frame number, spec) for `frames[start:stop:stride]`, with Python slice semantics."""
+        specs = []
+        for i in range(*slice(start, stop, stride).indices(len(self.frames))):
+            frame_start, frame_end, header = self.frames[i]
+            header_start, header_end = self.headers[header][:2] if header >= 0 else (0, 0)
+            specs.append((i, (frame_start, frame_end, header_start, header_end)))
+        return specs
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "path": str(self.path),
+            "format": self.format,
+            "frames": len(self.frames),
+            "indexed_bytes": self._scanned,
+        }
+
+
+_indexes: "OrderedDict[str, FrameIndex]" = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def get_frame_index(path: Path) -> FrameIndex:
+    """Shared, up-to-date frame index of a trajectory file."""
+    fmt = trajectory_format(path.name)
+    if fmt is None:
+        raise ValueError(f"Not a trajectory file: {path.name}")
+    key = str(path)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = FrameIndex(path, fmt)
+        _indexes.move_to_end(key)
+        while len(_indexes) > TRAJECTORY_INDEX_CACHE:
+            _indexes.popitem(last=False)
+    index.refresh()
+    return index
+
+
+def _frame_payload(number: int, atoms, layout: str) -> Dict[str, Any]:
+    elements, species = symbol_table(atoms.get_chemical_symbols())
+    lattice = atoms.cell.array if atoms.cell.rank > 0 else None
+    payload = {"frame": number, **pack_columns(elements, species, atoms.get_positions(), lattice, layout)}
+    info = {k: v.item() if isinstance(v, np.generic) else v for k, v in atoms.info.items()
+            if isinstance(v, (bool, int, float, str, np.generic))}
+    if atoms.calc is not None and "energy" in atoms.calc.results:
+        info["energy"] = float(atoms.calc.results["energy"])
+    payload["info"] = info
+    return payload
+
+
+def read_frames(path: str, fmt: str, specs: Sequence[Tuple[int, FrameSpec]], layout: str = "columnar") -> List[Dict[str, Any]]:
+    """Decode the given frames of a trajectory file; runs in a materials worker."""
+    from ase.io import read as ase_read
+
+    payloads = []
+    with open(path, "rb") as f:
+        for number, (start, end, header_start, header_end) in specs:
+            f.seek(header_start)
+            text = f.read(header_end - header_start)
+            f.seek(start)
+            text += f.read(end - start)
+            atoms = ase_read(io.StringIO(text.decode("utf-8", errors="replace")), format=_ASE_FORMATS[fmt])
+            payloads.append(_frame_payload(number, atoms, layout))
+    return payloads
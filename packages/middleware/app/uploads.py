@@ -0,0 +1,310 @@
+"""
+Streaming structure uploads.
+
+Uploaded files are written chunk by chunk into an inputs directory (a
+session's, or the shared one), optionally gunzipped on the way, and
+registered under a short handle. `/run` and the `/materials/*` endpoints
+accept the handle instead of the file content, so large CIF/extxyz files
+never travel through JSON bodies. A handle stops resolving once the file it
+points to is changed or removed. With a shared state backend, handles are
+also published there, so any worker can resolve them.
+
+Multipart bodies (`POST /uploads`) are parsed as they arrive as well
+(`multipart_file`), instead of letting Starlette spool them to disk first.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import AsyncIterator, List, Optional, Tuple
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart before 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+from .config import UPLOAD_HANDLE_HISTORY, UPLOAD_MAX_BYTES
+from .state import StateBackend, state
+from .structures import format_for_filename
+
+logger = logging.getLogger(__name__)
+
+# Bytes collected before handing a write to a worker thread
+_WRITE_BUFFER = 1024 * 1024
+# Lifetime of handles published to a shared state backend
+_SHARED_HANDLE_TTL = 7 * 24 * 3600
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class UploadGone(Exception):
+    """The file behind a handle was removed or modified after the upload."""
+
+
+class Upload:
+    def __init__(self, path: Path, size: int, sha256: str, owner: Optional[Tuple[str, str]]):
+        self.handle = f"upl_{uuid.uuid4().hex[:16]}"
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+        self.owner = owner
+        self.format = format_for_filename(path.name)
+        self.created_at = time.time()
+        self.mtime_ns = path.stat().st_mtime_ns
+
+    def check(self):
+        """Raise UploadGone if the file is no longer what was uploaded."""
+        try:
+            st = self.path.stat()
+        except FileNotFoundError:
+            raise UploadGone(f"Uploaded file {self.path.name} no longer exists")
+        if st.st_size != self.size or st.st_mtime_ns != self.mtime_ns:
+            raise UploadGone(f"Uploaded file {self.path.name} was modified after the upload")
+
+    def to_dict(self) -> dict:
+        return {
+            "handle": self.handle,
+            "fileName": self.path.name,
+            "path": str(self.path),
+            "format": self.format,
+            "size": self.size,
+            "sha256": self.sha256,
+            "user_id": self.owner[0] if self.owner else None,
+            "session_id": self.owner[1] if self.owner else None,
+            "created_at": self.created_at,
+        }
+
+    def dumps(self) -> str:
+        return json.dumps({**self.to_dict(), "mtime_ns": self.mtime_ns})
+
+    @classmethod
+    def loads(cls, text: str) -> "Upload":
+        data = json.loads(text)
+        upload = cls.__new__(cls)
+        upload.handle = data["handle"]
+        upload.path = Path(data["path"])
+        upload.size = data["size"]
+        upload.sha256 = data["sha256"]
+        upload.owner = (data["user_id"], data["session_id"]) if data["user_id"] else None
+        upload.format = data["format"]
+        upload.created_at = data["created_at"]
+        upload.mtime_ns = data["mtime_ns"]
+        return upload
+
+
+class UploadRegistry:
+    def __init__(self, history: int = UPLOAD_HANDLE_HISTORY, state: StateBackend = state):
+        self.history = history
+        self.state = state
+        self._uploads: "OrderedDict[str, Upload]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember(self, upload: Upload):
+        with self._lock:
+            self._uploads[upload.handle] = upload
+            while len(self._uploads) > self.history:
+                self._uploads.popitem(last=False)
+
+    def register(self, upload: Upload) -> Upload:
+        self._remember(upload)
+        if self.state.shared:
+            self.state.set(f"upload:{upload.handle}", upload.dumps(), ttl=_SHARED_HANDLE_TTL)
+        return upload
+
+    def get(self, handle: str) -> Optional[Upload]:
+        with self._lock:
+            upload = self._uploads.get(handle)
+        if upload is None and self.state.shared:
+            # Uploaded through another worker
+            data = self.state.get(f"upload:{handle}")
+            if data is not None:
+                upload = Upload.loads(data)
+                self._remember(upload)
+        return upload
+
+
+upload_registry = UploadRegistry()
+
+
+def safe_file_name(name: str) -> str:
+    safe = Path(name or "").name
+    if not safe or safe.startswith("."):
+        raise ValueError(f"Invalid file name: {name!r}")
+    return safe
+
+
+class _MultipartFileReader:
+    """Collects the data of one field of a multipart/form-data body, part by part as it is fed."""
+
+    def __init__(self, boundary: bytes, field: str):
+        self.field = field.encode("utf-8")
+        self.file_name: Optional[str] = None  # set once the field's headers are parsed
+        self.finished = False
+        self._data: List[bytes] = []
+        self._in_field = False
+        self._headers = {}
+        self._header_name = b""
+        self._header_value = b""
+        self.parser = MultipartParser(boundary, callbacks={
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        })
+
+    def _on_part_begin(self):
+        self._headers = {}
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._header_name += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._header_name.lower()] = self._header_value
+        self._header_name = self._header_value = b""
+
+    def _on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        self._in_field = self.file_name is None and options.get(b"name") == self.field
+        if self._in_field:
+            self.file_name = options.get(b"filename", b"").decode("utf-8", errors="replace")
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        if self._in_field:
+            self._data.append(bytes(data[start:end]))
+
+    def _on_part_end(self):
+        if self._in_field:
+            self._in_field = False
+            self.finished = True
+
+    def feed(self, chunk: bytes) -> List[bytes]:
+        """Parse `chunk` and return the field data it completed."""
+        self.parser.write(chunk)
+        data, self._data = self._data, []
+        return data
+
+
+async def multipart_file(body: AsyncIterator[bytes], content_type: str, field: str = "file") -> Tuple[str, AsyncIterator[bytes]]:
+    """File name and content of the `field` part of a multipart/form-data body.
+
+    The body is read only until the part's headers are known; the returned
+    iterator reads the rest as it is consumed. Other parts are skipped.
+    Raises ValueError for a malformed body or a missing field.
+    """
+    ctype, params = parse_options_header(content_type)
+    boundary = params.get(b"boundary")
+    if ctype != b"multipart/form-data" or not boundary:
+        raise ValueError("Expected a multipart/form-data body")
+    reader = _MultipartFileReader(boundary, field)
+    body = body.__aiter__()
+    head: List[bytes] = []
+    while reader.file_name is None:
+        try:
+            chunk = await body.__anext__()
+        except StopAsyncIteration:
+            raise ValueError(f"No '{field}' field in the multipart body")
+        head.extend(reader.feed(chunk))
+
+    async def chunks():
+        for data in head:
+            yield data
+        while not reader.finished:
+            try:
+                chunk = await body.__anext__()
+            except StopAsyncIteration:
+                raise ValueError("Truncated multipart body")
+            for data in reader.feed(chunk):
+                yield data
+
+    return reader.file_name, chunks()
+
+
+async def receive_upload(
+    chunks: AsyncIterator[bytes],
+    target_dir: Path,
+    file_name: str,
+    gzipped: bool = False,
+    owner: Optional[Tuple[str, str]] = None,
+    max_bytes: int = UPLOAD_MAX_BYTES,
+) -> Upload:
+    """Write `chunks` to `target_dir/file_name` and register the result.
+
+    The data goes to a hidden temporary file first and is renamed into place
+    when complete, so readers never see a partial file. With `gzipped` the
+    stream is decompressed while writing (a trailing `.gz` is dropped from the
+    name); `max_bytes` applies to the decompressed size.
+    """
+    file_name = safe_file_name(file_name)
+    if gzipped and file_name.lower().endswith(".gz"):
+        file_name = file_name[:-3]
+    target_dir.mkdir(parents=True, exist_ok=True)
+    target = target_dir / file_name
+    partial = target_dir / f".{file_name}.{uuid.uuid4().hex[:8]}.part"
+    digest = hashlib.sha256()
+    inflater = zlib.decompressobj(16 + zlib.MAX_WBITS) if gzipped else None
+    size = 0
+    pending = []
+    pending_bytes = 0
+    try:
+        with open(partial, "wb") as f:
+            async for chunk in chunks:
+                if inflater is not None:
+                    # Cap the output so a small compressed chunk cannot expand without limit
+                    try:
+                        data = inflater.decompress(chunk, max_bytes - size + 1)
+                    except zlib.error as e:
+                        raise ValueError(f"Invalid gzip data: {e}")
+                    if inflater.unconsumed_tail:
+                        raise UploadTooLarge(f"Upload exceeds {max_bytes} bytes")
+                else:
+                    data = chunk
+                size += len(data)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"Upload exceeds {max_bytes} bytes")
+                digest.update(data)
+                pending.append(data)
+                pending_bytes += len(data)
+                if pending_bytes >= _WRITE_BUFFER:
+                    await asyncio.to_thread(f.write, b"".join(pending))
+                    pending, pending_bytes = [], 0
+            if inflater is not None and not inflater.eof:
+                raise ValueError("Truncated gzip stream")
+            await asyncio.to_thread(f.write, b"".join(pending))
+        os.replace(partial, target)
+    except BaseException:
+        partial.unlink(missing_ok=True)
+        raise
+    upload = await asyncio.to_thread(upload_registry.register, Upload(target, size, digest.hexdigest(), owner))
+    logger.info(f"Stored upload {upload.handle} at {target} ({size} bytes)")
+    return upload
+
+
+def place_upload(upload: Upload, inputs_dir: Path, file_name: Optional[str] = None) -> Path:
+    """Make an uploaded file available in `inputs_dir`; hard-links when it lives elsewhere."""
+    upload.check()
+    target = inputs_dir / safe_file_name(file_name or upload.path.name)
+    if target == upload.path:
+        return target
+    inputs_dir.mkdir(parents=True, exist_ok=True)
+    target.unlink(missing_ok=True)
+    try:
+        os.link(upload.path, target)
+    except OSError:
+        shutil.copy2(upload.path, target)
+    return target
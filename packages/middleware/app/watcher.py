@@ -0,0 +1,98 @@
+"""
+Single filesystem watcher for the agent workspace.
+
+One `watchfiles.awatch` task follows WORKSPACE_DIR recursively and hands each
+batch of changes to every registered listener. `watchfiles` is installed with
+`uvicorn[standard]`; when it is missing (or the watch fails) `available` is
+False and listeners fall back to their own periodic rescans.
+"""
+import asyncio
+import logging
+import threading
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+
+from .config import WORKSPACE_DIR, WATCH_DEBOUNCE_MS
+
+try:
+    import watchfiles
+except ImportError:  # optional dependency
+    watchfiles = None
+
+logger = logging.getLogger(__name__)
+
+# (kind, path) where kind is "added", "modified" or "deleted"
+Change = Tuple[str, str]
+Listener = Callable[[List[Change]], None]
+
+
+class WorkspaceWatcher:
+    def __init__(self, root: Path = WORKSPACE_DIR):
+        self.root = root
+        self.available = False
+        self._listeners: List[Listener] = []
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._stop_event: Optional[asyncio.Event] = None
+
+    def subscribe(self, listener: Listener):
+        with self._lock:
+            self._listeners.append(listener)
+
+    def unsubscribe(self, listener: Listener):
+        with self._lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+    def _dispatch(self, changes: List[Change]):
+        with self._lock:
+            listeners = list(self._listeners)
+        for listener in listeners:
+            try:
+                listener(changes)
+            except Exception as e:
+                logger.error(f"Workspace watch listener failed: {e}")
+
+    async def _run(self):
+        kinds = {
+            watchfiles.Change.added: "added",
+            watchfiles.Change.modified: "modified",
+            watchfiles.Change.deleted: "deleted",
+        }
+        try:
+            async for batch in watchfiles.awatch(
+                self.root, watch_filter=None, debounce=WATCH_DEBOUNCE_MS, step=min(50, WATCH_DEBOUNCE_MS),
+                stop_event=self._stop_event,
+            ):
+                self._dispatch([(kinds[change], path) for change, path in batch])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Workspace watcher stopped, falling back to rescans: {e}")
+        finally:
+            self.available = False
+
+    def start(self):
+        if watchfiles is None:
+            logger.info("watchfiles is not installed; workspace indexes will rescan periodically")
+            return
+        if self._task is not None and not self._task.done():
+            return
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.available = True
+        self._stop_event = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            # Let the watch thread notice the stop event and exit cleanly before cancelling
+            self._stop_event.set()
+            try:
+                await asyncio.wait_for(self._task, timeout=2)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                pass
+            self._task = None
+        self.available = False
+
+
+workspace_watcher = WorkspaceWatcher()
@@ -0,0 +1,424 @@
+"""
+Per-session workspaces.
+
+Each `(user_id, session_id)` pair gets its own directory tree under
+`WORKSPACE_DIR/sessions/<user_id>/<session_id>/` with `inputs/`, `outputs/`
+and `tmp/` subfolders. Trees are created lazily on first use, reference
+counted while requests are using them, and evicted (renamed into the
+staging area, then archived by `archive_jobs.archive_queue`) once they have
+been idle for `WORKSPACE_IDLE_TIMEOUT` seconds.
+
+With WORKSPACE_SHARED_FALLBACK (on by default, because Agentom does not use
+the session paths yet) the agent works in the shared workspace: run inputs go
+to the shared `inputs/`, the session also sees structures written to the
+shared tree after it started (tagged `shared` in responses), and the shared
+tree is archived whenever a different session starts a run. With it off, a
+session only sees its own tree.
+
+Use counts and last-use times are mirrored into the shared state backend
+(`app/state.py`), so with several workers a workspace is only evicted when no
+worker is using it. With a shared backend (SQLite, Redis) those writes are
+done by a background publisher thread, never on the event loop or under the
+manager's lock; heartbeat and eviction run in a thread too. One worker holds
+the leader lease and does the idle evictions and startup recovery; the last
+worker to shut down archives what is left.
+"""
+import asyncio
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from .archive_jobs import ArchiveJob, archive_queue, schedule_workspace_cleanup
+from .config import (
+    WORKSPACE_DIR, INPUTS_DIR, OUTPUTS_DIR, TEMP_DIR, SESSIONS_DIR, ARCHIVE_STAGING_DIR, WORKSPACE_IDLE_TIMEOUT, WORKSPACE_EVICTION_INTERVAL,
+    WORKSPACE_SHARED_FALLBACK, SESSION_LEASE_TTL,
+)
+from .file_index import drop_indexes_under, get_structure_index
+from .services import get_final_structure_file, move_tree
+from .state import WORKER_ID, StateBackend, state
+from .structure_feed import StructureFeed, drop_feed, get_feed
+
+logger = logging.getLogger(__name__)
+
+_ID_PATTERN = re.compile(r"^[A-Za-z0-9_.-]{1,128}$")
+
+
+def validate_id(value: str, name: str) -> str:
+    if not value or not _ID_PATTERN.match(value) or value in (".", ".."):
+        raise ValueError(f"Invalid {name}: {value!r}")
+    return value
+
+
+class SessionWorkspace:
+    def __init__(self, user_id: str, session_id: str, root: Path, shared_fallback: bool = WORKSPACE_SHARED_FALLBACK):
+        self.user_id = user_id
+        self.session_id = session_id
+        self.root = root
+        self.inputs_dir = root / "inputs"
+        self.outputs_dir = root / "outputs"
+        self.tmp_dir = root / "tmp"
+        self.created_at = time.time()
+        self.last_used = self.created_at
+        self.refcount = 0
+        self.shared_fallback = shared_fallback
+        # Where the agent reads inputs and writes results
+        self.agent_inputs_dir = INPUTS_DIR if shared_fallback else self.inputs_dir
+        self.agent_outputs_dir = OUTPUTS_DIR if shared_fallback else self.outputs_dir
+        self._materialized = False
+
+    @property
+    def key(self) -> Tuple[str, str]:
+        return (self.user_id, self.session_id)
+
+    @property
+    def name(self) -> str:
+        return f"{self.user_id}/{self.session_id}"
+
+    def ensure_dirs(self):
+        """Create the directory tree on first use (or again after another worker archived it)."""
+        if not self._materialized or not self.root.is_dir():
+            for d in (self.inputs_dir, self.outputs_dir, self.tmp_dir):
+                d.mkdir(parents=True, exist_ok=True)
+            self._materialized = True
+        return self
+
+    def find_latest_structure(self) -> Optional[Path]:
+        """Latest structure in this session's tree (and, with the shared fallback, in the shared workspace)."""
+        candidates = [get_final_structure_file([self.root, self.outputs_dir])]
+        if self.shared_fallback:
+            candidates.append(get_final_structure_file(since=self.created_at))
+        candidates = [c for c in candidates if c is not None]
+        if not candidates:
+            return None
+        return max(candidates, key=os.path.getmtime)
+
+    def is_shared(self, path: Path) -> bool:
+        """Whether a structure found for this session lies outside its own tree."""
+        return not path.is_relative_to(self.root)
+
+    def structure_sources(self):
+        """(index, since) pairs searched for this session's structures."""
+        sources = [(get_structure_index([self.root, self.outputs_dir]), None)]
+        if self.shared_fallback:
+            sources.append((get_structure_index([WORKSPACE_DIR, OUTPUTS_DIR]), self.created_at))
+        return sources
+
+    def structure_feed(self) -> StructureFeed:
+        return get_feed(self.key, self.structure_sources(), root=self.root)
+
+    def agent_state(self) -> dict:
+        """Paths handed to Agentom as session state: this session's tree, or the shared one with the fallback."""
+        if self.shared_fallback:
+            return {
+                "workspace_dir": str(WORKSPACE_DIR),
+                "inputs_dir": str(INPUTS_DIR),
+                "outputs_dir": str(OUTPUTS_DIR),
+                "tmp_dir": str(TEMP_DIR),
+            }
+        return {
+            "workspace_dir": str(self.root),
+            "inputs_dir": str(self.inputs_dir),
+            "outputs_dir": str(self.outputs_dir),
+            "tmp_dir": str(self.tmp_dir),
+        }
+
+
+class WorkspaceManager:
+    def __init__(
+        self,
+        sessions_dir: Path = SESSIONS_DIR,
+        idle_timeout: float = WORKSPACE_IDLE_TIMEOUT,
+        state: StateBackend = state,
+        heartbeat_interval: float = WORKSPACE_EVICTION_INTERVAL,
+    ):
+        self.sessions_dir = sessions_dir
+        self.idle_timeout = idle_timeout
+        self.state = state
+        # Worker registrations and use counts expire when a worker stops renewing them
+        self.worker_ttl = 3 * heartbeat_interval
+        self.leader = False
+        self._workspaces: Dict[Tuple[str, str], SessionWorkspace] = {}
+        self._claims: Dict[str, str] = {}  # session lease key -> owner token
+        self._lock = threading.Lock()
+        # Latest (last_used, refcount) per workspace not yet written to a shared backend
+        self._dirty: Dict[str, Tuple[float, int]] = {}
+        self._dirty_lock = threading.Lock()
+        self._dirty_event = threading.Event()
+        self._publisher: Optional[threading.Thread] = None
+
+    def _used_key(self, name: str) -> str:
+        return f"workspace:used:{name}"
+
+    def _refs_key(self, name: str, worker: str = WORKER_ID) -> str:
+        return f"workspace:refs:{name}:{worker}"
+
+    def _write(self, name: str, last_used: float, refcount: int):
+        self.state.set(self._used_key(name), repr(last_used))
+        if refcount > 0:
+            self.state.set(self._refs_key(name), str(refcount), ttl=self.worker_ttl)
+        else:
+            self.state.delete(self._refs_key(name))
+
+    def _publish(self, ws: SessionWorkspace):
+        """Mirror this worker's use count and the last-use time into the shared state.
+
+        In-memory state is written directly. Shared backends do I/O, so the latest
+        values are handed to the publisher thread, which coalesces bursts.
+        """
+        if not self.state.shared:
+            self._write(ws.name, ws.last_used, ws.refcount)
+            return
+        with self._dirty_lock:
+            self._dirty[ws.name] = (ws.last_used, ws.refcount)
+            if self._publisher is None:
+                self._publisher = threading.Thread(target=self._publish_loop, name="workspace-publisher", daemon=True)
+                self._publisher.start()
+        self._dirty_event.set()
+
+    def _publish_loop(self):
+        while True:
+            self._dirty_event.wait()
+            self._dirty_event.clear()
+            with self._dirty_lock:
+                batch, self._dirty = self._dirty, {}
+            for name, (last_used, refcount) in batch.items():
+                try:
+                    self._write(name, last_used, refcount)
+                except Exception as e:
+                    logger.error(f"Could not publish workspace {name} to the state backend: {e}")
+
+    def _in_use(self, name: str) -> bool:
+        return bool(self.state.keys(f"workspace:refs:{name}:"))
+
+    def _forget(self, name: str):
+        with self._dirty_lock:
+            self._dirty.pop(name, None)
+        self.state.delete(self._used_key(name))
+        for key in self.state.keys(f"workspace:refs:{name}:"):
+            self.state.delete(key)
+
+    def start(self):
+        """Register this worker and try to become the leader."""
+        self.state.set(f"worker:{WORKER_ID}", "1", ttl=self.worker_ttl)
+        self.leader = self.state.acquire_lease("workspace:leader", WORKER_ID, self.worker_ttl)
+        if self.state.shared:
+            logger.info(f"Worker {WORKER_ID} started ({'leader' if self.leader else 'follower'}, state backend {self.state.name})")
+
+    def heartbeat(self):
+        """Renew this worker's registration, leadership, use counts and session leases."""
+        self.state.set(f"worker:{WORKER_ID}", "1", ttl=self.worker_ttl)
+        was_leader = self.leader
+        self.leader = self.state.acquire_lease("workspace:leader", WORKER_ID, self.worker_ttl)
+        if self.leader and not was_leader:
+            logger.info(f"Worker {WORKER_ID} took over as leader")
+        with self._lock:
+            in_use = [ws for ws in self._workspaces.values() if ws.refcount > 0]
+            claims = list(self._claims.items())
+        for ws in in_use:
+            self.state.set(self._refs_key(ws.name), str(ws.refcount), ttl=self.worker_ttl)
+        for key, token in claims:
+            self.state.acquire_lease(key, token, SESSION_LEASE_TTL)
+
+    def get(self, user_id: str, session_id: str) -> SessionWorkspace:
+        """Look up (or register) the workspace for a session. Directories are not created here."""
+        key = (validate_id(user_id, "user_id"), validate_id(session_id, "session_id"))
+        with self._lock:
+            ws = self._workspaces.get(key)
+            if ws is None:
+                ws = SessionWorkspace(user_id, session_id, self.sessions_dir / user_id / session_id)
+                self._workspaces[key] = ws
+                logger.info(f"Registered workspace for session {session_id} (user {user_id})")
+            ws.last_used = time.time()
+            self._publish(ws)
+            return ws
+
+    def acquire(self, user_id: str, session_id: str) -> SessionWorkspace:
+        ws = self.get(user_id, session_id)
+        with self._lock:
+            ws.refcount += 1
+            self._publish(ws)
+        return ws
+
+    def release(self, ws: SessionWorkspace):
+        with self._lock:
+            ws.refcount = max(0, ws.refcount - 1)
+            ws.last_used = time.time()
+            self._publish(ws)
+
+    @contextmanager
+    def lease(self, user_id: str, session_id: str):
+        ws = self.acquire(user_id, session_id)
+        try:
+            yield ws
+        finally:
+            self.release(ws)
+
+    def switch_shared_workspace(self, ws: SessionWorkspace) -> Optional[ArchiveJob]:
+        """Hand the shared workspace to `ws` for a run, archiving what another session left in it.
+
+        Only used with the shared fallback. Blocking (state I/O, renames).
+        """
+        key = "workspace:shared:session"
+        previous = self.state.get(key)
+        if previous == ws.name:
+            return None
+        self.state.set(key, ws.name)
+        logger.info(f"Shared workspace switches from session {previous} to {ws.name}")
+        return schedule_workspace_cleanup()
+
+    def claim_session(self, ws: SessionWorkspace) -> Optional[str]:
+        """Take ownership of a session for one run, across all workers.
+
+        Returns a token for `release_session`, or None while another run holds
+        the session. The claim is renewed by the heartbeat and expires
+        SESSION_LEASE_TTL seconds after its worker stops.
+        """
+        key = f"session:run:{ws.name}"
+        token = f"{WORKER_ID}:{uuid.uuid4().hex[:8]}"
+        if not self.state.acquire_lease(key, token, SESSION_LEASE_TTL):
+            return None
+        with self._lock:
+            self._claims[key] = token
+        return token
+
+    def release_session(self, ws: SessionWorkspace, token: str):
+        key = f"session:run:{ws.name}"
+        with self._lock:
+            if self._claims.get(key) == token:
+                del self._claims[key]
+        self.state.release_lease(key, token)
+
+    def active(self) -> List[SessionWorkspace]:
+        with self._lock:
+            return list(self._workspaces.values())
+
+    def evict_idle(self, now: Optional[float] = None) -> List[SessionWorkspace]:
+        """Drop workspaces that are unused and idle past the timeout; archive them in the background.
+
+        Only the leader archives. Other workers just forget their idle entries.
+        Does state I/O: call it from a thread (see `run_eviction_loop`).
+        """
+        now = time.time() if now is None else now
+        idle = []
+        if self.leader:
+            prefix = self._used_key("")
+            for used_key in self.state.keys(prefix):
+                name = used_key[len(prefix):]
+                used = self.state.get(used_key)
+                if used is None or now - float(used) < self.idle_timeout or self._in_use(name):
+                    continue
+                idle.append(name)
+        evicted = []
+        with self._lock:
+            for name in idle:
+                user_id, session_id = name.split("/", 1)
+                ws = self._workspaces.get((user_id, session_id))
+                if ws is not None and (ws.refcount > 0 or now - ws.last_used < self.idle_timeout):
+                    continue  # picked up again by this worker since the scan
+                self._workspaces.pop((user_id, session_id), None)
+                evicted.append(ws or SessionWorkspace(user_id, session_id, self.sessions_dir / user_id / session_id))
+            forgotten = []
+            for key, ws in list(self._workspaces.items()):
+                if ws.refcount == 0 and now - ws.last_used >= self.idle_timeout:
+                    del self._workspaces[key]
+                    forgotten.append(ws)
+        for ws in forgotten:
+            drop_feed(ws.key)
+            drop_indexes_under(ws.root)
+        for ws in evicted:
+            self._forget(ws.name)
+            logger.info(f"Evicting idle workspace {ws.user_id}/{ws.session_id}")
+            self._schedule_archive(ws)
+        return evicted
+
+    def close(self, user_id: str, session_id: str) -> Optional[ArchiveJob]:
+        """Archive a session's workspace now. Raises RuntimeError while a request (on any worker) still holds it."""
+        key = (validate_id(user_id, "user_id"), validate_id(session_id, "session_id"))
+        name = f"{user_id}/{session_id}"
+        if self._in_use(name):
+            raise RuntimeError(f"Workspace {user_id}/{session_id} is in use")
+        with self._lock:
+            ws = self._workspaces.get(key)
+            if ws is not None and ws.refcount > 0:
+                raise RuntimeError(f"Workspace {user_id}/{session_id} is in use")
+            self._workspaces.pop(key, None)
+        self._forget(name)
+        if ws is None:
+            ws = SessionWorkspace(user_id, session_id, self.sessions_dir / user_id / session_id)
+        return self._schedule_archive(ws)
+
+    def _schedule_archive(self, ws: SessionWorkspace) -> Optional[ArchiveJob]:
+        # Renaming the tree away is O(1), so the same session id can start over
+        # immediately while the old tree is archived behind it.
+        drop_feed(ws.key)
+        drop_indexes_under(ws.root)
+        if not ws.root.exists():
+            return None
+        ARCHIVE_STAGING_DIR.mkdir(parents=True, exist_ok=True)
+        staged = ARCHIVE_STAGING_DIR / f"{ws.user_id}_{ws.session_id}_{uuid.uuid4().hex[:6]}"
+        try:
+            move_tree(ws.root, staged)
+        except Exception as e:
+            logger.error(f"Failed to detach workspace {ws.root}: {e}")
+            return None
+        user_dir = ws.root.parent
+        try:
+            user_dir.rmdir()
+        except OSError:
+            pass
+        return archive_queue.submit(staged / "outputs", label=f"{ws.user_id}_{ws.session_id}", remove=[staged])
+
+    async def run_eviction_loop(self, interval: float = WORKSPACE_EVICTION_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                # State backend I/O and tree renames stay off the event loop
+                await asyncio.to_thread(self.heartbeat)
+                await asyncio.to_thread(self.evict_idle)
+            except Exception as e:
+                logger.error(f"Workspace eviction failed: {e}")
+
+    def shutdown(self) -> bool:
+        """Queue every remaining workspace for archiving, unless other workers are still running.
+
+        Returns True if this was the last worker.
+        """
+        self.state.delete(f"worker:{WORKER_ID}")
+        if self.leader:
+            self.state.release_lease("workspace:leader", WORKER_ID)
+            self.leader = False
+        with self._lock:
+            remaining = list(self._workspaces.values())
+            self._workspaces.clear()
+            claims = list(self._claims.items())
+            self._claims.clear()
+        for key, token in claims:
+            self.state.release_lease(key, token)
+        with self._dirty_lock:
+            pending, self._dirty = self._dirty, {}
+        for name, (last_used, _) in pending.items():
+            self.state.set(self._used_key(name), repr(last_used))
+        for ws in remaining:
+            self.state.delete(self._refs_key(ws.name))
+        if self.state.keys("worker:"):
+            # Other workers keep serving these sessions
+            for ws in remaining:
+                drop_feed(ws.key)
+            return False
+        names = {ws.name for ws in remaining}
+        prefix = self._used_key("")
+        names.update(key[len(prefix):] for key in self.state.keys(prefix))
+        for name in names:
+            self._forget(name)
+            user_id, session_id = name.split("/", 1)
+            self._schedule_archive(SessionWorkspace(user_id, session_id, self.sessions_dir / user_id / session_id))
+        return True
+
+
+workspace_manager = WorkspaceManager()
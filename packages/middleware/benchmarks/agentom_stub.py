@@ -0,0 +1,179 @@
+"""
+Minimal stand-in for the Agentom server used by the middleware benchmarks.
+
+Implements the two upstream endpoints the middleware talks to:
+  POST /apps/{app}/users/{user}/sessions/{session}
+  POST /run                      (streams `chunks` events, as a JSON array or as SSE)
+
+`first_chunk_delay` simulates the model thinking before the first event and
+`chunk_delay` the pace of the following ones.
+
+Every request records the client (host, port) pair, so the number of distinct
+TCP connections opened by the middleware can be read back from `/_stats`,
+together with how many runs completed or were cancelled by the caller.
+`status` and `fail_after` simulate upstream errors (an error status, or a
+connection dropped after that many chunks). With `require_session`, `/run`
+answers 404 for sessions that were not created first, like Agentom does;
+`POST /_sessions/clear` forgets them, as an Agentom restart would.
+
+Run standalone with:
+    python -m benchmarks.agentom_stub --port 8765
+"""
+import argparse
+import asyncio
+import json
+import threading
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+STUB_SETTINGS = {
+    "chunks": 5,
+    "first_chunk_delay": 0.0,
+    "chunk_delay": 0.0,
+    "chunk_size": 256,
+    "status": 200,
+    "fail_after": None,
+    "require_session": False,
+    "sse": False,
+}
+
+_stats = {
+    "requests": 0,
+    "connections": set(),
+    "runs_active": 0,
+    "runs_completed": 0,
+    "runs_cancelled": 0,
+    "session_posts": 0,
+}
+_sessions = set()
+
+
+def _record(request: Request):
+    _stats["requests"] += 1
+    if request.client is not None:
+        _stats["connections"].add((request.client.host, request.client.port))
+
+
+app = FastAPI(title="Agentom stub")
+
+
+@app.post("/apps/{app_name}/users/{user_id}/sessions/{session_id}")
+async def create_session(app_name: str, user_id: str, session_id: str, request: Request):
+    _record(request)
+    _stats["session_posts"] += 1
+    _sessions.add((user_id, session_id))
+    return {"id": session_id, "appName": app_name, "userId": user_id, "state": {}, "events": []}
+
+
+@app.post("/run")
+async def run(request: Request):
+    _record(request)
+    body = await request.json()
+    chunks = int(STUB_SETTINGS["chunks"])
+    first_delay = float(STUB_SETTINGS["first_chunk_delay"])
+    delay = float(STUB_SETTINGS["chunk_delay"])
+    filler = "x" * int(STUB_SETTINGS["chunk_size"])
+    fail_after = STUB_SETTINGS["fail_after"]
+    sse = bool(STUB_SETTINGS["sse"])
+    if int(STUB_SETTINGS["status"]) != 200:
+        return JSONResponse({"detail": "stub failure"}, status_code=int(STUB_SETTINGS["status"]))
+    if STUB_SETTINGS["require_session"] and (body.get("userId"), body.get("sessionId")) not in _sessions:
+        return JSONResponse({"detail": "Session not found"}, status_code=404)
+
+    def frame(i: int, event: dict) -> bytes:
+        if sse:
+            return f"data: {json.dumps(event)}\n\n".encode()
+        return (("," if i else "") + json.dumps(event)).encode()
+
+    async def generate():
+        _stats["runs_active"] += 1
+        try:
+            if not sse:
+                yield b"["
+            for i in range(chunks):
+                if fail_after is not None and i >= fail_after:
+                    raise RuntimeError("stub dropped the stream")
+                pause = first_delay if i == 0 else delay
+                if pause:
+                    await asyncio.sleep(pause)
+                yield frame(i, {"index": i, "sessionId": body.get("sessionId"), "text": filler})
+            if not sse:
+                yield b"]"
+            _stats["runs_completed"] += 1
+        except (asyncio.CancelledError, GeneratorExit):
+            _stats["runs_cancelled"] += 1
+            raise
+        finally:
+            _stats["runs_active"] -= 1
+
+    return StreamingResponse(generate(), media_type="text/event-stream" if sse else "application/json")
+
+
+@app.get("/_stats")
+async def stats():
+    return {**_stats, "connections": len(_stats["connections"])}
+
+
+@app.post("/_stats/reset")
+async def reset_stats():
+    _stats.update(requests=0, connections=set(), runs_completed=0, runs_cancelled=0, session_posts=0)
+    return {"ok": True}
+
+
+@app.post("/_sessions/clear")
+async def clear_sessions():
+    _sessions.clear()
+    return {"ok": True}
+
+
+class StubServer:
+    """Runs the stub in a background thread for the lifetime of a `with` block."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8765, **settings):
+        STUB_SETTINGS.update(settings)
+        config = uvicorn.Config(app, host=host, port=port, log_level="warning", backlog=4096)
+        self.server = uvicorn.Server(config)
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+        self.base_url = f"http://{host}:{port}"
+
+    def __enter__(self):
+        self.thread.start()
+        deadline = time.time() + 10
+        while not self.server.started:
+            if time.time() > deadline:
+                raise RuntimeError("Agentom stub failed to start")
+            time.sleep(0.05)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join(timeout=10)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--chunks", type=int, default=STUB_SETTINGS["chunks"])
+    parser.add_argument("--first-chunk-delay", type=float, default=STUB_SETTINGS["first_chunk_delay"])
+    parser.add_argument("--chunk-delay", type=float, default=STUB_SETTINGS["chunk_delay"])
+    parser.add_argument("--chunk-size", type=int, default=STUB_SETTINGS["chunk_size"])
+    parser.add_argument("--status", type=int, default=STUB_SETTINGS["status"])
+    parser.add_argument("--fail-after", type=int, default=STUB_SETTINGS["fail_after"])
+    parser.add_argument("--require-session", action="store_true")
+    parser.add_argument("--sse", action="store_true", help="stream /run as server-sent events")
+    args = parser.parse_args()
+    STUB_SETTINGS.update(
+        chunks=args.chunks,
+        first_chunk_delay=args.first_chunk_delay,
+        chunk_delay=args.chunk_delay,
+        chunk_size=args.chunk_size,
+        status=args.status,
+        fail_after=args.fail_after,
+        require_session=args.require_session,
+        sse=args.sse,
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
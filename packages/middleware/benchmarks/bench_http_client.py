@@ -0,0 +1,96 @@
+"""
+Compare a fresh `httpx.AsyncClient` per upstream call (the old proxy pattern)
+against the shared pooled client from `app.http_client`.
+
+Each simulated chat turn does what `/run` does upstream: one session POST
+followed by one streamed `/run` request. The script reports per-turn latency
+and the number of TCP connections the Agentom stub saw.
+
+Usage (from packages/middleware):
+    python -m benchmarks.bench_http_client --turns 500 --concurrency 50
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+from app import http_client
+from benchmarks.agentom_stub import StubServer
+
+
+async def _turn(client: httpx.AsyncClient, base_url: str, i: int):
+    session_url = f"{base_url}/apps/agentom/users/u_bench/sessions/s_{i}"
+    await client.post(session_url, json={})
+    async with client.stream("POST", f"{base_url}/run", json={"sessionId": f"s_{i}"}) as response:
+        async for _ in response.aiter_bytes():
+            pass
+
+
+async def _turn_per_request(base_url: str, i: int):
+    # Mirrors the previous implementation: one client for the session POST,
+    # another for the stream.
+    async with httpx.AsyncClient() as client:
+        await client.post(f"{base_url}/apps/agentom/users/u_bench/sessions/s_{i}", json={})
+    async with httpx.AsyncClient() as client:
+        async with client.stream("POST", f"{base_url}/run", json={"sessionId": f"s_{i}"}) as response:
+            async for _ in response.aiter_bytes():
+                pass
+
+
+async def _run_mode(mode: str, base_url: str, turns: int, concurrency: int):
+    async with httpx.AsyncClient() as admin:
+        await admin.post(f"{base_url}/_stats/reset")
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    shared = await http_client.start_client() if mode == "shared" else None
+
+    async def one(i):
+        async with semaphore:
+            start = time.perf_counter()
+            if shared is not None:
+                await _turn(shared, base_url, i)
+            else:
+                await _turn_per_request(base_url, i)
+            latencies.append(time.perf_counter() - start)
+
+    wall = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(turns)))
+    wall = time.perf_counter() - wall
+    if shared is not None:
+        await http_client.close_client()
+
+    async with httpx.AsyncClient() as admin:
+        stats = (await admin.get(f"{base_url}/_stats")).json()
+
+    latencies.sort()
+    return {
+        "mode": mode,
+        "turns/s": turns / wall,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        "connections": stats["connections"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    with StubServer(port=args.port) as stub:
+        results = []
+        for mode in ("per_request", "shared"):
+            results.append(asyncio.run(_run_mode(mode, stub.base_url, args.turns, args.concurrency)))
+
+    print(f"{'mode':<12} {'turns/s':>10} {'p50 ms':>10} {'p99 ms':>10} {'connections':>12}")
+    for r in results:
+        print(f"{r['mode']:<12} {r['turns/s']:>10.1f} {r['p50_ms']:>10.2f} {r['p99_ms']:>10.2f} {r['connections']:>12}")
+
+
+if __name__ == "__main__":
+    main()
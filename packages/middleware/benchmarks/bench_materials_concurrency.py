@@ -0,0 +1,132 @@
+"""
+Latency of light endpoints while /materials jobs are running.
+
+Starts the middleware in a subprocess for each MATERIALS_WORKERS setting,
+keeps `--concurrency` /materials/analyze requests on large structures in
+flight, and meanwhile probes `GET /` every few milliseconds. With jobs on
+the event loop (or in a thread, competing for the GIL) probe latency grows
+with job length; with worker processes it should stay flat.
+
+Every job uses a distinct structure text so the result cache never answers.
+
+Usage (from packages/middleware):
+    python -m benchmarks.bench_materials_concurrency --atoms 2000 --jobs 16 --workers 0 4
+"""
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+
+def make_poscar(atoms: int) -> str:
+    from pymatgen.core import Lattice, Structure
+
+    cell = Structure(Lattice.cubic(5.43), ["Si"] * 2, [[0, 0, 0], [0.25, 0.25, 0.25]])
+    n = max(1, round((atoms / 2) ** (1 / 3)))
+    cell.make_supercell([n, n, n])
+    return cell.to(fmt="poscar")
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _percentile(values, q):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def _wait_ready(client: httpx.AsyncClient, base_url: str, deadline: float = 30.0):
+    start = time.monotonic()
+    while time.monotonic() - start < deadline:
+        try:
+            await client.get(f"{base_url}/")
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.2)
+    raise RuntimeError("middleware did not start")
+
+
+async def _run(base_url: str, poscar: str, jobs: int, concurrency: int, probe_interval: float):
+    async with httpx.AsyncClient(timeout=None) as client:
+        await _wait_ready(client, base_url)
+        # Let every worker warm up so the measured jobs do not include pymatgen imports
+        await asyncio.gather(*(
+            client.post(f"{base_url}/materials/analyze", json={"structure_string": f"warmup {i}\n" + poscar.split("\n", 1)[1]})
+            for i in range(concurrency)
+        ))
+
+        probes = []
+        job_times = []
+        done = asyncio.Event()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def probe():
+            while not done.is_set():
+                start = time.perf_counter()
+                await client.get(f"{base_url}/")
+                probes.append(time.perf_counter() - start)
+                await asyncio.sleep(probe_interval)
+
+        async def job(i):
+            text = f"job {i}\n" + poscar.split("\n", 1)[1]
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post(f"{base_url}/materials/analyze", json={"structure_string": text})
+                response.raise_for_status()
+                job_times.append(time.perf_counter() - start)
+
+        prober = asyncio.create_task(probe())
+        wall = time.perf_counter()
+        await asyncio.gather(*(job(i) for i in range(jobs)))
+        wall = time.perf_counter() - wall
+        done.set()
+        await prober
+    return wall, job_times, probes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--atoms", type=int, default=2000)
+    parser.add_argument("--jobs", type=int, default=16)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--probe-interval", type=float, default=0.01)
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 4], help="MATERIALS_WORKERS values to compare")
+    args = parser.parse_args()
+
+    poscar = make_poscar(args.atoms)
+    print(f"structure: {args.atoms} atoms requested, {len(poscar.splitlines()) - 8} sites")
+    for workers in args.workers:
+        port = _free_port()
+        env = {**os.environ, "MATERIALS_WORKERS": str(workers), "STRUCTURE_CACHE_MAX_BYTES": "0"}
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+            env=env,
+        )
+        try:
+            wall, job_times, probes = asyncio.run(
+                _run(f"http://127.0.0.1:{port}", poscar, args.jobs, args.concurrency, args.probe_interval)
+            )
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+        print(
+            f"MATERIALS_WORKERS={workers}: {args.jobs / wall:.2f} jobs/s, "
+            f"job p50={statistics.median(job_times) * 1000:.0f}ms | "
+            f"probe p50={_percentile(probes, 0.5) * 1000:.1f}ms "
+            f"p99={_percentile(probes, 0.99) * 1000:.1f}ms max={max(probes) * 1000:.1f}ms (n={len(probes)})"
+        )
+
+
+if __name__ == "__main__":
+    main()
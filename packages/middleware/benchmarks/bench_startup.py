@@ -0,0 +1,115 @@
+"""
+Startup time of the middleware.
+
+1. Import time: runs `python -X importtime -c "import app.main"` and reports
+   the slowest modules. It also reports the total per top-level package
+   (fastapi, numpy, app, ...). Times are the median of `--runs` fresh
+   interpreters. Heavy libraries such as pymatgen should not appear, because
+   they are imported lazily.
+2. Time to ready: starts uvicorn against a scratch workspace. It measures
+   how long until `GET /` answers, and then how long the first
+   `/materials/parse` takes (this includes the import in a materials worker
+   unless the warm-up already finished).
+
+Usage (from packages/middleware):
+    python -m benchmarks.bench_startup --runs 5 --top 20
+"""
+import argparse
+import asyncio
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import httpx
+
+from benchmarks.bench_materials_concurrency import _free_port
+from benchmarks.fixtures import make_structure
+from benchmarks.load import _start_middleware
+
+
+def import_times(module: str = "app.main") -> dict:
+    """{module: (self µs, cumulative µs)} of one fresh `import module`."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+async def _time_to_ready(base_url: str, started: float, materials: bool) -> dict:
+    timings = {}
+    async with httpx.AsyncClient(timeout=None) as client:
+        while True:
+            try:
+                await client.get(f"{base_url}/")
+                break
+            except httpx.TransportError:
+                await asyncio.sleep(0.02)
+        timings["ready_s"] = time.perf_counter() - started
+        if materials:
+            start = time.perf_counter()
+            response = await client.post(f"{base_url}/materials/parse", json={"structure_string": make_structure("small")})
+            response.raise_for_status()
+            timings["first_parse_s"] = time.perf_counter() - start
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="app.main")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--no-server", action="store_true", help="only measure imports")
+    parser.add_argument("--no-materials", action="store_true", help="skip the first /materials/parse request")
+    args = parser.parse_args()
+
+    runs = [import_times(args.module) for _ in range(args.runs)]
+    modules = {name: (statistics.median(r[name][0] for r in runs if name in r),
+                      statistics.median(r[name][1] for r in runs if name in r))
+               for name in runs[0]}
+    total = modules[args.module][1]
+    print(f"import {args.module}: {total / 1000:.0f} ms (median of {args.runs})")
+
+    print("\nslowest modules (cumulative, includes their imports):")
+    for name, (_, cumulative) in sorted(modules.items(), key=lambda item: -item[1][1])[:args.top]:
+        print(f"  {cumulative / 1000:8.1f} ms  {name}")
+
+    packages = defaultdict(float)
+    for name, (self_us, _) in modules.items():
+        packages[name.split(".")[0]] += self_us
+    print("\nper package (own import time):")
+    for package, self_us in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {self_us / 1000:8.1f} ms  {package}")
+    heavy = [name for name in ("pymatgen", "ase", "scipy", "spglib") if name in packages]
+    print(f"\nscientific stack imported at startup: {', '.join(heavy) or 'none'}")
+
+    if args.no_server:
+        return
+    scratch = Path(tempfile.mkdtemp(prefix="middleware-startup-"))
+    port = _free_port()
+    started = time.perf_counter()
+    server = _start_middleware(port, "http://127.0.0.1:9", scratch, workers=1)
+    try:
+        timings = asyncio.run(_time_to_ready(f"http://127.0.0.1:{port}", started, not args.no_materials))
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+        shutil.rmtree(scratch, ignore_errors=True)
+    print(f"\nuvicorn start to first response: {timings['ready_s'] * 1000:.0f} ms")
+    if "first_parse_s" in timings:
+        print(f"first /materials/parse after that: {timings['first_parse_s'] * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Synthetic structure fixtures for the benchmarks.
+
+Structures are rock-salt supercells written directly with numpy, so even the
+100k-atom fixtures are generated in well under a second without going
+through pymatgen. Each atom is displaced by a small deterministic amount,
+so symmetry analysis has real work to do, and the same seed always yields
+byte-identical files.
+
+    SIZES["small"]   ->      8 atoms (1x1x1)
+    SIZES["medium"]  ->  1,000 atoms (5x5x5)
+    SIZES["large"]   -> 10,648 atoms (11x11x11)
+    SIZES["huge"]    -> 97,336 atoms (23x23x23)
+
+Usage (from packages/middleware) to write them to a folder:
+    python -m benchmarks.fixtures --out /tmp/fixtures --sizes small medium large huge
+"""
+import argparse
+from pathlib import Path
+from typing import Tuple
+
+import numpy as np
+
+# Supercell repetitions of the 8-atom conventional cell
+SIZES = {"small": 1, "medium": 5, "large": 11, "huge": 23}
+FORMATS = ("poscar", "cif", "extxyz")
+
+_A = 5.64  # NaCl lattice constant in Angstrom
+_BASIS = np.array([
+    [0.0, 0.0, 0.0], [0.0, 0.5, 0.5], [0.5, 0.0, 0.5], [0.5, 0.5, 0.0],  # Na
+    [0.5, 0.0, 0.0], [0.0, 0.5, 0.0], [0.0, 0.0, 0.5], [0.5, 0.5, 0.5],  # Cl
+])
+
+
+def supercell(n: int, jitter: float = 0.01, seed: int = 0) -> Tuple[np.ndarray, np.ndarray, list]:
+    """(lattice 3x3, fractional coordinates Nx3, species) of an n x n x n rock-salt supercell."""
+    shifts = np.stack(np.meshgrid(np.arange(n), np.arange(n), np.arange(n), indexing="ij"), -1).reshape(-1, 1, 3)
+    frac = (shifts + _BASIS[:4]).reshape(-1, 3), (shifts + _BASIS[4:]).reshape(-1, 3)
+    coords = np.concatenate(frac) / n
+    if jitter:
+        coords += np.random.default_rng(seed).normal(scale=jitter / (_A * n), size=coords.shape)
+    species = ["Na"] * len(frac[0]) + ["Cl"] * len(frac[1])
+    return np.eye(3) * _A * n, coords % 1.0, species
+
+
+def _poscar(lattice, coords, species) -> str:
+    counts = {s: species.count(s) for s in dict.fromkeys(species)}
+    lines = [f"NaCl {len(species)} atoms", "1.0"]
+    lines += [" ".join(f"{x:.10f}" for x in row) for row in lattice]
+    lines += [" ".join(counts), " ".join(str(c) for c in counts.values()), "Direct"]
+    body = "\n".join(f"{x:.10f} {y:.10f} {z:.10f}" for x, y, z in coords)
+    return "\n".join(lines) + "\n" + body + "\n"
+
+
+def _cif(lattice, coords, species) -> str:
+    a, b, c = np.linalg.norm(lattice, axis=1)
+    head = (
+        "data_NaCl\n"
+        "_symmetry_space_group_name_H-M 'P 1'\n"
+        f"_cell_length_a {a:.6f}\n_cell_length_b {b:.6f}\n_cell_length_c {c:.6f}\n"
+        "_cell_angle_alpha 90\n_cell_angle_beta 90\n_cell_angle_gamma 90\n"
+        "loop_\n_symmetry_equiv_pos_as_xyz\n 'x, y, z'\n"
+        "loop_\n_atom_site_label\n_atom_site_type_symbol\n_atom_site_fract_x\n_atom_site_fract_y\n_atom_site_fract_z\n"
+    )
+    body = "\n".join(f"{s}{i} {s} {x:.8f} {y:.8f} {z:.8f}" for i, (s, (x, y, z)) in enumerate(zip(species, coords)))
+    return head + body + "\n"
+
+
+def _extxyz_frame(lattice, coords, species, step: int = 0) -> str:
+    cart = coords @ lattice
+    cell = " ".join(f"{x:.6f}" for x in lattice.reshape(-1))
+    head = f'{len(species)}\nLattice="{cell}" Properties=species:S:1:pos:R:3 step={step} pbc="T T T"\n'
+    return head + "\n".join(f"{s} {x:.6f} {y:.6f} {z:.6f}" for s, (x, y, z) in zip(species, cart)) + "\n"
+
+
+def make_structure(size: str, fmt: str = "poscar") -> str:
+    """Text of the `size` fixture in `fmt` (poscar, cif or extxyz)."""
+    lattice, coords, species = supercell(SIZES[size])
+    if fmt == "poscar":
+        return _poscar(lattice, coords, species)
+    if fmt == "cif":
+        return _cif(lattice, coords, species)
+    if fmt == "extxyz":
+        return _extxyz_frame(lattice, coords, species)
+    raise ValueError(f"Unknown fixture format {fmt!r}; expected one of {', '.join(FORMATS)}")
+
+
+def make_trajectory(size: str, frames: int) -> str:
+    """An extxyz trajectory of `frames` slightly different frames."""
+    n = SIZES[size]
+    return "".join(_extxyz_frame(*supercell(n, seed=i), step=i) for i in range(frames))
+
+
+def write_fixtures(out: Path, sizes=tuple(SIZES), formats=FORMATS) -> list:
+    out.mkdir(parents=True, exist_ok=True)
+    written = []
+    suffix = {"poscar": ".vasp", "cif": ".cif", "extxyz": ".extxyz"}
+    for size in sizes:
+        for fmt in formats:
+            path = out / f"nacl_{size}{suffix[fmt]}"
+            path.write_text(make_structure(size, fmt))
+            written.append(path)
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", type=Path, required=True)
+    parser.add_argument("--sizes", nargs="+", default=list(SIZES), choices=list(SIZES))
+    parser.add_argument("--formats", nargs="+", default=list(FORMATS), choices=list(FORMATS))
+    args = parser.parse_args()
+    for path in write_fixtures(args.out, args.sizes, args.formats):
+        print(f"{path} ({path.stat().st_size / 1024:.0f} KiB)")
+
+
+if __name__ == "__main__":
+    main()
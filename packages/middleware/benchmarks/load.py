@@ -0,0 +1,391 @@
+"""
+Load test of the middleware against the Agentom stub.
+
+Starts the stub in this process and the middleware as a uvicorn subprocess
+pointed at a scratch workspace, config.json and state folder (nothing in the
+repo is touched), then runs these scenarios in turn:
+
+  run        concurrent /run streams; time to first byte and full stream
+  poll       clients polling /get_final_structure while a writer keeps
+             producing structures; request latency and delivery delay
+  logs       /logs/stream subscribers while lines are appended to a log
+             file; delivery delay from write to each subscriber
+  materials  /materials/parse and /materials/analyze on the synthetic
+             fixtures (benchmarks/fixtures.py), uncached and cached
+
+Each scenario reports throughput, p50/p99 latencies and the peak resident
+memory of the middleware process tree (including materials workers).
+
+Usage (from packages/middleware):
+    python -m benchmarks.load
+    python -m benchmarks.load --scenarios run logs --concurrency 100 --subscribers 200
+    python -m benchmarks.load --scenarios materials --sizes medium large huge --json results.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+from benchmarks.agentom_stub import StubServer
+from benchmarks.bench_materials_concurrency import _free_port, _percentile, _wait_ready
+from benchmarks.fixtures import SIZES, make_structure
+
+SCENARIOS = ("run", "poll", "logs", "materials")
+
+
+def _ms(values, q) -> float:
+    return round(_percentile(values, q) * 1000, 2)
+
+
+def _process_tree(root: int) -> list:
+    parents = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces; fields resume after its closing parenthesis
+                parents[int(entry)] = int(f.read().rpartition(")")[2].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+    tree, frontier = [root], [root]
+    while frontier:
+        frontier = [pid for pid, ppid in parents.items() if ppid in frontier]
+        tree.extend(frontier)
+    return tree
+
+
+def rss_bytes(root: int) -> int:
+    """Resident memory of `root` and all its descendants, from /proc (Linux only)."""
+    total = 0
+    for pid in _process_tree(root):
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            continue
+    return total
+
+
+class RssSampler:
+    """Samples the middleware's memory in the background while a scenario runs."""
+
+    def __init__(self, pid: int, interval: float = 0.25):
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self._task = None
+
+    async def _sample(self):
+        while True:
+            self.peak = max(self.peak, await asyncio.to_thread(rss_bytes, self.pid))
+            await asyncio.sleep(self.interval)
+
+    async def __aenter__(self):
+        if os.path.isdir("/proc"):
+            self._task = asyncio.create_task(self._sample())
+        return self
+
+    async def __aexit__(self, *exc):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self.peak = max(self.peak, rss_bytes(self.pid))
+
+
+async def scenario_run(client: httpx.AsyncClient, base_url: str, args) -> dict:
+    semaphore = asyncio.Semaphore(args.concurrency)
+    first_bytes, totals, errors = [], [], 0
+
+    async def one(i):
+        nonlocal errors
+        payload = {
+            "userId": "u_load",
+            "sessionId": f"s_{i}",
+            "newMessage": {"role": "user", "parts": [{"text": "hello"}]},
+        }
+        async with semaphore:
+            start = time.perf_counter()
+            first = None
+            try:
+                async with client.stream("POST", f"{base_url}/run", json=payload) as response:
+                    async for _ in response.aiter_raw():
+                        if first is None:
+                            first = time.perf_counter() - start
+                    if response.status_code != 200:
+                        errors += 1
+                        return
+            except httpx.HTTPError:
+                errors += 1
+                return
+            first_bytes.append(first or 0.0)
+            totals.append(time.perf_counter() - start)
+
+    wall = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(args.runs)))
+    wall = time.perf_counter() - wall
+    return {
+        "requests": args.runs,
+        "errors": errors,
+        "throughput": round(len(totals) / wall, 2),
+        "ttfb_p50_ms": _ms(first_bytes, 0.5),
+        "ttfb_p99_ms": _ms(first_bytes, 0.99),
+        "p50_ms": _ms(totals, 0.5),
+        "p99_ms": _ms(totals, 0.99),
+    }
+
+
+async def scenario_poll(client: httpx.AsyncClient, base_url: str, args, outputs: Path) -> dict:
+    structure = make_structure(args.poll_size, "poscar")
+    written = {}
+    stop = asyncio.Event()
+    latencies, delays, errors = [], [], 0
+
+    async def writer():
+        i = 0
+        while not stop.is_set():
+            name = f"load_{i}.vasp"
+            tmp = outputs / f".{name}.tmp"
+            await asyncio.to_thread(tmp.write_text, structure)
+            os.replace(tmp, outputs / name)
+            written[name] = time.time()
+            i += 1
+            await asyncio.sleep(args.write_interval)
+
+    async def poller(n):
+        nonlocal errors
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                response = await client.get(f"{base_url}/get_final_structure", params={"client_id": f"poller_{n}"})
+                response.raise_for_status()
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+            body = response.json()
+            if body and body["fileName"] in written:
+                delays.append(time.time() - written[body["fileName"]])
+            await asyncio.sleep(args.poll_interval)
+
+    tasks = [asyncio.create_task(writer())] + [asyncio.create_task(poller(n)) for n in range(args.pollers)]
+    await asyncio.sleep(args.duration)
+    stop.set()
+    await asyncio.gather(*tasks)
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "throughput": round(len(latencies) / args.duration, 2),
+        "p50_ms": _ms(latencies, 0.5),
+        "p99_ms": _ms(latencies, 0.99),
+        "structures_written": len(written),
+        "structures_delivered": len(delays),
+        "delivery_p50_ms": _ms(delays, 0.5),
+        "delivery_p99_ms": _ms(delays, 0.99),
+    }
+
+
+async def scenario_logs(client: httpx.AsyncClient, base_url: str, args, logs_dir: Path) -> dict:
+    delays, received = [], [0] * args.subscribers
+    connected = 0
+    all_connected = asyncio.Event()
+
+    async def subscriber(n):
+        nonlocal connected
+        async with client.stream("GET", f"{base_url}/logs/stream") as response:
+            connected += 1
+            if connected == args.subscribers:
+                all_connected.set()
+            async for line in response.aiter_lines():
+                if not line.startswith("data: load "):
+                    continue
+                _, _, seq, sent = line.split(" ")
+                delays.append(time.time() - float(sent))
+                received[n] += 1
+                if int(seq) == args.log_lines - 1:
+                    return
+
+    tasks = [asyncio.create_task(subscriber(n)) for n in range(args.subscribers)]
+    await asyncio.wait_for(all_connected.wait(), timeout=30)
+    # Headers are sent before the stream registers with the tailer; give it a moment
+    await asyncio.sleep(0.5)
+
+    wall = time.perf_counter()
+    with open(logs_dir / "load.log", "a") as f:
+        for seq in range(args.log_lines):
+            f.write(f"load {seq} {time.time():.6f}\n")
+            f.flush()
+            await asyncio.sleep(args.log_interval)
+    done, pending = await asyncio.wait(tasks, timeout=30)
+    wall = time.perf_counter() - wall
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    expected = args.subscribers * args.log_lines
+    return {
+        "requests": args.subscribers,
+        "errors": sum(1 for t in done if t.exception() is not None) + len(pending),
+        "throughput": round(sum(received) / wall, 2),
+        "events_delivered": f"{sum(received)}/{expected}",
+        "delivery_p50_ms": _ms(delays, 0.5),
+        "delivery_p99_ms": _ms(delays, 0.99),
+    }
+
+
+def _variant(text: str, fmt: str, i: int) -> str:
+    # A distinct but equivalent text, so the structure cache cannot answer
+    if fmt == "cif":
+        return text.replace("data_NaCl", f"data_NaCl_{i}", 1)
+    return f"variant {i}\n" + text.split("\n", 1)[1]
+
+
+async def scenario_materials(client: httpx.AsyncClient, base_url: str, args) -> dict:
+    # Warm every materials worker up so the first measurement does not include pymatgen imports
+    warmup = make_structure("small", "poscar")
+    await asyncio.gather(*(
+        client.post(f"{base_url}/materials/{endpoint}", json={"structure_string": _variant(warmup, "poscar", -i)})
+        for i in range(1, 9) for endpoint in ("parse", "analyze")
+    ))
+    results = {}
+    for size in args.sizes:
+        for fmt in ("poscar", "cif"):
+            text = make_structure(size, fmt)
+            for endpoint in ("parse", "analyze"):
+                url = f"{base_url}/materials/{endpoint}"
+                uncached, cached = [], []
+                for i in range(args.repeats):
+                    start = time.perf_counter()
+                    response = await client.post(url, json={"structure_string": _variant(text, fmt, i), "format": fmt})
+                    response.raise_for_status()
+                    uncached.append(time.perf_counter() - start)
+                    start = time.perf_counter()
+                    response = await client.post(url, json={"structure_string": _variant(text, fmt, i), "format": fmt})
+                    response.raise_for_status()
+                    cached.append(time.perf_counter() - start)
+                results[f"{endpoint} {size} {fmt} ({SIZES[size] ** 3 * 8} atoms)"] = {
+                    "p50_ms": _ms(uncached, 0.5),
+                    "max_ms": round(max(uncached) * 1000, 2),
+                    "cached_p50_ms": _ms(cached, 0.5),
+                }
+    return results
+
+
+def _start_middleware(port: int, stub_url: str, scratch: Path, workers: int) -> subprocess.Popen:
+    workspace = scratch / "workspace"
+    (workspace / "logs").mkdir(parents=True, exist_ok=True)
+    (workspace / "outputs").mkdir(parents=True, exist_ok=True)
+    config_file = scratch / "config" / "config.json"
+    config_file.parent.mkdir(parents=True, exist_ok=True)
+    config_file.write_text(json.dumps({"OUTPUT_ARCHIVE_DIR": str(scratch / "archive"), "LOG_LEVEL": "WARNING"}))
+    env = {
+        **os.environ,
+        "AGENTOM_BASE_URL": stub_url,
+        "MIDDLEWARE_WORKSPACE_DIR": str(workspace),
+        "MIDDLEWARE_CONFIG_FILE": str(config_file),
+        "MIDDLEWARE_STATE_DIR": str(scratch / "state"),
+    }
+    command = [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"]
+    if workers > 1:
+        env.setdefault("STATE_BACKEND", "sqlite")
+        command += ["--workers", str(workers)]
+    log = open(scratch / "middleware.log", "wb")
+    return subprocess.Popen(command, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def _print(name: str, result: dict, peak_rss: int):
+    if name == "materials":
+        print(f"[materials] peak RSS {peak_rss / 2**20:.0f} MiB")
+        for label, values in result.items():
+            print(f"  {label}: " + ", ".join(f"{k}={v}" for k, v in values.items()))
+        return
+    print(f"[{name}] " + ", ".join(f"{k}={v}" for k, v in result.items()) + f", peak_rss={peak_rss / 2**20:.0f}MiB")
+
+
+async def _main(args, base_url: str, server: subprocess.Popen, scratch: Path) -> dict:
+    report = {}
+    async with httpx.AsyncClient(timeout=None, limits=httpx.Limits(max_connections=None)) as client:
+        await _wait_ready(client, base_url)
+        report["idle_rss_bytes"] = rss_bytes(server.pid) if os.path.isdir("/proc") else None
+        for name in args.scenarios:
+            async with RssSampler(server.pid) as sampler:
+                if name == "run":
+                    result = await scenario_run(client, base_url, args)
+                elif name == "poll":
+                    result = await scenario_poll(client, base_url, args, scratch / "workspace" / "outputs")
+                elif name == "logs":
+                    result = await scenario_logs(client, base_url, args, scratch / "workspace" / "logs")
+                else:
+                    result = await scenario_materials(client, base_url, args)
+            _print(name, result, sampler.peak)
+            report[name] = {"result": result, "peak_rss_bytes": sampler.peak}
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=SCENARIOS)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for the middleware")
+    # run
+    parser.add_argument("--runs", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--chunks", type=int, default=20)
+    parser.add_argument("--first-chunk-delay", type=float, default=0.2)
+    parser.add_argument("--chunk-delay", type=float, default=0.01)
+    parser.add_argument("--sse", action="store_true", help="have the stub stream /run as server-sent events")
+    # poll
+    parser.add_argument("--pollers", type=int, default=20)
+    parser.add_argument("--poll-interval", type=float, default=0.05)
+    parser.add_argument("--write-interval", type=float, default=0.5)
+    parser.add_argument("--poll-size", default="medium", choices=list(SIZES))
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of polling")
+    # logs
+    parser.add_argument("--subscribers", type=int, default=50)
+    parser.add_argument("--log-lines", type=int, default=200)
+    parser.add_argument("--log-interval", type=float, default=0.01)
+    # materials
+    parser.add_argument("--sizes", nargs="+", default=["small", "medium", "large"], choices=list(SIZES))
+    parser.add_argument("--repeats", type=int, default=3)
+
+    parser.add_argument("--json", type=Path, help="also write the results to this file")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch folder (workspace, archive, middleware.log)")
+    args = parser.parse_args()
+
+    scratch = Path(tempfile.mkdtemp(prefix="middleware-load-"))
+    stub_port, port = _free_port(), _free_port()
+    stub = StubServer(
+        port=stub_port,
+        chunks=args.chunks,
+        first_chunk_delay=args.first_chunk_delay,
+        chunk_delay=args.chunk_delay,
+        sse=args.sse,
+    )
+    with stub:
+        server = _start_middleware(port, stub.base_url, scratch, args.workers)
+        try:
+            report = asyncio.run(_main(args, f"http://127.0.0.1:{port}", server, scratch))
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+            if not args.keep:
+                shutil.rmtree(scratch, ignore_errors=True)
+    if args.json:
+        args.json.write_text(json.dumps({"args": {k: str(v) for k, v in vars(args).items()}, **report}, indent=2))
+        print(f"results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
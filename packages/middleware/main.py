@@ -1,5 +1,17 @@
+import os
+
 import uvicorn
-from app.main import app
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=3000)
+    # MIDDLEWARE_WORKERS=0 starts one worker per CPU core
+    workers = int(os.getenv("MIDDLEWARE_WORKERS", "1")) or (os.cpu_count() or 1)
+    if workers > 1:
+        # Workers share sessions, cursors and leases through the state backend (see app/state.py)
+        os.environ.setdefault("STATE_BACKEND", "sqlite")
+        if os.environ["STATE_BACKEND"].lower() == "memory":
+            raise SystemExit("STATE_BACKEND=memory cannot be shared between workers; use sqlite or redis")
+        uvicorn.run("app.main:app", host="0.0.0.0", port=3000, workers=workers)
+    else:
+        from app.main import app
+
+        uvicorn.run(app, host="0.0.0.0", port=3000)
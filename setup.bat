@@ -5,7 +5,7 @@ REM Check if Python is installed
 python --version >nul 2>&1
 if %errorlevel% neq 0 (
     echo Error: Python is not installed or not in your PATH.
-    echo Please install Python 3.8 or higher from https://www.python.org/
+    echo Please install Python 3.9 or higher from https://www.python.org/
     pause
     exit /b 1
 )